@@ -6,6 +6,9 @@ Methods:
     - init_llm: Initialize the LLM model
     - choose_model: Choose the model type
     - simple_request: Simple request to the LLM
+    - stream_request: Streaming request to the LLM
+    - warm_up: Initialize the shared agent at server start
+Note: provider SDKs, the chat model and the embeddings are all created lazily on first use
 https://python.langchain.com/docs/integrations/text_embedding/
 """
 
@@ -19,12 +22,16 @@ def set_proxy():
 
 import os
 import re
+import threading
+
+from tokens import MAX_TOKENS
 file_dir = os.path.dirname(__file__)
     
 # 调试模式下可以控制打印prompt模板和变量
 DEBUG_MODE = False
 
 DEFAULT_MODEL = "qwq:latest-fixed"
+SYSTEM_PROMPT = "You are a helpful AI assistant."
 model_options = {
     "gpt": ["gpt-4o", "gpt-4-1106-preview", "deepseek-chat", "gpt-4o-all", "gpt-4.1"],
     "claude": ["claude-3-7-sonnet-20250219", "claude-3-sonnet-20240229", "claude-3-7-sonnet-latest", "claude-3-5-sonnet-20241022", "claude-3-5-sonnet-20240620"],
@@ -32,14 +39,14 @@ model_options = {
     "llama2": ["llama2:7b", "llama2:70b", "llama2:13b", "llama2-chinese:13b", "qwq:latest-fixed"],
     "baidu": ["baidu"]
 }
+# 所有可以直接使用的模型名
+MODEL_LIST = [model for models in model_options.values() for model in models]
 
 # embedding_model = "openai"
 embedding_model = "default"
 
 def choose_actual_model(model):
-    # get all the models of model options
-    all_models = [model for models in model_options.values() for model in models]
-    if model in all_models:
+    if model in MODEL_LIST:
         return model
     elif model not in model_options:
         print("Invalid model type")
@@ -54,19 +61,36 @@ def choose_actual_model(model):
         exit(1)
     return model_list[model_type]
 
-def create_llm(model, temperature):
+# 进程内共享的 HTTP 连接池，所有 OpenAI 兼容客户端复用 keep-alive 连接
+HTTP_MAX_CONNECTIONS = 100
+HTTP_MAX_KEEPALIVE = 20
+HTTP_KEEPALIVE_EXPIRY = 120
+_http_client = None
+_http_client_lock = threading.Lock()
+
+def get_http_client():
+    global _http_client
+    with _http_client_lock:
+        if _http_client is None:
+            import httpx
+            _http_client = httpx.Client(
+                limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS,
+                                    max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                                    keepalive_expiry=HTTP_KEEPALIVE_EXPIRY),
+                timeout=httpx.Timeout(600, connect=10)
+            )
+        return _http_client
+
+def create_chat_model(model, temperature):
     # 调用选择实际模型的函数
     actual_model = choose_actual_model(model)
 
     # 如果选择的是 Llama2 模型
     if 'llama2' in model or "qwq" in model:
         from langchain_ollama import OllamaLLM
-        from langchain_ollama import OllamaEmbeddings
 
         # 初始化 Llama2 模型
         llm = OllamaLLM(model=actual_model, temperature=temperature)
-        # 初始化嵌入模型
-        embeddings = OllamaEmbeddings(model=actual_model)
 
     # 如果选择的是 GPT 模型或 deepseek-chat 模型
     elif 'gpt' in model or 'deepseek' in model or 'claude' in model:
@@ -78,14 +102,14 @@ def create_llm(model, temperature):
 
         # 初始化默认参数
         base_url = os.getenv("CHAT_MODEL_URL")
-        max_tokens = 8192  # 默认对 OpenAI 模型限制 token
+        max_tokens = MAX_TOKENS  # 默认对 OpenAI 模型限制 token
         api_key_name = "OPENAI_API_KEY"
 
         # 如果是 deepseek-chat 模型，特殊处理
         if actual_model == "deepseek-chat":
             api_key_name = "DEEPSEEK_API_KEY"
             base_url = os.getenv("CHAT_MODEL_URL")
-            max_tokens = 8192  # 设置 deepseek-chat 的最大 token 限制
+            max_tokens = MAX_TOKENS  # 设置 deepseek-chat 的最大 token 限制
         # 从环境变量中获取 API 密钥
         api_key = os.getenv(api_key_name)
         if not api_key:
@@ -98,8 +122,41 @@ def create_llm(model, temperature):
             max_tokens=max_tokens,
             model=actual_model,
             openai_api_key=api_key,
-            openai_api_base=base_url
+            openai_api_base=base_url,
+            http_client=get_http_client(),
+            max_retries=0  # 由 throttle.call_with_retry 统一重试
+        )
+    elif 'gemini' in model:
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        from dotenv import load_dotenv
+
+        load_dotenv(override=True)
+        api_key = os.getenv("GEMINI_API_KEY")
+        if not api_key:
+            print("Error: GEMINI_API_KEY is not set in the .env file or environment variables.")
+            exit(1)
+
+        llm = ChatGoogleGenerativeAI(
+            model=actual_model,
+            temperature=temperature,
+            google_api_key=api_key,
+            max_retries=0  # 由 throttle.call_with_retry 统一重试
         )
+    else:
+        print("Error: Unsupported model type.")
+        exit(1)
+
+    return llm
+
+def create_embeddings(model):
+    actual_model = choose_actual_model(model)
+
+    if 'llama2' in model or "qwq" in model:
+        from langchain_ollama import OllamaEmbeddings
+
+        # 初始化嵌入模型
+        embeddings = OllamaEmbeddings(model=actual_model)
+    elif 'gpt' in model or 'deepseek' in model or 'claude' in model:
         # 初始化嵌入模型
         if embedding_model == "default":
             # BAAI/bge-m3
@@ -115,6 +172,9 @@ def create_llm(model, temperature):
                 model_name=model_name)
         else:
             from langchain_openai import OpenAIEmbeddings
+            from dotenv import load_dotenv
+
+            load_dotenv(override=True)
             model_name = "text-embedding-ada-002"
             embeddings = OpenAIEmbeddings(
                 model=model_name,
@@ -122,44 +182,84 @@ def create_llm(model, temperature):
                 openai_api_base=os.getenv("EMBEDDING_MODEL_URL")
             )
     elif 'gemini' in model:
-        from langchain_google_genai import ChatGoogleGenerativeAI
-        from dotenv import load_dotenv
-
-        load_dotenv(override=True)
-        api_key = os.getenv("GEMINI_API_KEY")
-        if not api_key:
-            print("Error: GEMINI_API_KEY is not set in the .env file or environment variables.")
-            exit(1)
-
-        llm = ChatGoogleGenerativeAI(
-            model=actual_model,
-            temperature=temperature,
-            google_api_key=api_key
-        )
         embeddings = None  # Gemini暂不支持embedding
     else:
         print("Error: Unsupported model type.")
         exit(1)
 
+    return embeddings
+
+def cache_embeddings(embeddings):
+    """用持久化的向量库包装嵌入模型，相同文本只嵌入一次；没有 numpy 时返回原模型"""
+    if embeddings is None:
+        return embeddings
+    try:
+        from embedding_store import EMBEDDING_STORE, CachedEmbeddings
+    except ImportError:
+        return embeddings
+    return CachedEmbeddings(embeddings) if EMBEDDING_STORE else embeddings
+
+def create_llm(model, temperature):
     # 返回语言模型和嵌入模型
-    return llm, embeddings
+    return create_chat_model(model, temperature), create_embeddings(model)
 
 import hashlib
 import json
-import gzip
-import pickle
+import time
+
+from cache_store import get_cache_store
+from telemetry import start_call
+from throttle import LeaderCancelled, SingleFlight, call_with_retry, get_limiter, provider_of
+
+# 进程内正在进行的请求，按缓存键合并
+_in_flight = SingleFlight()
 
 
 class LLMAgent:
-    def __init__(self, model=DEFAULT_MODEL, temperature=0, init=True):
+    def __init__(self, model=DEFAULT_MODEL, temperature=0, init=True, semantic_cache=None):
         self.model = model
         self.temperature = temperature
-        self.llm = None  # 改为实例变量，避免线程间共享
-        self.embeddings = None
+        # None 时由 semantic_cache.SEMANTIC_CACHE 决定（默认关闭，HUST_GEN_PAPER_SEMANTIC_CACHE=1 开启）
+        self.semantic_cache = semantic_cache
+        self._llm = None  # 改为实例变量，避免线程间共享
+        self._embeddings = None
+        # 按系统提示词缓存 prompt 模板和编译好的 prompt | llm | parser 调用链
+        self._prompts = {}
+        self._chains = {}
+        # 分段并行生成时多个线程共用一个agent，初始化只能执行一次
+        self._init_lock = threading.RLock()
         if init:
             self.init_llm()
         pass
 
+    @property
+    def llm(self):
+        """对话模型，第一次使用时才创建"""
+        if self._llm is None:
+            with self._init_lock:
+                if self._llm is None:
+                    self._llm = create_chat_model(self.model, self.temperature)
+        return self._llm
+
+    @llm.setter
+    def llm(self, value):
+        with self._init_lock:
+            self._llm = value
+            self._chains = {}
+
+    @property
+    def embeddings(self):
+        """嵌入模型，第一次使用时才创建；simple_request 不会触发它的加载"""
+        if self._embeddings is None:
+            with self._init_lock:
+                if self._embeddings is None:
+                    self._embeddings = cache_embeddings(create_embeddings(self.model))
+        return self._embeddings
+
+    @embeddings.setter
+    def embeddings(self, value):
+        self._embeddings = value
+
     @staticmethod
     def _generate_cache_key(prompt_path, user_context, input, chat_history, top_k_retrieval, kwargs,
                             return_retrieved_content):
@@ -180,43 +280,42 @@ class LLMAgent:
     @staticmethod
     def _load_from_cache(cache_key):
         """从缓存加载"""
-        cache_dir = os.path.join(file_dir, 'llm_cache')
-        filepath = os.path.join(cache_dir, f"{cache_key}.pkl.gz")
-
-        if os.path.exists(filepath):
-            try:
-                with gzip.open(filepath, 'rb') as f:
-                    return pickle.load(f)
-            except Exception as e:
-                print(f"Error loading cache: {e}, removing invalid file")
-                os.remove(filepath)
+        record = get_cache_store().get(cache_key)
+        if record is not None:
+            return record['response']
         return None
 
     @staticmethod
-    def _save_to_cache(cache_key, data):
+    def _save_to_cache(cache_key, data, prompt=None, model=None, temperature=None):
         """保存到缓存"""
-        cache_dir = os.path.join(file_dir, 'llm_cache')
-        os.makedirs(cache_dir, exist_ok=True)
-        filepath = os.path.join(cache_dir, f"{cache_key}.pkl.gz")
-
-        with gzip.open(filepath, 'wb') as f:
-            pickle.dump(data, f)
+        get_cache_store().put(cache_key, data, prompt=prompt, model=model, temperature=temperature)
 
     @staticmethod
-    def _clean_cache(max_size=1000):
-        """LRU缓存清理"""
-        cache_dir = os.path.join(file_dir, 'llm_cache')
-        files = [os.path.join(cache_dir, f) for f in os.listdir(cache_dir)]
+    def _clean_cache(max_bytes=None):
+        """按字节预算淘汰最久未访问的缓存（平时由后台线程执行）"""
+        return get_cache_store().evict(max_bytes)
 
-        # 按最后访问时间排序
-        files.sort(key=lambda x: os.path.getatime(x))
+    @staticmethod
+    def cache_stats():
+        """两级缓存的命中、未命中和淘汰计数"""
+        return get_cache_store().stats()
 
-        # 删除最旧的超出部分
-        while len(files) > max_size:
-            os.remove(files.pop(0))
+    def _request_cache_key(self, request_prompt, system_prompt=SYSTEM_PROMPT):
+        """请求缓存键：prompt、模型、温度和系统提示词任一变化都不会命中旧结果"""
+        params = {
+            'prompt': request_prompt,
+            'model': self.model,
+            'temperature': self.temperature,
+            'system_prompt': system_prompt
+        }
+        params_str = json.dumps(params, sort_keys=True, ensure_ascii=False).encode('utf-8')
+        return hashlib.md5(params_str).hexdigest()
 
     def init_llm(self):
-        self.llm, self.embeddings = create_llm(self.model, self.temperature)
+        # 只初始化对话模型，嵌入模型在第一次访问 embeddings 时创建
+        with self._init_lock:
+            self._llm = create_chat_model(self.model, self.temperature)
+            self._chains = {}
 
     def choose_model(self, model=None, temperature=0, init=True):
         self.temperature = temperature
@@ -234,6 +333,10 @@ class LLMAgent:
                 exit(1)
         else:
             self.model = model
+        # 模型变了，旧的客户端和调用链不能再用
+        self._llm = None
+        self._embeddings = None
+        self._chains = {}
         if init:
             self.init_llm()
 
@@ -259,43 +362,277 @@ class LLMAgent:
 
         return answer
 
+    def _semantic_cache(self):
+        """开启语义缓存且嵌入模型可用时返回语义缓存，否则返回 None"""
+        if self.semantic_cache is not None and not self.semantic_cache:
+            return None
+        try:
+            # 第一次用到时才导入（需要 numpy），agent 本身保持轻量
+            from embedding_store import embedding_model_name
+            from semantic_cache import SEMANTIC_CACHE, get_semantic_cache
+        except ImportError:
+            return None
+        if self.semantic_cache is None and not SEMANTIC_CACHE:
+            return None
+        embeddings = self.embeddings
+        if embeddings is None:
+            return None
+        return get_semantic_cache(embeddings, name=embedding_model_name(embeddings))
+
+    def _semantic_key(self, request_prompt, system_prompt=SYSTEM_PROMPT):
+        """返回 (参与嵌入的文本, scope)：修改要求放进 scope 精确匹配，只有原始文本按语义相似度匹配"""
+        from prompt_builder import split_requirements
+        text, requirements = split_requirements(request_prompt)
+        return text, json.dumps([self.model, self.temperature, system_prompt, requirements], ensure_ascii=False)
+
+    def _lookup_cache(self, cache_key, request_prompt):
+        """先查精确缓存，未命中时再查语义缓存，返回 (cache_key, response, 命中层级) 或 None"""
+        record, tier = get_cache_store().lookup(cache_key)
+        if record is not None:
+            return cache_key, record['response'], tier
+        semantic_cache = self._semantic_cache()
+        if semantic_cache is None:
+            return None
+        try:
+            match = semantic_cache.lookup(*self._semantic_key(request_prompt))
+        except Exception as e:
+            print(f"Error looking up semantic cache: {e}")
+            return None
+        if match is None:
+            return None
+        matched_key, similarity = match
+        cached = self._load_from_cache(cache_key=matched_key)
+        if cached is None:
+            return None
+        if DEBUG_MODE:
+            print(f"Semantic cache hit: {matched_key} (similarity {similarity:.4f})")
+        return matched_key, cached, 'semantic'
+
+    def _remember(self, cache_key, request_prompt, response):
+        """写入精确缓存，开启语义缓存时同时加入向量索引"""
+        self._save_to_cache(cache_key, response, prompt=request_prompt,
+                            model=self.model, temperature=self.temperature)
+        semantic_cache = self._semantic_cache()
+        if semantic_cache is not None:
+            try:
+                text, scope = self._semantic_key(request_prompt)
+                semantic_cache.add(text, cache_key, scope)
+            except Exception as e:
+                print(f"Error updating semantic cache: {e}")
+
+    def _build_prompt(self, system_prompt=SYSTEM_PROMPT):
+        """获取系统提示词对应的 prompt 模板，同一系统提示词只创建一次"""
+        prompt = self._prompts.get(system_prompt)
+        if prompt is not None:
+            return prompt
+        with self._init_lock:
+            if system_prompt not in self._prompts:
+                from langchain_core.prompts import ChatPromptTemplate
+
+                self._prompts[system_prompt] = ChatPromptTemplate.from_messages([
+                    ("system", system_prompt),
+                    ("user", "{input}")
+                ])
+            return self._prompts[system_prompt]
+
+    def _build_chain(self, system_prompt=SYSTEM_PROMPT):
+        """获取 prompt | llm | parser 调用链，同一系统提示词只编译一次"""
+        chain = self._chains.get(system_prompt)
+        if chain is not None:
+            return chain
+        with self._init_lock:
+            if system_prompt not in self._chains:
+                from langchain_core.output_parsers import StrOutputParser
+
+                output_parser = StrOutputParser()
+                self._chains[system_prompt] = self._build_prompt(system_prompt) | self.llm | output_parser
+            return self._chains[system_prompt]
+
+    @staticmethod
+    def _chunk_text(chunk):
+        """把 llm.stream 输出的片段转成文本，与 StrOutputParser 的结果一致"""
+        if isinstance(chunk, str):
+            return chunk
+        content = getattr(chunk, 'content', chunk)
+        if isinstance(content, list):
+            # 部分模型按内容块返回
+            return "".join(block if isinstance(block, str) else block.get('text', '')
+                           for block in content if isinstance(block, (str, dict)))
+        return content
+
+    def _stream_llm(self, request_prompt, system_prompt=SYSTEM_PROMPT):
+        """
+        直接迭代对话模型的流。关闭 prompt | llm | parser 调用链的流时会先把剩余输出读完，
+        关闭模型自己的流才会立即中止请求，取消和字数上限才真正节省 token
+        """
+        messages = self._build_prompt(system_prompt).invoke({"input": request_prompt})
+        return self.llm.stream(messages)
+
     def simple_request(self, request_prompt, enable_cache=True):
         '''
         Usage: Request the LLM model to generate a response based on the prompt
         :param request_prompt: str, prompt for the LLM model
         :param enable_cache: bool, whether to enable caching
-        :return: str, response from the LLM model
+        :return: (str, str), cache key and response from the LLM model
         '''
-        # 生成缓存键时需要排除不影响结果的控制参数
-        cache_key = hashlib.md5(request_prompt.encode('utf-8')).hexdigest()
-        if enable_cache:
-            # 尝试读取缓存
-            cached = self._load_from_cache(cache_key=cache_key)
-            if cached is not None:
-                return cached
-        # 确保LLM已经初始化
-        if self.llm is None:
-            self.init_llm()
-            
-        from langchain_core.prompts import ChatPromptTemplate
-        from langchain_core.output_parsers import StrOutputParser
-
-        output_parser = StrOutputParser()
+        call = start_call(self.model, self.temperature, "invoke")
+        try:
+            # 生成缓存键时需要排除不影响结果的控制参数
+            cache_key = self._request_cache_key(request_prompt)
+            if enable_cache:
+                # 尝试读取缓存
+                cached = self._lookup_cache(cache_key, request_prompt)
+                if cached is not None:
+                    call.finish(request_prompt, cached[1], cache_tier=cached[2])
+                    return cached[:2]
+
+            # 相同请求正在进行时直接等待它的结果，不重复发起付费请求
+            while True:
+                future, leader = _in_flight.begin(cache_key)
+                if leader:
+                    break
+                wait_start = time.perf_counter()
+                try:
+                    response = future.result()
+                except LeaderCancelled:
+                    # 正在执行的请求被取消（例如流被关闭），由当前调用方重新发起
+                    call.add_wait(time.perf_counter() - wait_start)
+                    continue
+                call.add_wait(time.perf_counter() - wait_start)
+                call.finish(request_prompt, response, cache_tier="coalesced")
+                return cache_key, response
+            try:
+                response = self._generate(cache_key, request_prompt, call)
+            except BaseException as e:
+                _in_flight.finish(cache_key, exception=e)
+                raise
+            _in_flight.finish(cache_key, result=response)
+        except Exception as e:
+            call.finish(request_prompt, error=e)
+            raise
+
+        call.finish(request_prompt, response, cache_tier="miss")
+        return cache_key, response
 
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", "You are a helpful AI assistant."),
-            ("user", "{input}")
-        ])
-        chain = prompt | self.llm | output_parser
+    def _generate(self, cache_key, request_prompt, call=None):
+        """限流并带重试地调用大模型，完成后写缓存"""
+        chain = self._build_chain()
 
-        response = chain.invoke({"input": request_prompt})
+        response = call_with_retry(lambda: chain.invoke({"input": request_prompt}),
+                                   limiter=get_limiter(provider_of(self.model)),
+                                   on_wait=call.add_wait if call is not None else None)
 
         response = self.parse_llm_response(response)
 
         # 在返回结果前保存缓存
-        self._save_to_cache(cache_key, response)
+        self._remember(cache_key, request_prompt, response)
+        return response
 
-        return cache_key, response
-
-agent = LLMAgent(model=DEFAULT_MODEL, init=False)
+    def stream_request(self, request_prompt, enable_cache=True):
+        '''
+        Usage: Stream the response of the LLM model token by token
+        :param request_prompt: str, prompt for the LLM model
+        :param enable_cache: bool, whether to enable caching
+        :return: generator of str, response chunks; the full response is cached once the stream completes
+        '''
+        call = start_call(self.model, self.temperature, "stream")
+        cache_key = self._request_cache_key(request_prompt)
+        if enable_cache:
+            cached = self._lookup_cache(cache_key, request_prompt)
+            if cached is not None:
+                call.mark_first_token()
+                call.finish(request_prompt, cached[1], cache_tier=cached[2])
+                yield cached[1]
+                return
+
+        while True:
+            future, leader = _in_flight.begin(cache_key)
+            if leader:
+                break
+            # 相同请求正在生成，等它完成后一次性返回
+            wait_start = time.perf_counter()
+            try:
+                response = future.result()
+            except LeaderCancelled:
+                # 正在生成的流被关闭，由当前调用方重新发起
+                call.add_wait(time.perf_counter() - wait_start)
+                continue
+            except Exception as e:
+                call.finish(request_prompt, error=e)
+                raise
+            call.add_wait(time.perf_counter() - wait_start)
+            call.mark_first_token()
+            call.finish(request_prompt, response, cache_tier="coalesced")
+            yield response
+            return
+
+        chunks = []
+        iterator = None
+        try:
+            def open_stream():
+                # 只在拿到第一个片段之前重试，已经输出的内容无法撤回
+                stream = self._stream_llm(request_prompt)
+                try:
+                    return stream, next(stream, None)
+                except BaseException:
+                    stream.close()
+                    raise
+
+            iterator, first = call_with_retry(open_stream, limiter=get_limiter(provider_of(self.model)),
+                                              on_wait=call.add_wait)
+            call.mark_first_token()
+            if first is not None:
+                chunks.append(self._chunk_text(first))
+                yield chunks[-1]
+            for chunk in iterator:
+                chunk = self._chunk_text(chunk)
+                chunks.append(chunk)
+                yield chunk
+        except BaseException as e:
+            _in_flight.finish(cache_key, exception=e)
+            call.finish(request_prompt, "".join(chunks), error=e)
+            raise
+        finally:
+            # 流被关闭（取消、超出字数上限、对冲落败）时中止模型请求，不再为剩余输出付费
+            if iterator is not None:
+                iterator.close()
+
+        response = "".join(chunks)
+        # 流结束后才写缓存，中途中断不会留下不完整的结果
+        self._remember(cache_key, request_prompt, response)
+        _in_flight.finish(cache_key, result=response)
+        call.finish(request_prompt, response, cache_tier="miss")
+
+_agents = {}
+_agents_lock = threading.Lock()
+
+
+def get_agent(model=DEFAULT_MODEL, temperature=0):
+    """
+    按 (model, temperature) 复用 LLMAgent 实例，每个实例再按系统提示词缓存调用链。
+    模块只导入一次，这个池在 Streamlit 的所有重跑和会话之间共享。
+    """
+    with _agents_lock:
+        key = (model, temperature)
+        if key not in _agents:
+            _agents[key] = LLMAgent(model=model, temperature=temperature, init=False)
+        return _agents[key]
+
+
+def warm_up(model=DEFAULT_MODEL, temperature=0, embeddings=False):
+    """
+    Usage: Initialize the chat model (and optionally the embeddings) ahead of the first request
+    :param model: str, model to warm up
+    :param temperature: float, temperature of the agent to warm up
+    :param embeddings: bool, whether to also load the embedding model
+    :return: LLMAgent, the warmed-up shared agent
+    """
+    warm_agent = get_agent(model, temperature)
+    warm_agent._build_chain()
+    if embeddings:
+        warm_agent.embeddings
+    return warm_agent
+
+
+agent = get_agent(DEFAULT_MODEL)
 # agent = LLMAgent(model=DEFAULT_MODEL, init=True)
\ No newline at end of file
@@ -3,12 +3,36 @@ from streamlit_js_eval import streamlit_js_eval
 import json
 import hashlib
 import os
+import sys
 import gzip
 import pickle
 import time
+import zlib
+import base64
 from typing import List, Dict
 
 DEBUG = False
+# 设置 HUST_GEN_PAPER_WARM_UP=1 时在服务启动后预先初始化大模型客户端
+WARM_UP = os.getenv("HUST_GEN_PAPER_WARM_UP", "0") == "1"
+
+# localStorage 中每个字段单独一个键：hust_gen_paper_cache:<字段>，列表字段每一项再单独一个键
+LOCAL_CACHE_KEY = "hust_gen_paper_cache"
+LOCAL_CACHE_ITEM_FIELDS = ('references',)
+# 超过该长度的字段压缩后再写入，值以 "z:" 开头；设置 HUST_GEN_PAPER_CACHE_COMPRESS=0 关闭压缩
+LOCAL_CACHE_COMPRESS = os.getenv("HUST_GEN_PAPER_CACHE_COMPRESS", "1") == "1"
+LOCAL_CACHE_COMPRESS_MIN_CHARS = 4096
+# 浏览器端合并写入的延迟（毫秒）
+LOCAL_CACHE_DEBOUNCE_MS = 500
+# 侧边栏调用统计的刷新间隔（秒）
+TELEMETRY_REFRESH = 30
+
+@st.cache_resource
+def start_warm_up():
+    """每个进程只执行一次，后台初始化大模型，不阻塞首次页面加载"""
+    import threading
+    from agent import warm_up
+    threading.Thread(target=warm_up, name="llm-warm-up", daemon=True).start()
+    return True
 
 # 基础函数和工具类
 class AppFramework:
@@ -19,29 +43,177 @@ class AppFramework:
     
     @staticmethod
     def save_to_local_cache(data: Dict):
-        """保存数据到本地缓存"""
+        """保存数据到本地缓存：只记录待写入的数据，本次运行结束时由 flush_local_cache 统一写入"""
+        st.session_state._hust_gen_paper_cache_pending = data
+    
+    @staticmethod
+    def _local_cache_entries(data: Dict) -> Dict[str, str]:
+        """把会话数据拆成 localStorage 键值，值为 JSON 文本"""
+        entries = {}
+        for field, value in data.items():
+            key = f"{LOCAL_CACHE_KEY}:{field}"
+            if field in LOCAL_CACHE_ITEM_FIELDS and isinstance(value, list):
+                entries[key] = json.dumps(len(value))
+                for i, item in enumerate(value):
+                    entries[f"{key}:{i}"] = json.dumps(item, ensure_ascii=False)
+            else:
+                entries[key] = json.dumps(value, ensure_ascii=False)
+        return entries
+    
+    @staticmethod
+    def _encode_local_value(value: str) -> str:
+        if LOCAL_CACHE_COMPRESS and len(value) >= LOCAL_CACHE_COMPRESS_MIN_CHARS:
+            return "z:" + base64.b64encode(zlib.compress(value.encode('utf-8'))).decode('ascii')
+        return value
+    
+    @staticmethod
+    def _decode_local_value(value: str):
+        # JSON 文本不会以 "z:" 开头，可以和压缩值区分
+        if value.startswith("z:"):
+            value = zlib.decompress(base64.b64decode(value[2:])).decode('utf-8')
+        return json.loads(value)
+    
+    @staticmethod
+    def flush_local_cache():
+        """把本次运行中保存过的数据写入 localStorage，只写入内容有变化的键，每次运行最多一个组件"""
+        data = st.session_state.get('_hust_gen_paper_cache_pending')
+        if data is None:
+            return
+        st.session_state._hust_gen_paper_cache_pending = None
+        hashes = st.session_state.setdefault('_hust_gen_paper_cache_hashes', {})
+        
+        from session_store import SESSION_STORE, get_session_store
+        if SESSION_STORE:
+            # 草稿写入服务端，localStorage 只记住会话 id，方便不带 sid 打开页面时找回草稿
+            session_id = AppFramework.get_session_id()
+            get_session_store().save(session_id, data)
+            data = {'session_id': session_id}
+        
+        entries = AppFramework._local_cache_entries(data)
+        updates = {}
+        for key, value in entries.items():
+            digest = hashlib.md5(value.encode('utf-8')).hexdigest()
+            if hashes.get(key) != digest:
+                updates[key] = AppFramework._encode_local_value(value)
+                hashes[key] = digest
+        # 删除不再存在的键（列表变短、旧版整体缓存）
+        for key in [key for key in hashes if key not in entries]:
+            updates[key] = None
+            del hashes[key]
+        if not updates:
+            return
+        
+        if DEBUG:
+            print(f"写入 localStorage: {sorted(updates)}")
+        counter = st.session_state.get('_hust_gen_paper_cache_flushes', 0) + 1
+        st.session_state._hust_gen_paper_cache_flushes = counter
+        # 待写入的数据和定时器挂在主页面上，组件 iframe 被替换时仍会写入；连续修改只在停顿后写一次
         streamlit_js_eval(
-            js_expressions=f"localStorage.setItem('hust_gen_paper_cache', JSON.stringify({json.dumps(data)}))",
-            key=f"save_cache_{hash(json.dumps(data))}"
+            js_expressions=f"""(() => {{
+                let w = window;
+                try {{ if (window.parent.localStorage) w = window.parent; }} catch (e) {{}}
+                w.__hustGenPaperPending = Object.assign(w.__hustGenPaperPending || {{}}, {json.dumps(updates)});
+                if (!w.__hustGenPaperFlush) {{
+                    w.__hustGenPaperFlush = new w.Function(`
+                        const pending = window.__hustGenPaperPending || {{}};
+                        window.__hustGenPaperPending = {{}};
+                        for (const [key, value] of Object.entries(pending)) {{
+                            if (value === null) localStorage.removeItem(key); else localStorage.setItem(key, value);
+                        }}`);
+                    w.addEventListener('beforeunload', w.__hustGenPaperFlush);
+                }}
+                w.clearTimeout(w.__hustGenPaperTimer);
+                w.__hustGenPaperTimer = w.setTimeout(w.__hustGenPaperFlush, {LOCAL_CACHE_DEBOUNCE_MS});
+                return {counter};
+            }})()""",
+            key=f"hust_gen_paper_cache_flush_{counter}"
         )
     
+    @staticmethod
+    def get_session_id(create: bool = True) -> str:
+        """服务端草稿的会话 id，保存在页面地址的 ?sid= 参数中，首次运行即可同步读取"""
+        session_id = st.query_params.get("sid")
+        if not session_id and create:
+            from session_store import new_session_id
+            session_id = new_session_id()
+            st.query_params["sid"] = session_id
+        return session_id
+    
     @staticmethod
     def load_from_local_cache() -> Dict:
-        """从本地缓存加载数据"""
-        cached_data = streamlit_js_eval(
-            js_expressions="JSON.parse(localStorage.getItem('hust_gen_paper_cache') || 'null')",
+        """从本地缓存加载数据；启用服务端草稿存储时按会话 id 同步读取，不需要等待浏览器返回"""
+        from session_store import SESSION_STORE, get_session_store
+        if not SESSION_STORE:
+            return AppFramework._load_browser_cache() or {}
+        
+        session_id = AppFramework.get_session_id(create=False)
+        if session_id:
+            data = get_session_store().load(session_id)
+            if data is not None:
+                return data
+        # 地址中没有 sid 或服务端没有草稿：从 localStorage 取回记住的 sid，或迁移旧的浏览器草稿
+        data = AppFramework._load_browser_cache() or {}
+        remembered = data.pop('session_id', None)
+        if remembered and not session_id:
+            stored = get_session_store().load(remembered)
+            if stored is not None:
+                st.query_params["sid"] = remembered
+                return stored
+        return data
+    
+    @staticmethod
+    def _load_browser_cache() -> Dict:
+        """读取 localStorage 中的数据，兼容旧版整体存储的 hust_gen_paper_cache；浏览器尚未返回时为 None"""
+        stored = streamlit_js_eval(
+            js_expressions=f"""(() => {{
+                const out = {{}};
+                for (let i = 0; i < localStorage.length; i++) {{
+                    const key = localStorage.key(i);
+                    if (key === '{LOCAL_CACHE_KEY}' || key.startsWith('{LOCAL_CACHE_KEY}:')) out[key] = localStorage.getItem(key);
+                }}
+                return out;
+            }})()""",
             key="load_cache"
         )
-        return cached_data or {}
+        if stored is None:
+            return None
+        # 记录已存储内容的哈希，之后只写入有变化的键
+        hashes = st.session_state.setdefault('_hust_gen_paper_cache_hashes', {})
+        data = {}
+        prefix = f"{LOCAL_CACHE_KEY}:"
+        try:
+            values = {key: AppFramework._decode_local_value(value) for key, value in stored.items()
+                      if key.startswith(prefix)}
+            for key, value in values.items():
+                hashes[key] = hashlib.md5(json.dumps(value, ensure_ascii=False).encode('utf-8')).hexdigest()
+                field = key[len(prefix):]
+                if ':' in field:
+                    continue
+                if field in LOCAL_CACHE_ITEM_FIELDS and isinstance(value, int):
+                    data[field] = [values.get(f"{key}:{i}", "") for i in range(value)]
+                else:
+                    data[field] = value
+        except (ValueError, zlib.error) as e:
+            print(f"Error loading local cache: {e}")
+            data = {}
+        if not data and stored.get(LOCAL_CACHE_KEY):
+            data = json.loads(stored[LOCAL_CACHE_KEY]) or {}
+        if LOCAL_CACHE_KEY in stored:
+            # 旧版整体缓存在下次写入时删除
+            hashes[LOCAL_CACHE_KEY] = None
+        return data
     
     @staticmethod
-    def load_history(cache_dir: str) -> List:
-        """加载历史记录"""
-        if os.path.exists(cache_dir):
-            cache_files = [f for f in os.listdir(cache_dir)]
-            cache_files.sort(key=lambda x: os.path.getmtime(os.path.join(cache_dir, x)), reverse=True)
-            return cache_files
-        return []
+    def load_history(query: str = None, field: str = 'response', limit: int = None, offset: int = 0) -> List:
+        """加载历史记录（按生成时间倒序），只包含预览，不读取完整内容"""
+        from cache_store import get_cache_store
+        return get_cache_store().list_history(query=query, field=field, limit=limit, offset=offset)
+    
+    @staticmethod
+    def count_history(query: str = None, field: str = 'response') -> int:
+        """符合检索条件的历史记录数"""
+        from cache_store import get_cache_store
+        return get_cache_store().count_history(query=query, field=field)
     
     @staticmethod
     def setup_page_config():
@@ -122,12 +294,59 @@ class PageManager:
             PaperGeneratorPage().render()
         # 可以在此添加更多页面的调用
 
+    def show_cache_stats(self):
+        """在侧边栏显示缓存命中统计"""
+        from cache_store import get_cache_store
+        stats = get_cache_store().stats()
+        with st.sidebar.expander("缓存统计"):
+            st.write(f"命中率: {stats['hit_ratio']:.1%}")
+            st.write(f"内存命中: {stats['memory_hits']}，磁盘命中: {stats['disk_hits']}，未命中: {stats['misses']}")
+            st.write(f"内存淘汰: {stats['memory_evictions']}，磁盘淘汰: {stats['disk_evictions']}，过期: {stats['expired']}")
+            if 'semantic_cache' in sys.modules:
+                from semantic_cache import semantic_cache_stats
+                for name, semantic in semantic_cache_stats().items():
+                    st.write(f"语义缓存（{name}）: 节省 {semantic['saved_calls']} 次调用，"
+                             f"命中率 {semantic['hit_ratio']:.1%}，条目 {semantic['entries']}，"
+                             f"嵌入耗时 {semantic['embed_seconds']:.1f} 秒")
+            if 'embedding_store' in sys.modules:
+                from embedding_store import embedding_store_stats
+                for name, store in embedding_store_stats().items():
+                    st.write(f"嵌入向量（{name}）: {store['vectors']} 条，命中 {store['hits']}，"
+                             f"新嵌入 {store['misses']} 条 / {store['embed_calls']} 次调用，"
+                             f"耗时 {store['embed_seconds']:.1f} 秒")
+
+    @staticmethod
+    @st.cache_data(ttl=TELEMETRY_REFRESH, show_spinner=False)
+    def telemetry_summary():
+        """最近 24 小时的调用统计，页面每次重跑都会调用，结果缓存 TELEMETRY_REFRESH 秒"""
+        from telemetry import summary
+        return summary(since=time.time() - 24 * 3600)
+
+    def show_telemetry(self):
+        """在侧边栏汇总最近 24 小时的大模型调用情况"""
+        with st.sidebar.expander("调用统计（24小时）"):
+            models = self.telemetry_summary()
+            if not models:
+                st.write("暂无调用记录")
+            for model, stats in models.items():
+                st.markdown(f"**{model}**")
+                st.write(f"调用 {stats['calls']} 次，错误 {stats['errors']} 次，缓存命中率 {stats['hit_ratio']:.1%}")
+                st.write(f"延迟 p50 {stats['latency_p50']:.1f} 秒 / p95 {stats['latency_p95']:.1f} 秒，"
+                         f"首 token p50 {stats['ttft_p50']:.1f} 秒，排队 p95 {stats['queue_wait_p95']:.1f} 秒")
+                st.write(f"输出速度 {stats['tokens_per_sec']:.1f} tokens/秒，"
+                         f"输入 {stats['input_tokens']} / 输出 {stats['output_tokens']} tokens")
+
 # 主入口
 def main():
     AppFramework.setup_page_config()
+    if WARM_UP:
+        start_warm_up()
     manager = PageManager()
     current_page = manager.show_navigation()
     manager.run_current_page(current_page)
+    manager.show_cache_stats()
+    manager.show_telemetry()
+    AppFramework.flush_local_cache()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,190 @@
+"""
+Usage: Headless batch generation of many papers from a JSONL job file
+Run: python batch_cli.py jobs.jsonl --output-dir batch_output [--workers 4] [--model gpt-4o]
+Job format (one JSON object per line):
+    {"id": "report-01", "theme": "...", "outlines": ["1. ...", "2. ..."], "references": ["...", "..."],
+     "requirements": ["..."], "req_selected": [true, false], "model": "gpt-4o", "temperature": 0,
+     "mode": "whole" | "sections"}
+    "outline_text" (one point per line) can replace "outlines"; requirements default to DEFAULT_REQUIREMENTS.
+Output:
+    <output-dir>/<id>.txt          generated paper
+    <output-dir>/<id>.json         prompt, model, timings
+    <output-dir>/checkpoint.jsonl  finished job ids, re-running the same command skips them
+    Ids with characters other than letters, digits, "-", "_" and "." are sanitized and get a short hash suffix
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List
+
+from agent import DEFAULT_MODEL, MODEL_LIST, get_agent
+from generation import DEFAULT_MAX_WORKERS, generate_sections, stitch_sections
+from prompt_builder import (DEFAULT_REQUIREMENTS, build_outline_text, build_section_prompts,
+                            generate_prompt, select_requirements)
+
+CHECKPOINT_FILE = "checkpoint.jsonl"
+
+
+def load_jobs(path: str) -> List[Dict]:
+    jobs = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            job = json.loads(line)
+            job.setdefault('id', f"job{lineno}")
+            jobs.append(job)
+    return jobs
+
+
+def build_job_prompts(job: Dict) -> Dict:
+    """和 PaperGeneratorPage.render_step2 相同的拼接逻辑"""
+    theme = job.get('theme', "").strip()
+    outlines = job.get('outlines')
+    if outlines is None:
+        outlines = [line.strip() for line in job.get('outline_text', "").split('\n') if line.strip()]
+    references = list(job.get('references', []))
+    references += [""] * (len(outlines) - len(references))
+    requirements = job.get('requirements', DEFAULT_REQUIREMENTS)
+    req_selected = job.get('req_selected', [True] * len(requirements))
+    selected_requirements = select_requirements(requirements, req_selected, theme)
+    return {
+        'prompt': generate_prompt(build_outline_text(theme, outlines, references), selected_requirements),
+        'section_prompts': build_section_prompts(theme, outlines, references, selected_requirements),
+    }
+
+
+def invalid_model(job: Dict, default_model: str):
+    """任务指定了 model_options 之外的模型时返回该模型名，否则返回 None"""
+    model = job.get('model', default_model)
+    return None if model in MODEL_LIST else model
+
+
+def run_job(job: Dict, default_model: str, section_workers: int) -> Dict:
+    prompts = build_job_prompts(job)
+    job_agent = get_agent(job.get('model', default_model), job.get('temperature', 0))
+    start = time.perf_counter()
+    if job.get('mode') == "sections":
+        text = stitch_sections(generate_sections(prompts['section_prompts'], job_agent.simple_request,
+                                                 max_workers=section_workers))
+        cache_key = None
+    else:
+        cache_key, text = job_agent.simple_request(prompts['prompt'])
+    return {
+        'id': job['id'],
+        'text': text,
+        'cache_key': cache_key,
+        'model': job_agent.model,
+        'temperature': job_agent.temperature,
+        'mode': job.get('mode', "whole"),
+        'prompt': prompts['prompt'],
+        'elapsed': time.perf_counter() - start,
+    }
+
+
+def load_checkpoint(output_dir: str) -> set:
+    path = os.path.join(output_dir, CHECKPOINT_FILE)
+    if not os.path.exists(path):
+        return set()
+    done = set()
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                done.add(json.loads(line)['id'])
+    return done
+
+
+def result_name(job_id) -> str:
+    """输出文件名：替换掉不能用在文件名里的字符；有替换时加上原 id 的短哈希，避免 "a/b" 和 "a_b" 互相覆盖"""
+    raw_id = str(job_id)
+    safe_id = "".join(c if c.isalnum() or c in "-_." else "_" for c in raw_id)
+    if safe_id != raw_id:
+        safe_id += "-" + hashlib.md5(raw_id.encode('utf-8')).hexdigest()[:8]
+    return safe_id
+
+
+def write_result(output_dir: str, result: Dict, checkpoint_lock: threading.Lock):
+    safe_id = result_name(result['id'])
+    # 先写临时文件再替换，中断时不会留下半个结果
+    for suffix, content in ((".txt", result['text']),
+                            (".json", json.dumps({k: v for k, v in result.items() if k != 'text'},
+                                                 ensure_ascii=False, indent=2))):
+        path = os.path.join(output_dir, safe_id + suffix)
+        with open(path + ".tmp", 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(path + ".tmp", path)
+    # 输出文件落盘后才记录检查点
+    with checkpoint_lock:
+        with open(os.path.join(output_dir, CHECKPOINT_FILE), 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'id': result['id'], 'finished_at': time.time()}, ensure_ascii=False) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate papers in batch from a JSONL job file")
+    parser.add_argument("jobs", help="JSONL job file")
+    parser.add_argument("--output-dir", default="batch_output")
+    parser.add_argument("--workers", type=int, default=DEFAULT_MAX_WORKERS, help="concurrent jobs")
+    parser.add_argument("--section-workers", type=int, default=DEFAULT_MAX_WORKERS,
+                        help="concurrent section requests per job in sections mode")
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="default model for jobs without 'model'")
+    args = parser.parse_args()
+    if args.model not in MODEL_LIST:
+        parser.error(f"unknown model {args.model!r}, choose one of: {', '.join(MODEL_LIST)}")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    jobs = load_jobs(args.jobs)
+    done = load_checkpoint(args.output_dir)
+    pending = [job for job in jobs if job['id'] not in done]
+    print(f"{len(jobs)} jobs, {len(jobs) - len(pending)} already done, {len(pending)} to run")
+
+    checkpoint_lock = threading.Lock()
+    start = time.perf_counter()
+    finished, failed, total_chars = 0, [], 0
+    # 模型名无效时 choose_actual_model 会直接退出进程，提交前先检查，只把这个任务记为失败
+    runnable = []
+    for job in pending:
+        model = invalid_model(job, args.model)
+        if model is None:
+            runnable.append(job)
+        else:
+            failed.append(job['id'])
+            print(f"[failed] {job['id']}: unknown model {model!r}")
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as executor:
+        futures = {executor.submit(run_job, job, args.model, args.section_workers): job for job in runnable}
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                result = future.result()
+            except (Exception, SystemExit) as e:
+                # SystemExit：缺少 API 密钥等配置错误时模型初始化会调用 exit()
+                failed.append(job['id'])
+                print(f"[failed] {job['id']}: {type(e).__name__}: {e}")
+                continue
+            write_result(args.output_dir, result, checkpoint_lock)
+            finished += 1
+            total_chars += len(result['text'])
+            elapsed = time.perf_counter() - start
+            print(f"[{finished + len(failed)}/{len(pending)}] {job['id']} {result['elapsed']:.1f}s "
+                  f"({finished / elapsed * 60:.1f} jobs/min, {total_chars / elapsed:.0f} chars/s)")
+
+    elapsed = time.perf_counter() - start
+    summary = {
+        'total': len(jobs),
+        'skipped': len(jobs) - len(pending),
+        'finished': finished,
+        'failed': failed,
+        'elapsed_sec': elapsed,
+        'jobs_per_min': finished / elapsed * 60 if elapsed > 0 else 0.0,
+        'chars_per_sec': total_chars / elapsed if elapsed > 0 else 0.0,
+    }
+    print(json.dumps(summary, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
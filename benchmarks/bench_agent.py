@@ -0,0 +1,188 @@
+"""
+Usage: Offline benchmark suite for the agent and cache paths, using a deterministic fake LLM
+Run: python benchmarks/bench_agent.py [--sizes 1000,10000,100000] [--latency 0.05] [--output bench_agent.json]
+Cases:
+    - simple_request: cold (model call), warm from memory, warm from disk
+    - cache_key: hashing of prompts of different sizes
+    - cache_store: put / get throughput and eviction (_clean_cache) cost at each store size
+    - prompt_assembly: building prompts, section prompts and token budgets for large outlines
+Results are written to a JSON file so runs can be compared.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root_dir)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from cache_store import MemoryLRU, SQLiteCacheStore, TieredCache, set_cache_store
+
+
+def timed(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return {
+        "median_sec": statistics.median(timings),
+        "p95_sec": sorted(timings)[max(0, int(len(timings) * 0.95) - 1)],
+        "min_sec": min(timings),
+        "runs": len(timings),
+    }
+
+
+def bench_simple_request(args, work_dir):
+    from agent import LLMAgent
+    from throttle import TokenBucket, provider_of, set_limiter
+    from fake_llm import make_fake_llm
+
+    store = TieredCache(SQLiteCacheStore(os.path.join(work_dir, "requests.db")), background=False)
+    set_cache_store(store)
+    agent = LLMAgent(model="fake", init=False)
+    agent.llm = make_fake_llm(args.latency, args.tokens_per_sec, args.output_tokens)
+    # 基准测试不测限流，放开令牌桶
+    set_limiter(provider_of(agent.model), TokenBucket(1e9, 1e9))
+
+    counter = iter(range(10 ** 9))
+    cold = timed(lambda: agent.simple_request(f"cold prompt {next(counter)}"), args.repeat)
+    agent.simple_request("warm prompt")
+    warm_memory = timed(lambda: agent.simple_request("warm prompt"), args.repeat * 10)
+
+    def disk_hit():
+        store.memory = MemoryLRU()
+        agent.simple_request("warm prompt")
+    warm_disk = timed(disk_hit, args.repeat * 10)
+
+    def first_token():
+        stream = agent.stream_request(f"stream prompt {next(counter)}")
+        next(stream)
+        stream.close()
+    ttft = timed(first_token, args.repeat)
+    return {"cold": cold, "warm_memory": warm_memory, "warm_disk": warm_disk, "stream_first_token": ttft,
+            "cache_stats": store.stats()}
+
+
+def bench_cache_key(args):
+    from agent import LLMAgent
+    agent = LLMAgent(model="fake", init=False)
+    results = {}
+    for size in (1_000, 10_000, 100_000):
+        prompt = "参考文本" * (size // 4)
+        results[f"{size}_chars"] = timed(lambda: agent._request_cache_key(prompt), args.repeat * 100)
+    return results
+
+
+def bench_cache_store(args, work_dir):
+    results = {}
+    response = "生成的文章内容" * (args.response_chars // 7)
+    for size in args.sizes:
+        store = SQLiteCacheStore(os.path.join(work_dir, f"store_{size}.db"))
+        start = time.perf_counter()
+        for i in range(size):
+            store.put(f"key{i}", response, prompt=f"prompt {i}", model="fake", temperature=0)
+        put_elapsed = time.perf_counter() - start
+
+        keys = [f"key{(i * 7919) % size}" for i in range(min(size, 2000))]
+        start = time.perf_counter()
+        for key in keys:
+            store.get(key)
+        get_elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        store.list_entries(limit=20)
+        list_elapsed = time.perf_counter() - start
+
+        total = store.total_bytes()
+        start = time.perf_counter()
+        evicted = store.evict(total // 2)
+        evict_elapsed = time.perf_counter() - start
+
+        results[str(size)] = {
+            "put_per_sec": size / put_elapsed,
+            "get_per_sec": len(keys) / get_elapsed,
+            "list_recent_sec": list_elapsed,
+            "clean_cache_sec": evict_elapsed,
+            "evicted": evicted,
+            "db_bytes": os.path.getsize(store.db_path),
+        }
+        print(f"cache_store {size}: {results[str(size)]['put_per_sec']:.0f} put/s, "
+              f"{results[str(size)]['get_per_sec']:.0f} get/s, evict {evict_elapsed * 1000:.1f} ms")
+    return results
+
+
+def bench_prompt_assembly(args):
+    from prompt_builder import (DEFAULT_REQUIREMENTS, build_outline_text, build_section_prompts,
+                                generate_prompt, select_requirements)
+    from tokens import plan_budget
+
+    results = {}
+    for points in (20, 150, 500):
+        outlines = [f"{i+1}. 大纲要点 {i+1}" for i in range(points)]
+        references = ["参考文本内容，包含一些 English words。" * 50 for _ in range(points)]
+
+        def assemble():
+            requirements = select_requirements(DEFAULT_REQUIREMENTS, [True] * len(DEFAULT_REQUIREMENTS), "主题")
+            prompt = generate_prompt(build_outline_text("主题", outlines, references), requirements)
+            build_section_prompts("主题", outlines, references, requirements)
+            return prompt
+
+        prompt = assemble()
+        results[f"{points}_points"] = {
+            "assemble": timed(assemble, args.repeat),
+            "plan_budget": timed(lambda: plan_budget("gpt-4o", prompt, references), args.repeat),
+            "prompt_chars": len(prompt),
+        }
+    return results
+
+
+def run_case(name, fn, *fn_args):
+    print(f"running {name} ...")
+    try:
+        return fn(*fn_args)
+    except ImportError as e:
+        # 缺少 langchain 等依赖时跳过该用例，其余用例照常运行
+        return {"skipped": f"{type(e).__name__}: {e}"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline agent / cache benchmark")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="cache store sizes")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.05, help="fake LLM first-token latency (s)")
+    parser.add_argument("--tokens-per-sec", type=float, default=2000.0, help="fake LLM output rate")
+    parser.add_argument("--output-tokens", type=int, default=200)
+    parser.add_argument("--response-chars", type=int, default=2000)
+    parser.add_argument("--output", default=os.path.join(root_dir, "bench_agent.json"))
+    args = parser.parse_args()
+    args.sizes = [int(size) for size in args.sizes.split(",") if size]
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        # 假模型的调用记录写入临时目录，不混入真实的 telemetry.db
+        from telemetry import set_telemetry_db
+        set_telemetry_db(os.path.join(work_dir, "telemetry.db"))
+        report = {
+            "benchmark": "agent",
+            "timestamp": time.time(),
+            "python": sys.version.split()[0],
+            "config": {key: value for key, value in vars(args).items() if key != "output"},
+            "cases": {
+                "simple_request": run_case("simple_request", bench_simple_request, args, work_dir),
+                "cache_key": run_case("cache_key", bench_cache_key, args),
+                "cache_store": run_case("cache_store", bench_cache_store, args, work_dir),
+                "prompt_assembly": run_case("prompt_assembly", bench_prompt_assembly, args),
+            },
+        }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Usage: Measure cold-start cost of the app modules and of eager vs lazy LLM client construction
+Run: python benchmarks/bench_import.py [--model gpt-4o] [--repeat 5] [--output bench_import.json]
+Each case runs in a fresh interpreter so module caches do not hide the import cost.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 每个用例在新的解释器里执行，输出执行耗时（秒）
+CASES = {
+    # 页面首次加载时 paper_generator 导入 agent 的开销
+    "import_agent": "import agent",
+    # 页面模块本身（包含 streamlit）
+    "import_paper_generator": "import paper_generator",
+    # 旧行为：创建 agent 时同时创建对话模型和嵌入模型
+    "eager_create_llm": "import agent; agent.create_llm({model!r}, 0)",
+    # 新行为：第一次请求前只创建对话模型
+    "lazy_first_request": "import agent; agent.get_agent({model!r}).llm",
+}
+
+RUNNER = """
+import sys, time
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+{code}
+print(time.perf_counter() - start)
+"""
+
+
+def run_case(code, repeat):
+    timings = []
+    for _ in range(repeat):
+        script = RUNNER.format(root=root_dir, code=code)
+        result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, cwd=root_dir)
+        if result.returncode != 0:
+            return {"error": result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "failed"}
+        timings.append(float(result.stdout.strip().splitlines()[-1]))
+    return {
+        "median_sec": statistics.median(timings),
+        "min_sec": min(timings),
+        "max_sec": max(timings),
+        "runs": timings,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time / cold-start benchmark")
+    parser.add_argument("--model", default=None, help="model to construct, defaults to agent.DEFAULT_MODEL")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", default=os.path.join(root_dir, "bench_import.json"))
+    args = parser.parse_args()
+
+    model = args.model
+    if model is None:
+        sys.path.insert(0, root_dir)
+        from agent import DEFAULT_MODEL
+        model = DEFAULT_MODEL
+
+    report = {
+        "benchmark": "import",
+        "timestamp": time.time(),
+        "python": sys.version.split()[0],
+        "model": model,
+        "repeat": args.repeat,
+        "cases": {name: run_case(code.format(model=model), args.repeat) for name, code in CASES.items()},
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    for name, result in report["cases"].items():
+        if "error" in result:
+            print(f"{name:24s} error: {result['error']}")
+        else:
+            print(f"{name:24s} {result['median_sec'] * 1000:10.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""
+Usage: Deterministic fake LLM for offline benchmarks
+Export: make_fake_llm
+The fake model answers with a fixed transformation of the prompt after a configurable first-token latency,
+then emits tokens at a configurable rate, so invoke and stream behave like a real provider.
+"""
+
+import time
+
+
+def make_fake_llm(latency: float = 0.05, tokens_per_sec: float = 2000.0, output_tokens: int = 200):
+    """
+    Usage: Build a LangChain LLM that can be injected into LLMAgent (agent.llm = make_fake_llm())
+    :param latency: float, seconds before the first token
+    :param tokens_per_sec: float, output token rate after the first token
+    :param output_tokens: int, number of tokens in every response
+    :return: langchain_core LLM instance
+    """
+    from langchain_core.language_models.llms import LLM
+    from langchain_core.outputs import GenerationChunk
+
+    class FakeLLM(LLM):
+        latency: float = 0.05
+        tokens_per_sec: float = 2000.0
+        output_tokens: int = 200
+
+        @property
+        def _llm_type(self) -> str:
+            return "fake"
+
+        def _tokens(self, prompt):
+            # 输出只取决于 prompt，保证结果可复现
+            seed = sum(prompt.encode('utf-8')) % 9973
+            return [f"tok{(seed + i) % 97} " for i in range(self.output_tokens)]
+
+        def _call(self, prompt, stop=None, run_manager=None, **kwargs):
+            time.sleep(self.latency + self.output_tokens / self.tokens_per_sec)
+            return "".join(self._tokens(prompt))
+
+        def _stream(self, prompt, stop=None, run_manager=None, **kwargs):
+            time.sleep(self.latency)
+            for token in self._tokens(prompt):
+                time.sleep(1 / self.tokens_per_sec)
+                yield GenerationChunk(text=token)
+
+    return FakeLLM(latency=latency, tokens_per_sec=tokens_per_sec, output_tokens=output_tokens)
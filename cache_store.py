@@ -0,0 +1,705 @@
+"""
+Usage: Storage engines for the LLM response cache
+Export: CacheStore, SQLiteCacheStore, PickleCacheStore, MemoryLRU, TieredCache, get_cache_store, set_cache_store,
+        migrate_pickle_cache
+Methods:
+    - get: Load one cache record (response, prompt, model, temperature, timestamps)
+    - put: Atomically write one cache record
+    - delete: Remove one cache record
+    - list_entries: List records ordered by creation time (newest first)
+    - evict: Remove least recently used records until the store fits a byte budget
+    - touch: Write back access times of memory-tier hits so disk eviction stays least-recently-used
+    - list_history / count_history: Paginated, searchable history with precomputed previews (no unpickling)
+    - stats: Hit / miss / eviction counters of the two-tier cache
+Migration:
+    python cache_store.py migrate [--cache-dir llm_cache] [--db llm_cache.db]
+    python cache_store.py reindex [--db llm_cache.db]
+"""
+
+import os
+import gzip
+import json
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from history_index import index_terms, make_preview, query_terms
+
+file_dir = os.path.dirname(os.path.abspath(__file__))
+
+# 缓存后端：sqlite（默认，单库带索引）或 pickle（旧版，每条记录一个 .pkl.gz 文件）
+CACHE_BACKEND = os.getenv("HUST_GEN_PAPER_CACHE_BACKEND", "sqlite")
+DEFAULT_CACHE_DIR = os.path.join(file_dir, 'llm_cache')
+DEFAULT_DB_PATH = os.path.join(file_dir, 'llm_cache.db')
+# 磁盘缓存的字节预算，超出后由后台线程按最近访问时间淘汰
+CACHE_MAX_BYTES = int(os.getenv("HUST_GEN_PAPER_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+# 每条记录的默认存活时间（秒），0 表示永不过期
+CACHE_TTL = float(os.getenv("HUST_GEN_PAPER_CACHE_TTL", 0))
+# 进程内 LRU 缓存的条目数上限和字节上限
+MEMORY_CACHE_ENTRIES = int(os.getenv("HUST_GEN_PAPER_MEMORY_CACHE_ENTRIES", 256))
+MEMORY_CACHE_BYTES = int(os.getenv("HUST_GEN_PAPER_MEMORY_CACHE_BYTES", 64 * 1024 * 1024))
+# 后台淘汰线程的检查间隔（秒）
+EVICT_INTERVAL = 60
+# 后台线程每次补建历史索引的记录数
+REINDEX_BATCH = 500
+
+
+class CacheStore:
+    """缓存存储引擎接口，每条记录包含 response、prompt、model、temperature 和时间戳"""
+
+    def get(self, key: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    def put(self, key: str, response, prompt: Optional[str] = None, model: Optional[str] = None,
+            temperature: Optional[float] = None, created_at: Optional[float] = None,
+            ttl: Optional[float] = None):
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    def list_entries(self, limit: Optional[int] = None, offset: int = 0) -> List[Dict]:
+        raise NotImplementedError
+
+    def count(self) -> int:
+        raise NotImplementedError
+
+    @staticmethod
+    def _history_entry(record: Dict) -> Dict:
+        from prompt_builder import extract_theme
+        response = record['response'] if isinstance(record['response'], str) else ""
+        return {
+            'key': record['key'],
+            'created_at': record['created_at'],
+            'model': record.get('model'),
+            'theme': extract_theme(record.get('prompt') or ""),
+            'preview': make_preview(response),
+            'prompt_preview': make_preview(record['prompt']) if record.get('prompt') else None,
+        }
+
+    def _matching_history(self, query: Optional[str], field: str) -> List[Dict]:
+        terms = query_terms(query)
+        entries = []
+        for record in self.list_entries():
+            if field == 'prompt' and not record.get('prompt'):
+                continue
+            if terms and not terms <= index_terms(record.get('prompt') or "") | index_terms(
+                    record['response'] if isinstance(record['response'], str) else ""):
+                continue
+            entries.append(self._history_entry(record))
+        return entries
+
+    def list_history(self, query: Optional[str] = None, field: str = 'response', limit: Optional[int] = None,
+                     offset: int = 0) -> List[Dict]:
+        """
+        Usage: List history entries (newest first) without their full content
+        :param query: str, search text, every term must appear in the prompt or the response
+        :param field: str, 'prompt' only lists records that have a prompt
+        :return: List[Dict], key, created_at, model, theme, preview and prompt_preview of each entry
+        """
+        entries = self._matching_history(query, field)
+        return entries[offset:] if limit is None else entries[offset:offset + limit]
+
+    def count_history(self, query: Optional[str] = None, field: str = 'response') -> int:
+        return len(self._matching_history(query, field))
+
+    def reindex(self, batch: Optional[int] = None) -> int:
+        """为尚未建立历史索引的记录补建索引，返回处理条数"""
+        return 0
+
+    def touch(self, accessed: Dict[str, float]):
+        """批量更新记录的最近访问时间（上层缓存命中的记录），key -> 访问时间"""
+        pass
+
+    def evict(self, max_bytes: int) -> int:
+        """淘汰最久未访问的记录直到总大小不超过 max_bytes，返回淘汰条数"""
+        return 0
+
+    def purge_expired(self) -> int:
+        """删除已过期的记录，返回删除条数"""
+        return 0
+
+
+class SQLiteCacheStore(CacheStore):
+    """基于 SQLite 的缓存存储，WAL 模式下多个 Streamlit 会话可以安全并发读写"""
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH):
+        self.db_path = db_path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._init_schema()
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite3 连接不能跨线程使用，每个线程各自持有一个连接
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._connect()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                response BLOB NOT NULL,
+                prompt TEXT,
+                model TEXT,
+                temperature REAL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                size INTEGER NOT NULL,
+                expires_at REAL
+            )
+        """)
+        # 兼容没有 expires_at 列的旧库
+        columns = [row['name'] for row in conn.execute("PRAGMA table_info(llm_cache)")]
+        if 'expires_at' not in columns:
+            conn.execute("ALTER TABLE llm_cache ADD COLUMN expires_at REAL")
+        # 历史索引：预先计算的预览和主题，旧库的记录由 reindex 补建
+        for column, definition in (('theme', "TEXT"), ('preview', "TEXT"), ('prompt_preview', "TEXT"),
+                                   ('indexed', "INTEGER NOT NULL DEFAULT 0")):
+            if column not in columns:
+                conn.execute(f"ALTER TABLE llm_cache ADD COLUMN {column} {definition}")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_cache_terms (
+                term TEXT NOT NULL,
+                key TEXT NOT NULL,
+                PRIMARY KEY (term, key)
+            ) WITHOUT ROWID
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_terms_key ON llm_cache_terms(key)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_indexed ON llm_cache(indexed)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_created ON llm_cache(created_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed ON llm_cache(accessed_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_expires ON llm_cache(expires_at)")
+
+    @staticmethod
+    def _row_to_dict(row) -> Dict:
+        return {
+            'key': row['key'],
+            'response': pickle.loads(row['response']),
+            'prompt': row['prompt'],
+            'model': row['model'],
+            'temperature': row['temperature'],
+            'created_at': row['created_at'],
+            'accessed_at': row['accessed_at'],
+            # 提升到内存缓存后仍按原过期时间失效
+            'expires_at': row['expires_at'],
+        }
+
+    def get(self, key: str) -> Optional[Dict]:
+        conn = self._connect()
+        row = conn.execute("SELECT * FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if row['expires_at'] is not None and row['expires_at'] <= time.time():
+            return None
+        try:
+            record = self._row_to_dict(row)
+        except Exception as e:
+            print(f"Error loading cache: {e}, removing invalid record")
+            self.delete(key)
+            return None
+        conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        return record
+
+    def put(self, key: str, response, prompt: Optional[str] = None, model: Optional[str] = None,
+            temperature: Optional[float] = None, created_at: Optional[float] = None,
+            ttl: Optional[float] = None):
+        now = time.time()
+        blob = pickle.dumps(response)
+        size = len(blob) + len((prompt or '').encode('utf-8'))
+        expires_at = now + ttl if ttl else None
+        conn = self._connect()
+        # 单条 INSERT 在一个事务内完成，读者要么看到旧记录，要么看到完整的新记录
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            # prompt 可能由调用方稍后补写，已有的 prompt 不会被 None 覆盖
+            conn.execute("""
+                INSERT INTO llm_cache (key, response, prompt, model, temperature, created_at, accessed_at, size,
+                                       expires_at, indexed)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 0)
+                ON CONFLICT(key) DO UPDATE SET
+                    response = excluded.response,
+                    prompt = COALESCE(excluded.prompt, llm_cache.prompt),
+                    model = COALESCE(excluded.model, llm_cache.model),
+                    temperature = COALESCE(excluded.temperature, llm_cache.temperature),
+                    accessed_at = excluded.accessed_at,
+                    size = excluded.size,
+                    expires_at = excluded.expires_at,
+                    indexed = 0
+            """, (key, blob, prompt, model, temperature, created_at or now, now, size, expires_at))
+        # 历史索引（预览、检索词）由后台线程的 reindex 补建，不占用请求路径
+
+    @staticmethod
+    def _index_bytes(key: str, terms) -> int:
+        """检索词表占用的字节数估算：主键和 key 索引各存一份 (term, key)"""
+        return sum(2 * (len(term.encode('utf-8')) + len(key) + 8) for term in terms)
+
+    def reindex(self, batch: Optional[int] = None) -> int:
+        from prompt_builder import extract_theme
+        conn = self._connect()
+        rows = conn.execute("SELECT key, response, prompt, size FROM llm_cache WHERE indexed = 0 LIMIT ?",
+                            (batch if batch is not None else -1,)).fetchall()
+        indexed = 0
+        for row in rows:
+            key = row['key']
+            try:
+                response = pickle.loads(row['response'])
+            except Exception:
+                response = ""
+            response = response if isinstance(response, str) else ""
+            prompt = row['prompt']
+            # 检索词在事务外计算，写锁只用于写入
+            terms = index_terms(prompt) | index_terms(response)
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                # 期间记录被重新写入时跳过，由下一轮按新内容建索引
+                cursor = conn.execute(
+                    "UPDATE llm_cache SET theme = ?, preview = ?, prompt_preview = ?, indexed = 1, size = ? "
+                    "WHERE key = ? AND indexed = 0 AND response = ? AND prompt IS ?",
+                    (extract_theme(prompt or ""), make_preview(response), make_preview(prompt) if prompt else None,
+                     row['size'] + self._index_bytes(key, terms), key, row['response'], prompt))
+                if cursor.rowcount == 0:
+                    continue
+                conn.execute("DELETE FROM llm_cache_terms WHERE key = ?", (key,))
+                conn.executemany("INSERT OR IGNORE INTO llm_cache_terms (term, key) VALUES (?, ?)",
+                                 [(term, key) for term in terms])
+            indexed += 1
+        return indexed
+
+    def touch(self, accessed: Dict[str, float]):
+        if not accessed:
+            return
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany("UPDATE llm_cache SET accessed_at = MAX(accessed_at, ?) WHERE key = ?",
+                             [(accessed_at, key) for key, accessed_at in accessed.items()])
+
+    def delete(self, key: str):
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM llm_cache_terms WHERE key = ?", (key,))
+            conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+
+    def _history_query(self, query: Optional[str], field: str):
+        """返回历史查询的 WHERE 子句和参数：每个检索词都要命中"""
+        clauses, params = [], []
+        if field == 'prompt':
+            clauses.append("prompt IS NOT NULL")
+        terms = sorted(query_terms(query))
+        if terms:
+            clauses.append(f"""key IN (SELECT key FROM llm_cache_terms WHERE term IN ({','.join('?' * len(terms))})
+                                     GROUP BY key HAVING COUNT(*) = ?)""")
+            params.extend(terms)
+            params.append(len(terms))
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def _index_pending(self, query: Optional[str]):
+        """检索前补建最近写入的记录的检索词，保证新记录也能被搜到"""
+        if query_terms(query):
+            self.reindex(REINDEX_BATCH)
+
+    def list_history(self, query: Optional[str] = None, field: str = 'response', limit: Optional[int] = None,
+                     offset: int = 0) -> List[Dict]:
+        conn = self._connect()
+        self._index_pending(query)
+        where, params = self._history_query(query, field)
+        rows = conn.execute(
+            f"SELECT key, created_at, model, theme, preview, prompt_preview, indexed FROM llm_cache{where} "
+            f"ORDER BY created_at DESC LIMIT ? OFFSET ?",
+            params + [limit if limit is not None else -1, offset]
+        ).fetchall()
+        entries = []
+        for row in rows:
+            if not row['indexed']:
+                # 尚未建立索引的记录临时计算预览，索引由后台线程补建
+                record = self.get(row['key'])
+                if record is None:
+                    continue
+                entries.append(self._history_entry(record))
+                continue
+            entries.append({key: row[key] for key in ('key', 'created_at', 'model', 'theme', 'preview',
+                                                      'prompt_preview')})
+        return entries
+
+    def count_history(self, query: Optional[str] = None, field: str = 'response') -> int:
+        self._index_pending(query)
+        where, params = self._history_query(query, field)
+        return self._connect().execute(f"SELECT COUNT(*) FROM llm_cache{where}", params).fetchone()[0]
+
+    def list_entries(self, limit: Optional[int] = None, offset: int = 0) -> List[Dict]:
+        conn = self._connect()
+        rows = conn.execute(
+            "SELECT * FROM llm_cache ORDER BY created_at DESC LIMIT ? OFFSET ?",
+            (limit if limit is not None else -1, offset)
+        ).fetchall()
+        return [self._row_to_dict(row) for row in rows]
+
+    def count(self) -> int:
+        return self._connect().execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+
+    def total_bytes(self) -> int:
+        return self._connect().execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+
+    def evict(self, max_bytes: int) -> int:
+        conn = self._connect()
+        total = self.total_bytes()
+        if total <= max_bytes:
+            return 0
+        # 淘汰到预算的 90%，避免每次只删一两条就又超限
+        target = int(max_bytes * 0.9)
+        keys = []
+        for row in conn.execute("SELECT key, size FROM llm_cache ORDER BY accessed_at ASC"):
+            if total <= target:
+                break
+            keys.append(row['key'])
+            total -= row['size']
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany("DELETE FROM llm_cache_terms WHERE key = ?", [(key,) for key in keys])
+            conn.executemany("DELETE FROM llm_cache WHERE key = ?", [(key,) for key in keys])
+        return len(keys)
+
+    def purge_expired(self) -> int:
+        conn = self._connect()
+        now = time.time()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM llm_cache_terms WHERE key IN (SELECT key FROM llm_cache "
+                         "WHERE expires_at IS NOT NULL AND expires_at <= ?)", (now,))
+            cursor = conn.execute("DELETE FROM llm_cache WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+        return cursor.rowcount
+
+
+class PickleCacheStore(CacheStore):
+    """旧版缓存格式：每条记录一个 <key>.pkl.gz 文件，prompt 存在 <key>.pkl.gz.prompt"""
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR):
+        self.cache_dir = cache_dir
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.pkl.gz")
+
+    def get(self, key: str) -> Optional[Dict]:
+        filepath = self._path(key)
+        if not os.path.exists(filepath):
+            return None
+        try:
+            with gzip.open(filepath, 'rb') as f:
+                response = pickle.load(f)
+        except Exception as e:
+            print(f"Error loading cache: {e}, removing invalid file")
+            os.remove(filepath)
+            return None
+        prompt = None
+        if os.path.exists(filepath + '.prompt'):
+            try:
+                with gzip.open(filepath + '.prompt', 'rb') as f:
+                    prompt = pickle.load(f)
+            except Exception:
+                prompt = None
+        mtime = os.path.getmtime(filepath)
+        return {'key': key, 'response': response, 'prompt': prompt, 'model': None,
+                'temperature': None, 'created_at': mtime, 'accessed_at': mtime}
+
+    def put(self, key: str, response, prompt: Optional[str] = None, model: Optional[str] = None,
+            temperature: Optional[float] = None, created_at: Optional[float] = None,
+            ttl: Optional[float] = None):
+        # 文件缓存不记录 TTL，只按字节预算淘汰
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # 先写临时文件再 rename，避免并发读到写了一半的文件
+        for path, data in ((self._path(key), response), (self._path(key) + '.prompt', prompt)):
+            if data is None:
+                continue
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with gzip.open(tmp_path, 'wb') as f:
+                pickle.dump(data, f)
+            os.replace(tmp_path, path)
+
+    def delete(self, key: str):
+        for path in (self._path(key), self._path(key) + '.prompt'):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def list_entries(self, limit: Optional[int] = None, offset: int = 0) -> List[Dict]:
+        if not os.path.exists(self.cache_dir):
+            return []
+        files = [f for f in os.listdir(self.cache_dir) if f.endswith('.pkl.gz')]
+        files.sort(key=lambda x: os.path.getmtime(os.path.join(self.cache_dir, x)), reverse=True)
+        files = files[offset:] if limit is None else files[offset:offset + limit]
+        entries = [self.get(f[:-len('.pkl.gz')]) for f in files]
+        return [entry for entry in entries if entry is not None]
+
+    def count(self) -> int:
+        if not os.path.exists(self.cache_dir):
+            return 0
+        return len([f for f in os.listdir(self.cache_dir) if f.endswith('.pkl.gz')])
+
+    def evict(self, max_bytes: int) -> int:
+        if not os.path.exists(self.cache_dir):
+            return 0
+        # noatime 挂载下 atime 不可靠，这里按 mtime 淘汰
+        files = [os.path.join(self.cache_dir, f) for f in os.listdir(self.cache_dir) if f.endswith('.pkl.gz')]
+        files.sort(key=os.path.getmtime)
+        total = sum(os.path.getsize(f) for f in files)
+        evicted = 0
+        while files and total > max_bytes * 0.9:
+            filepath = files.pop(0)
+            total -= os.path.getsize(filepath)
+            self.delete(os.path.basename(filepath)[:-len('.pkl.gz')])
+            evicted += 1
+        return evicted
+
+
+class MemoryLRU:
+    """进程内 LRU 缓存，同时限制条目数和字节数，命中时无需解压和反序列化"""
+
+    def __init__(self, max_entries: int = MEMORY_CACHE_ENTRIES, max_bytes: int = MEMORY_CACHE_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()
+        self._sizes = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    @staticmethod
+    def _sizeof(record: Dict) -> int:
+        return sum(len(value.encode('utf-8')) for value in (record.get('response'), record.get('prompt'))
+                   if isinstance(value, str)) + 256
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            record = self._data.get(key)
+            if record is None:
+                return None
+            expires_at = record.get('expires_at')
+            if expires_at is not None and expires_at <= time.time():
+                self._remove(key)
+                return None
+            self._data.move_to_end(key)
+            return record
+
+    def put(self, key: str, record: Dict):
+        size = self._sizeof(record)
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            if size > self.max_bytes:
+                return
+            self._data[key] = record
+            self._sizes[key] = size
+            self._bytes += size
+            while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+
+    def delete(self, key: str):
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+    def _remove(self, key: str):
+        del self._data[key]
+        self._bytes -= self._sizes.pop(key)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class TieredCache(CacheStore):
+    """两级缓存：进程内 LRU 在前，磁盘存储在后；磁盘淘汰由后台线程完成，不占用请求路径"""
+
+    def __init__(self, store: CacheStore, memory: Optional[MemoryLRU] = None,
+                 max_bytes: int = CACHE_MAX_BYTES, ttl: float = CACHE_TTL,
+                 evict_interval: float = EVICT_INTERVAL, background: bool = True):
+        self.store = store
+        self.memory = memory if memory is not None else MemoryLRU()
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.evict_interval = evict_interval
+        self._counter_lock = threading.Lock()
+        self._counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'disk_evictions': 0, 'expired': 0}
+        # 内存命中的记录和命中时间，淘汰前批量写回磁盘的 accessed_at，否则最热的记录最先被淘汰
+        self._touched: Dict[str, float] = {}
+        self._wakeup = threading.Event()
+        self._evictor = None
+        if background:
+            self._evictor = threading.Thread(target=self._evict_loop, name="llm-cache-evictor", daemon=True)
+            self._evictor.start()
+
+    def _count(self, name: str, value: int = 1):
+        with self._counter_lock:
+            self._counters[name] += value
+
+    def get(self, key: str) -> Optional[Dict]:
+        return self.lookup(key)[0]
+
+    def lookup(self, key: str):
+        """返回 (记录, 命中层级)，层级为 memory、disk 或 miss"""
+        record = self.memory.get(key)
+        if record is not None:
+            with self._counter_lock:
+                self._counters['memory_hits'] += 1
+                self._touched[key] = time.time()
+            return record, 'memory'
+        record = self.store.get(key)
+        if record is None:
+            self._count('misses')
+            return None, 'miss'
+        self._count('disk_hits')
+        self.memory.put(key, record)
+        return record, 'disk'
+
+    def put(self, key: str, response, prompt: Optional[str] = None, model: Optional[str] = None,
+            temperature: Optional[float] = None, created_at: Optional[float] = None,
+            ttl: Optional[float] = None):
+        ttl = ttl if ttl is not None else self.ttl
+        self.store.put(key, response, prompt=prompt, model=model, temperature=temperature,
+                       created_at=created_at, ttl=ttl)
+        now = time.time()
+        self.memory.put(key, {
+            'key': key, 'response': response, 'prompt': prompt, 'model': model,
+            'temperature': temperature, 'created_at': created_at or now, 'accessed_at': now,
+            'expires_at': now + ttl if ttl else None,
+        })
+        self._wakeup.set()
+
+    def delete(self, key: str):
+        self.memory.delete(key)
+        self.store.delete(key)
+
+    def list_entries(self, limit: Optional[int] = None, offset: int = 0) -> List[Dict]:
+        return self.store.list_entries(limit=limit, offset=offset)
+
+    def count(self) -> int:
+        return self.store.count()
+
+    def list_history(self, query: Optional[str] = None, field: str = 'response', limit: Optional[int] = None,
+                     offset: int = 0) -> List[Dict]:
+        return self.store.list_history(query=query, field=field, limit=limit, offset=offset)
+
+    def count_history(self, query: Optional[str] = None, field: str = 'response') -> int:
+        return self.store.count_history(query=query, field=field)
+
+    def reindex(self, batch: Optional[int] = None) -> int:
+        return self.store.reindex(batch)
+
+    def flush_access(self):
+        """把内存命中的访问时间写回磁盘存储"""
+        with self._counter_lock:
+            touched, self._touched = self._touched, {}
+        self.store.touch(touched)
+
+    def evict(self, max_bytes: Optional[int] = None) -> int:
+        self.flush_access()
+        evicted = self.store.evict(self.max_bytes if max_bytes is None else max_bytes)
+        self._count('disk_evictions', evicted)
+        return evicted
+
+    def purge_expired(self) -> int:
+        expired = self.store.purge_expired()
+        self._count('expired', expired)
+        return expired
+
+    def _evict_loop(self):
+        while True:
+            # 有新写入时提前醒来，否则按固定间隔检查
+            self._wakeup.wait(self.evict_interval)
+            self._wakeup.clear()
+            try:
+                self.purge_expired()
+                # 新写入和旧库的记录分批补建历史索引，索引大小计入字节预算，所以先于淘汰
+                self.reindex(REINDEX_BATCH)
+                self.evict()
+            except Exception as e:
+                print(f"Error evicting cache: {e}")
+
+    def stats(self) -> Dict:
+        with self._counter_lock:
+            stats = dict(self._counters)
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['memory_evictions'] = self.memory.evictions
+        stats['memory_entries'] = len(self.memory)
+        stats['hit_ratio'] = (stats['memory_hits'] + stats['disk_hits']) / lookups if lookups else 0.0
+        return stats
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_cache_store() -> TieredCache:
+    """获取进程内共享的两级缓存实例"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            if CACHE_BACKEND == "pickle":
+                _store = TieredCache(PickleCacheStore())
+            else:
+                _store = TieredCache(SQLiteCacheStore())
+        return _store
+
+
+def set_cache_store(store: CacheStore):
+    """替换进程内共享的缓存实例（用于基准测试或自定义存储引擎）"""
+    global _store
+    with _store_lock:
+        _store = store
+
+
+def migrate_pickle_cache(cache_dir: str = DEFAULT_CACHE_DIR, store: Optional[CacheStore] = None,
+                         overwrite: bool = False) -> int:
+    """
+    Usage: Import an existing llm_cache/*.pkl.gz tree into a cache store
+    :param cache_dir: str, directory containing <key>.pkl.gz and <key>.pkl.gz.prompt files
+    :param store: CacheStore, target store, defaults to the shared store
+    :param overwrite: bool, whether to overwrite records that already exist in the store
+    :return: int, number of imported records
+    """
+    store = store or get_cache_store()
+    source = PickleCacheStore(cache_dir)
+    if not os.path.exists(cache_dir):
+        return 0
+    imported = 0
+    for filename in os.listdir(cache_dir):
+        if not filename.endswith('.pkl.gz'):
+            continue
+        key = filename[:-len('.pkl.gz')]
+        if not overwrite and store.get(key) is not None:
+            continue
+        record = source.get(key)
+        if record is None:
+            continue
+        store.put(key, record['response'], prompt=record['prompt'], created_at=record['created_at'])
+        imported += 1
+    return imported
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="LLM cache store tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    migrate_parser = subparsers.add_parser("migrate", help="import llm_cache/*.pkl.gz into the SQLite store")
+    migrate_parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    migrate_parser.add_argument("--db", default=DEFAULT_DB_PATH)
+    migrate_parser.add_argument("--overwrite", action="store_true")
+    reindex_parser = subparsers.add_parser("reindex", help="build the history index for existing records")
+    reindex_parser.add_argument("--db", default=DEFAULT_DB_PATH)
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        count = migrate_pickle_cache(args.cache_dir, SQLiteCacheStore(args.db), overwrite=args.overwrite)
+        print(json.dumps({"imported": count, "db": args.db}))
+    elif args.command == "reindex":
+        print(json.dumps({"indexed": SQLiteCacheStore(args.db).reindex(), "db": args.db}))
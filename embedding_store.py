@@ -0,0 +1,208 @@
+"""
+Usage: Persistent embedding cache keyed by (embedding model name, text hash)
+Export: EmbeddingStore, CachedEmbeddings, EMBEDDING_STORE, get_embedding_store, embedding_model_name,
+        embedding_store_stats, file_lock
+Methods:
+    - EmbeddingStore.embed: Vectors for a list of texts; missing texts are embedded in one batched call and appended
+    - CachedEmbeddings: Drop-in wrapper for LangChain embeddings (embed_documents / embed_query) backed by the store
+    - file_lock: Inter-process lock for the append-only vector files (also used by semantic_cache)
+Files (one set per embedding model, under embedding_store/):
+    <model>.f32   float32 rows, appended only, opened with np.memmap so untouched rows are never read into RAM
+    <model>.idx   16-byte MD5 digest of each row's text, in row order (the compact side index)
+    <model>.json  vector dimension
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+file_dir = os.path.dirname(os.path.abspath(__file__))
+
+# 设置 HUST_GEN_PAPER_EMBEDDING_STORE=0 关闭嵌入向量缓存
+EMBEDDING_STORE = os.getenv("HUST_GEN_PAPER_EMBEDDING_STORE", "1") == "1"
+DEFAULT_STORE_DIR = os.path.join(file_dir, 'embedding_store')
+DIGEST_SIZE = 16
+
+
+def embedding_model_name(embeddings) -> str:
+    """嵌入模型的名字，用作向量文件名，不同模型的向量不能混用"""
+    name = getattr(embeddings, 'model_name', None) or getattr(embeddings, 'model', None) or type(embeddings).__name__
+    return re.sub(r'[^\w.-]', '_', str(name))
+
+
+@contextmanager
+def file_lock(path: str):
+    """多个进程同时追加时用文件锁保证行号一致；没有 fcntl 的平台只有进程内的锁"""
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    with open(path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class EmbeddingStore:
+    """一个嵌入模型的向量库：向量按行追加到 float32 文件，摘要索引常驻内存，向量按需从 memmap 读取"""
+
+    def __init__(self, name: str, directory: str = DEFAULT_STORE_DIR):
+        self.name = name
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, name)
+        self.vectors_path = base + '.f32'
+        self.index_path = base + '.idx'
+        self.meta_path = base + '.json'
+        self.dim: Optional[int] = None
+        self._rows: Dict[bytes, int] = {}
+        self._count = 0
+        self._matrix = None
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'embed_calls': 0, 'embed_seconds': 0.0}
+        with self._lock:
+            self._refresh()
+
+    @staticmethod
+    def _digest(text: str, kind: str) -> bytes:
+        # 部分模型的 embed_query 和 embed_documents 结果不同，两者分开缓存
+        return hashlib.md5(f"{kind}\0{text}".encode('utf-8')).digest()
+
+    def _refresh(self):
+        """读取索引中新增的行（包括其他进程追加的），调用方持有 self._lock"""
+        if self.dim is None:
+            if not os.path.exists(self.meta_path):
+                return
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                self.dim = json.load(f)['dim']
+        if not os.path.exists(self.index_path) or not os.path.exists(self.vectors_path):
+            return
+        # 写到一半的行不计入
+        total = min(os.path.getsize(self.index_path) // DIGEST_SIZE,
+                    os.path.getsize(self.vectors_path) // (4 * self.dim))
+        if total <= self._count:
+            return
+        with open(self.index_path, 'rb') as f:
+            f.seek(self._count * DIGEST_SIZE)
+            data = f.read((total - self._count) * DIGEST_SIZE)
+        for i in range(total - self._count):
+            self._rows.setdefault(data[i * DIGEST_SIZE:(i + 1) * DIGEST_SIZE], self._count + i)
+        self._count = total
+        self._matrix = None
+
+    def _vectors(self) -> np.ndarray:
+        if self._matrix is None:
+            self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(self._count, self.dim))
+        return self._matrix
+
+    def _append(self, digests: List[bytes], vectors: np.ndarray):
+        with self._lock, file_lock(self.index_path + '.lock'):
+            self._refresh()
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+                with open(self.meta_path, 'w', encoding='utf-8') as f:
+                    json.dump({'dim': self.dim}, f)
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"embedding dimension changed from {self.dim} to {vectors.shape[1]}")
+            keep = [i for i, digest in enumerate(digests) if digest not in self._rows]
+            if not keep:
+                return
+            # 截掉上次中断时写了一半的行，保证向量行号和索引行号一致
+            for path, row_size in ((self.vectors_path, 4 * self.dim), (self.index_path, DIGEST_SIZE)):
+                if os.path.exists(path) and os.path.getsize(path) != self._count * row_size:
+                    os.truncate(path, self._count * row_size)
+            # 先写向量再写索引，索引里出现的行一定有完整的向量
+            with open(self.vectors_path, 'ab') as f:
+                f.write(np.ascontiguousarray(vectors[keep], dtype=np.float32).tobytes())
+            with open(self.index_path, 'ab') as f:
+                f.write(b"".join(digests[i] for i in keep))
+            for offset, i in enumerate(keep):
+                self._rows[digests[i]] = self._count + offset
+            self._count += len(keep)
+            self._matrix = None
+
+    def embed(self, texts: List[str], embed_fn: Callable, kind: str = "document") -> np.ndarray:
+        """
+        Usage: Return one vector per text, embedding only the texts that are not stored yet
+        :param texts: list of str
+        :param embed_fn: callable(list of str) -> list of vectors, called at most once with all missing texts
+        :param kind: str, 'document' or 'query'
+        :return: np.ndarray of shape (len(texts), dim), float32
+        """
+        digests = [self._digest(text, kind) for text in texts]
+        with self._lock:
+            if any(digest not in self._rows for digest in digests):
+                self._refresh()
+            missing = {}
+            for digest, text in zip(digests, texts):
+                if digest not in self._rows and digest not in missing:
+                    missing[digest] = text
+            self._counters['hits'] += len(texts) - len(missing)
+            self._counters['misses'] += len(missing)
+        if missing:
+            start = time.perf_counter()
+            vectors = np.asarray(embed_fn(list(missing.values())), dtype=np.float32)
+            with self._lock:
+                self._counters['embed_calls'] += 1
+                self._counters['embed_seconds'] += time.perf_counter() - start
+            self._append(list(missing.keys()), vectors)
+        if not texts:
+            return np.zeros((0, self.dim or 0), dtype=np.float32)
+        with self._lock:
+            rows = [self._rows[digest] for digest in digests]
+            # 花式索引只复制用到的行
+            return np.array(self._vectors()[rows])
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._counters)
+            stats['vectors'] = self._count
+            stats['dim'] = self.dim
+        return stats
+
+
+class CachedEmbeddings:
+    """包装 LangChain 嵌入模型：先查向量库，缺失的文本合并成一次 embed_documents 调用"""
+
+    def __init__(self, embeddings, store: Optional[EmbeddingStore] = None):
+        self.embeddings = embeddings
+        self.model_name = embedding_model_name(embeddings)
+        self.store = store or get_embedding_store(self.model_name)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.store.embed(texts, self.embeddings.embed_documents).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.store.embed([text], lambda texts: [self.embeddings.embed_query(texts[0])], kind="query")[0].tolist()
+
+    def __getattr__(self, name):
+        if name == 'embeddings':
+            raise AttributeError(name)
+        return getattr(self.embeddings, name)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_embedding_store(name: str) -> EmbeddingStore:
+    """按嵌入模型名获取进程内共享的向量库"""
+    with _stores_lock:
+        if name not in _stores:
+            _stores[name] = EmbeddingStore(name)
+        return _stores[name]
+
+
+def embedding_store_stats() -> Dict:
+    with _stores_lock:
+        stores = dict(_stores)
+    return {name: store.stats() for name, store in stores.items()}
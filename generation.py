@@ -0,0 +1,94 @@
+"""
+Usage: Fan out generation requests over a worker pool
+Export: generate_sections, stitch_sections, section_key, dirty_sections, generate_variants, DEFAULT_MAX_WORKERS
+Methods:
+    - generate_sections: Generate one response per section prompt with bounded concurrency, stitched in outline order
+    - section_key / dirty_sections: Key the inputs of each section so only edited sections are regenerated
+    - generate_variants: Generate prompt/temperature variants side by side and report aggregate throughput
+"""
+
+import hashlib
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional
+
+# 分段并行生成的默认并发数
+DEFAULT_MAX_WORKERS = 4
+# 分段结果之间的分隔
+SECTION_SEPARATOR = "\n\n"
+
+
+def generate_sections(prompts: List[str], request_fn: Callable, max_workers: int = DEFAULT_MAX_WORKERS,
+                      on_section_done: Optional[Callable] = None) -> List[str]:
+    """
+    Usage: Generate every section prompt concurrently and return the responses in prompt order
+    :param prompts: list of str, one prompt per outline point
+    :param request_fn: callable, takes a prompt and returns (cache_key, response) like LLMAgent.simple_request
+    :param max_workers: int, maximum number of concurrent requests
+    :param on_section_done: callable(index, response), called in the calling thread as each section finishes
+    :return: list of str, responses in the same order as prompts
+    """
+    results = [None] * len(prompts)
+    if not prompts:
+        return results
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(prompts))))
+    try:
+        futures = {executor.submit(request_fn, prompt): i for i, prompt in enumerate(prompts)}
+        for future in as_completed(futures):
+            i = futures[future]
+            _, response = future.result()
+            results[i] = response
+            if on_section_done is not None:
+                on_section_done(i, response)
+    except BaseException:
+        # 出错或取消时立即返回：尚未开始的段不再执行，进行中的段由 request_fn 自行检查取消后结束
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    executor.shutdown()
+    return results
+
+
+def stitch_sections(sections: List[str]) -> str:
+    """按大纲顺序拼接各部分"""
+    return SECTION_SEPARATOR.join(section.strip() for section in sections if section)
+
+
+def section_key(theme: str, outline: str, reference: str, requirements: List[str], model: str,
+                temperature: float) -> str:
+    """分段缓存的键：主题、大纲要点、参考文本、启用的要求和模型都不变时，这一段可以直接复用"""
+    data = json.dumps([theme, outline, reference, requirements, model, temperature], ensure_ascii=False)
+    return hashlib.md5(data.encode('utf-8')).hexdigest()
+
+
+def dirty_sections(keys: List[str], cached: Dict[str, str]) -> List[int]:
+    """返回没有可复用结果、需要重新生成的段的下标"""
+    return [i for i, key in enumerate(keys) if key not in cached]
+
+
+def generate_variants(variants: List[Dict], request_fn: Callable, max_workers: int = DEFAULT_MAX_WORKERS) -> Dict:
+    """
+    Usage: Generate several prompt/temperature variants in one batch over a worker pool
+    :param variants: list of dict, each with 'label', 'prompt' and 'temperature'
+    :param request_fn: callable(prompt, temperature), returns (cache_key, response)
+    :param max_workers: int, maximum number of concurrent requests
+    :return: dict, 'results' (list of dict in variant order) and aggregate 'elapsed', 'requests_per_sec', 'chars_per_sec'
+    """
+    def run(variant):
+        start = time.perf_counter()
+        cache_key, response = request_fn(variant['prompt'], variant['temperature'])
+        return dict(variant, cache_key=cache_key, response=response, elapsed=time.perf_counter() - start)
+
+    start = time.perf_counter()
+    results = []
+    if variants:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(variants)))) as executor:
+            results = list(executor.map(run, variants))
+    elapsed = time.perf_counter() - start
+    total_chars = sum(len(result['response']) for result in results)
+    return {
+        'results': results,
+        'elapsed': elapsed,
+        'requests_per_sec': len(results) / elapsed if elapsed > 0 else 0.0,
+        'chars_per_sec': total_chars / elapsed if elapsed > 0 else 0.0,
+    }
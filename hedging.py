@@ -0,0 +1,161 @@
+"""
+Usage: Hedged requests across the models configured in model_options
+Export: HedgedRequest, HEDGE_MODELS, backup_model_for, hedge_threshold, hedged_request
+Methods:
+    - HedgedRequest.stream: Stream from the primary model; if it has no first token within the threshold,
+      also start the backup model, stream from whichever produces output first and cancel the other
+    - hedge_threshold: Per-model first-token percentile from telemetry, clamped to [HEDGE_MIN_DELAY, HEDGE_MAX_DELAY]
+    - hedged_request: Blocking variant returning (cache_key, response) like LLMAgent.simple_request
+Config: HUST_GEN_PAPER_HEDGE_MODELS="qwq:latest-fixed,deepseek-chat" (models in priority order, empty disables hedging)
+Note: a cancelled request stops at its next chunk, its model stream is closed (which aborts the provider call)
+      and nothing is cached; a request still waiting for its first token keeps its connection until the
+      provider answers, because the HTTP call cannot be interrupted
+"""
+
+import os
+import queue
+import threading
+import time
+from typing import Iterator, List, Optional, Tuple
+
+from agent import get_agent, model_options
+
+# 参与对冲的模型，按优先级排列；主模型之外排在最前的模型作为备用
+HEDGE_MODELS = [model.strip() for model in os.getenv("HUST_GEN_PAPER_HEDGE_MODELS", "").split(",") if model.strip()]
+# 主模型首 token 时间的分位数，超过它还没有输出就启动备用请求
+HEDGE_PERCENTILE = 0.95
+# 统计样本不足时的默认等待时间，以及等待时间的上下限（秒）
+HEDGE_DEFAULT_DELAY = 10.0
+HEDGE_MIN_DELAY = 2.0
+HEDGE_MAX_DELAY = 60.0
+# 只使用最近一段时间（秒）的调用统计
+HEDGE_WINDOW = 7 * 24 * 3600
+
+
+def _configured_models() -> List[str]:
+    known = {model for models in model_options.values() for model in models}
+    return [model for model in HEDGE_MODELS if model in known]
+
+
+def backup_model_for(model: str) -> Optional[str]:
+    """主模型的备用模型，没有配置对冲时返回 None"""
+    for candidate in _configured_models():
+        if candidate != model:
+            return candidate
+    return None
+
+
+def hedge_threshold(model: str) -> float:
+    """主模型流式调用首 token 时间的分位数，决定多久之后发出备用请求"""
+    from telemetry import latency_percentile
+    try:
+        ttft = latency_percentile(model, HEDGE_PERCENTILE, field='ttft', mode='stream',
+                                  since=time.time() - HEDGE_WINDOW)
+    except Exception as e:
+        print(f"Error reading latency percentiles: {e}")
+        ttft = None
+    if ttft is None:
+        return HEDGE_DEFAULT_DELAY
+    return min(HEDGE_MAX_DELAY, max(HEDGE_MIN_DELAY, ttft))
+
+
+class HedgedRequest:
+    def __init__(self, prompt: str, model: str, temperature: float = 0, backup_model: Optional[str] = None,
+                 threshold: Optional[float] = None, enable_cache: bool = True):
+        self.prompt = prompt
+        self.model = model
+        self.temperature = temperature
+        self.enable_cache = enable_cache
+        self.backup_model = backup_model if backup_model is not None else backup_model_for(model)
+        self.threshold = threshold if threshold is not None else hedge_threshold(model)
+        # 胜出的模型，以及是否发出了备用请求
+        self.winner: Optional[str] = None
+        self.hedged = False
+
+    @property
+    def cache_key(self) -> Optional[str]:
+        if self.winner is None:
+            return None
+        return get_agent(self.winner, self.temperature)._request_cache_key(self.prompt)
+
+    def _race(self, model: str, results: queue.Queue, cancel: threading.Event):
+        try:
+            stream = get_agent(model, self.temperature).stream_request(self.prompt, enable_cache=self.enable_cache)
+            try:
+                for chunk in stream:
+                    if cancel.is_set():
+                        return
+                    results.put((model, 'chunk', chunk))
+            finally:
+                # 被取消时关闭流：stream_request 随之关闭模型自己的流，中止请求，不再为剩余输出付费，
+                # 未完成的结果也不会写入缓存
+                stream.close()
+            results.put((model, 'done', None))
+        except Exception as e:
+            results.put((model, 'error', e))
+
+    def stream(self) -> Iterator[str]:
+        results = queue.Queue()
+        racers = {}
+
+        def start(model):
+            racers[model] = threading.Event()
+            threading.Thread(target=self._race, args=(model, results, racers[model]),
+                             name=f"hedge-{model}", daemon=True).start()
+
+        start(self.model)
+        started = time.monotonic()
+        errors = {}
+        try:
+            # 等待第一个输出片段，决定胜出的模型
+            while self.winner is None:
+                timeout = None
+                if self.backup_model and self.backup_model not in racers:
+                    timeout = max(0.0, self.threshold - (time.monotonic() - started))
+                try:
+                    model, kind, payload = results.get(timeout=timeout)
+                except queue.Empty:
+                    self.hedged = True
+                    start(self.backup_model)
+                    continue
+                if kind == 'error':
+                    errors[model] = payload
+                    if self.backup_model and self.backup_model not in racers:
+                        # 主模型直接出错时不必等到阈值
+                        self.hedged = True
+                        start(self.backup_model)
+                    elif len(errors) == len(racers):
+                        raise errors[self.model]
+                    continue
+                self.winner = model
+                for other, cancel in racers.items():
+                    if other != model:
+                        cancel.set()
+                if kind == 'done':
+                    return
+                yield payload
+
+            while True:
+                model, kind, payload = results.get()
+                if model != self.winner:
+                    continue
+                if kind == 'chunk':
+                    yield payload
+                elif kind == 'done':
+                    return
+                else:
+                    raise payload
+        finally:
+            for cancel in racers.values():
+                cancel.set()
+
+    def result(self) -> Tuple[str, str]:
+        response = "".join(self.stream())
+        return self.cache_key, response
+
+
+def hedged_request(prompt: str, model: str, temperature: float = 0, enable_cache: bool = True) -> Tuple[str, str]:
+    """有备用模型时对冲请求，否则等同于 simple_request"""
+    if backup_model_for(model) is None:
+        return get_agent(model, temperature).simple_request(prompt, enable_cache=enable_cache)
+    return HedgedRequest(prompt, model, temperature, enable_cache=enable_cache).result()
@@ -0,0 +1,53 @@
+"""
+Usage: Text helpers for the history index stored next to the LLM response cache
+Export: PREVIEW_CHARS, make_preview, index_terms, query_terms
+Methods:
+    - make_preview: Short single-line preview shown in the history list
+    - index_terms: Search terms of a text, CJK unigrams and bigrams plus lower-cased latin words
+    - query_terms: Terms a search query must all match
+Note: bigrams make Chinese search work without a word segmenter; a query matches an entry containing
+      every bigram of the query, which is close to (but looser than) a substring match
+"""
+
+import re
+from typing import Set
+
+# 历史列表中预览的字符数
+PREVIEW_CHARS = 200
+# 每个字段只索引前这么多字符，避免超长文章拖慢写入
+INDEX_MAX_CHARS = 20000
+
+_TOKEN_RE = re.compile(r'[㐀-䶿一-鿿豈-﫿]+|[A-Za-z0-9_]+')
+
+
+def make_preview(text: str, limit: int = PREVIEW_CHARS) -> str:
+    text = " ".join((text or "").split())
+    return text[:limit] + ("..." if len(text) > limit else "")
+
+
+def _terms(text: str) -> Set[str]:
+    terms = set()
+    for token in _TOKEN_RE.findall(text):
+        if token.isascii():
+            terms.add(token.lower())
+            continue
+        terms.update(token)
+        terms.update(token[i:i + 2] for i in range(len(token) - 1))
+    return terms
+
+
+def index_terms(text: str) -> Set[str]:
+    return _terms((text or "")[:INDEX_MAX_CHARS])
+
+
+def query_terms(query: str) -> Set[str]:
+    """连续的中文取二元组，单个汉字取单字，英文和数字按词匹配"""
+    terms = set()
+    for token in _TOKEN_RE.findall(query or ""):
+        if token.isascii():
+            terms.add(token.lower())
+        elif len(token) == 1:
+            terms.add(token)
+        else:
+            terms.update(token[i:i + 2] for i in range(len(token) - 1))
+    return terms
@@ -0,0 +1,251 @@
+"""
+Usage: Extract reference text from uploaded PDF / DOCX / TXT files on a process pool
+Dependencies: pdfplumber (PDF), python-docx (DOCX); both optional, TXT needs nothing
+Export: ingest_file, iter_pages, normalize_text, content_hash, SUPPORTED_EXTENSIONS
+Methods:
+    - iter_pages: Yield (page number, text) in page order while later pages are still being extracted
+    - ingest_file: Extract, normalize and chunk one file, cached by the SHA-256 of its content
+    - normalize_text: Join wrapped lines, drop page numbers and control characters
+Run: python ingest.py paper.pdf notes.docx [--chunk-size 300]
+"""
+
+import gzip
+import hashlib
+import io
+import json
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+file_dir = os.path.dirname(os.path.abspath(__file__))
+
+SUPPORTED_EXTENSIONS = ("pdf", "docx", "txt", "md")
+DEFAULT_CACHE_DIR = os.path.join(file_dir, 'ingest_cache')
+# 解析 PDF 的进程数，每个进程一次处理 PAGES_PER_TASK 页
+INGEST_WORKERS = int(os.getenv("HUST_GEN_PAPER_INGEST_WORKERS", min(4, os.cpu_count() or 1)))
+PAGES_PER_TASK = 8
+
+_control_chars = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]')
+_page_number = re.compile(r'^\s*(第\s*\d+\s*页|-?\s*\d+\s*-?|\d+\s*/\s*\d+)\s*$')
+_sentence_end = re.compile(r'[。！？；：!?;:」』”）)]$')
+_cjk_end = re.compile(r'[一-鿿　-〿＀-￯]$')
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _format_table(table: List[List]) -> str:
+    """表格按行输出，单元格之间用 | 分隔"""
+    rows = []
+    for row in table:
+        cells = [" ".join(str(cell).split()) if cell is not None else "" for cell in row]
+        if any(cells):
+            rows.append(" | ".join(cells))
+    return "\n".join(rows)
+
+
+def _extract_pdf_pages(data: bytes, start: int, end: int) -> List[str]:
+    """在子进程中提取 [start, end) 页的正文和表格"""
+    import pdfplumber
+    pages = []
+    with pdfplumber.open(io.BytesIO(data)) as pdf:
+        for page in pdf.pages[start:end]:
+            parts = [page.extract_text() or ""]
+            for table in page.extract_tables():
+                formatted = _format_table(table)
+                if formatted:
+                    parts.append(formatted)
+            pages.append("\n\n".join(part for part in parts if part.strip()))
+    return pages
+
+
+def _count_pdf_pages(data: bytes) -> int:
+    import pdfplumber
+    with pdfplumber.open(io.BytesIO(data)) as pdf:
+        return len(pdf.pages)
+
+
+def _extract_docx(data: bytes) -> str:
+    """按文档顺序提取段落和表格"""
+    import docx
+    from docx.table import Table
+    from docx.text.paragraph import Paragraph
+    document = docx.Document(io.BytesIO(data))
+    parts = []
+    for element in document.element.body.iterchildren():
+        tag = element.tag.rsplit('}', 1)[-1]
+        if tag == 'p':
+            parts.append(Paragraph(element, document).text)
+        elif tag == 'tbl':
+            table = Table(element, document)
+            parts.append(_format_table([[cell.text for cell in row.cells] for row in table.rows]))
+    return "\n".join(parts)
+
+
+def _decode_text(data: bytes) -> str:
+    # 中文文本文件常见 GBK 编码
+    for encoding in ("utf-8-sig", "gb18030"):
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return data.decode("utf-8", errors="replace")
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """进程内共享的解析进程池；使用 spawn，避免在多线程的 Streamlit 进程中 fork"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            import multiprocessing
+            _pool = ProcessPoolExecutor(max_workers=max(1, INGEST_WORKERS),
+                                        mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def iter_pages(name: str, data: bytes) -> Iterator[Tuple[int, str]]:
+    """
+    Usage: Extract a file page by page
+    :param name: str, file name, the extension selects the parser
+    :param data: bytes, file content
+    :return: iterator of (page number starting at 1, raw page text), in page order
+    """
+    extension = name.rsplit('.', 1)[-1].lower() if '.' in name else ""
+    if extension == "pdf":
+        pool = get_process_pool()
+        total = pool.submit(_count_pdf_pages, data).result()
+        # 多个进程同时解析不同的页段，按页码顺序逐页返回
+        futures = [pool.submit(_extract_pdf_pages, data, start, min(start + PAGES_PER_TASK, total))
+                   for start in range(0, total, PAGES_PER_TASK)]
+        page_number = 0
+        try:
+            for future in futures:
+                for text in future.result():
+                    page_number += 1
+                    yield page_number, text
+        finally:
+            for future in futures:
+                future.cancel()
+    elif extension == "docx":
+        yield 1, get_process_pool().submit(_extract_docx, data).result()
+    elif extension in ("txt", "md"):
+        yield 1, _decode_text(data)
+    else:
+        raise ValueError(f"unsupported file type: {name}")
+
+
+def normalize_text(text: str) -> str:
+    """合并 PDF 排版造成的断行，去掉页码行和控制字符，段落之间保留一个空行"""
+    text = _control_chars.sub("", text.replace("\r\n", "\n").replace("\r", "\n"))
+    paragraphs = []
+    current = ""
+    for line in text.split("\n"):
+        line = line.strip()
+        if not line or _page_number.match(line):
+            if current:
+                paragraphs.append(current)
+                current = ""
+            continue
+        if not current:
+            current = line
+        elif " | " in line or " | " in current or _sentence_end.search(current):
+            # 表格行和完整的句子单独成段
+            paragraphs.append(current)
+            current = line
+        elif current.endswith("-") and not _cjk_end.search(current):
+            current = current[:-1] + line
+        elif _cjk_end.search(current):
+            current += line
+        else:
+            current += " " + line
+    if current:
+        paragraphs.append(current)
+    return "\n".join(paragraphs)
+
+
+def _cache_path(cache_dir: str, digest: str) -> str:
+    return os.path.join(cache_dir, f"{digest}.json.gz")
+
+
+def _load_cached(cache_dir: str, digest: str) -> Optional[List[str]]:
+    path = _cache_path(cache_dir, digest)
+    if not os.path.exists(path):
+        return None
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            return json.load(f)['pages']
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Error loading ingest cache: {e}, removing invalid file")
+        os.remove(path)
+        return None
+
+
+def _save_cached(cache_dir: str, digest: str, name: str, pages: List[str]):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = _cache_path(cache_dir, digest)
+    # 先写临时文件再 rename，避免并发读到写了一半的文件
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+        json.dump({'name': name, 'pages': pages}, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def ingest_file(name: str, data: bytes, chunk_size: Optional[int] = None,
+                on_page: Optional[Callable] = None, cache_dir: str = DEFAULT_CACHE_DIR) -> Dict:
+    """
+    Usage: Extract, normalize and chunk one uploaded file
+    :param name: str, file name
+    :param data: bytes, file content
+    :param chunk_size: int, maximum characters per chunk, defaults to retrieval.CHUNK_SIZE
+    :param on_page: callable(page number, page text), called as each page is extracted
+    :param cache_dir: str, directory of the extraction cache
+    :return: dict, 'hash', 'name', 'pages', 'text', 'chunks' and 'cached' (True when served from the cache)
+    """
+    from retrieval import CHUNK_SIZE, chunk_text
+
+    digest = content_hash(data)
+    pages = _load_cached(cache_dir, digest)
+    cached = pages is not None
+    if cached:
+        for page_number, text in enumerate(pages, 1):
+            if on_page is not None:
+                on_page(page_number, text)
+    else:
+        pages = []
+        for page_number, text in iter_pages(name, data):
+            text = normalize_text(text)
+            pages.append(text)
+            if on_page is not None:
+                on_page(page_number, text)
+        _save_cached(cache_dir, digest, name, pages)
+
+    text = "\n".join(page for page in pages if page)
+    # 片段之间不重叠，拼接后就是完整的正文
+    chunks = chunk_text(text, chunk_size=chunk_size or CHUNK_SIZE, overlap=0)
+    return {'hash': digest, 'name': name, 'pages': len(pages), 'text': text, 'chunks': chunks, 'cached': cached}
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Extract reference text from PDF / DOCX / TXT files")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--chunk-size", type=int, default=None)
+    args = parser.parse_args()
+
+    for path in args.files:
+        with open(path, 'rb') as f:
+            result = ingest_file(os.path.basename(path), f.read(), chunk_size=args.chunk_size)
+        print(json.dumps({key: result[key] for key in ('name', 'hash', 'pages', 'cached')} |
+                         {'chars': len(result['text']), 'chunks': len(result['chunks'])}, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
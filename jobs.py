@@ -0,0 +1,267 @@
+"""
+Usage: In-process generation job queue with a bounded backlog and a worker pool
+Export: Job, JobQueue, QueueFullError, get_job_queue
+Methods:
+    - JobQueue.submit: Queue a generation job, raises QueueFullError when the backlog is full
+    - JobQueue.get / wait / cancel: Poll, block on or cancel a job
+    - Job.snapshot: JSON-serializable status of a job, including the text generated so far
+Note: jobs run through the shared LLMAgent pool, so they share the response cache with the web page
+"""
+
+import os
+import queue
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from agent import DEFAULT_MODEL, get_agent
+from generation import DEFAULT_MAX_WORKERS, generate_sections, stitch_sections
+from hedging import HedgedRequest, backup_model_for
+
+# 工作线程数和排队上限
+JOB_WORKERS = int(os.getenv("HUST_GEN_PAPER_JOB_WORKERS", DEFAULT_MAX_WORKERS))
+JOB_QUEUE_SIZE = int(os.getenv("HUST_GEN_PAPER_JOB_QUEUE_SIZE", 64))
+# 已结束的任务保留多久（秒）后清理
+JOB_RETENTION = 3600
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+
+class QueueFullError(Exception):
+    """排队任务已达上限"""
+
+
+class JobCancelled(Exception):
+    """任务在生成过程中被取消"""
+
+
+class Job:
+    def __init__(self, prompt: str, model: str, temperature: float, section_prompts: Optional[List[str]] = None,
+                 max_chars: Optional[int] = None, max_workers: Optional[int] = None, enable_cache: bool = True):
+        self.id = uuid.uuid4().hex
+        self.prompt = prompt
+        self.model = model
+        self.temperature = temperature
+        self.section_prompts = section_prompts
+        # 输出字符上限，超出后视为取消（用于限制预生成的浪费）
+        self.max_chars = max_chars
+        # 分段生成时的并发请求数
+        self.max_workers = max_workers or DEFAULT_MAX_WORKERS
+        # False 时跳过响应缓存强制重新生成（新结果仍会写入缓存）
+        self.enable_cache = enable_cache
+        self.status = QUEUED
+        self.chunks: List[str] = []
+        # 已生成的字符数，逐片段累加，避免每个片段都重新求和
+        self._chars = 0
+        # 是否因超出字数上限而停止
+        self.capped = False
+        self.sections_done = 0
+        self.sections: List[str] = []
+        self.result: Optional[str] = None
+        self.cache_key: Optional[str] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.cancel_event = threading.Event()
+        self.done_event = threading.Event()
+        self._lock = threading.Lock()
+
+    def text(self) -> str:
+        with self._lock:
+            return self.result if self.result is not None else "".join(self.chunks)
+
+    def append(self, chunk: str):
+        with self._lock:
+            self.chunks.append(chunk)
+            self._chars += len(chunk)
+            max_chars = self.max_chars
+            self.capped = max_chars is not None and self._chars > max_chars
+        if self.capped:
+            raise JobCancelled(f"output exceeded {max_chars} chars")
+
+    def lift_cap(self) -> bool:
+        """解除字数上限；任务已经因超出上限或其他原因停止时返回 False，调用方需要重新提交"""
+        with self._lock:
+            self.max_chars = None
+            return not self.capped and self.status not in (FAILED, CANCELLED)
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATES
+
+    def snapshot(self, include_text: bool = True) -> Dict:
+        snapshot = {
+            'id': self.id,
+            'status': self.status,
+            'model': self.model,
+            'temperature': self.temperature,
+            'sections': len(self.section_prompts) if self.section_prompts else 0,
+            'sections_done': self.sections_done,
+            'max_chars': self.max_chars,
+            'enable_cache': self.enable_cache,
+            'chars': len(self.text()),
+            'cache_key': self.cache_key,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+        if include_text:
+            snapshot['text'] = self.text()
+            # 分段任务的各段结果，按 section_prompts 的顺序
+            snapshot['section_texts'] = self.sections
+        return snapshot
+
+
+class JobQueue:
+    def __init__(self, workers: int = JOB_WORKERS, max_queue: int = JOB_QUEUE_SIZE):
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._workers = [threading.Thread(target=self._work, name=f"generation-worker-{i}", daemon=True)
+                         for i in range(max(1, workers))]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, prompt: str, model: str = DEFAULT_MODEL, temperature: float = 0,
+               section_prompts: Optional[List[str]] = None, max_chars: Optional[int] = None,
+               max_workers: Optional[int] = None, enable_cache: bool = True) -> Job:
+        job = Job(prompt, model, temperature, section_prompts, max_chars, max_workers, enable_cache)
+        with self._lock:
+            self._cleanup()
+            self._jobs[job.id] = job
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job.id]
+            raise QueueFullError(f"job queue is full ({self._queue.maxsize} jobs waiting)")
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def wait(self, job_id: str, timeout: Optional[float] = None) -> Optional[Job]:
+        job = self.get(job_id)
+        if job is not None:
+            job.done_event.wait(timeout)
+        return job
+
+    def cancel(self, job_id: str) -> bool:
+        job = self.get(job_id)
+        if job is None or job.finished:
+            return False
+        job.cancel_event.set()
+        if job.status == QUEUED:
+            self._finish(job, CANCELLED)
+        return True
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def _cleanup(self):
+        now = time.time()
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished and job.finished_at and now - job.finished_at > JOB_RETENTION]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def _finish(self, job: Job, status: str, error: Optional[str] = None):
+        with job._lock:
+            if job.status in FINISHED_STATES:
+                return
+            job.status = status
+            job.error = error
+            job.finished_at = time.time()
+        job.done_event.set()
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job.cancel_event.is_set():
+                self._finish(job, CANCELLED)
+                continue
+            job.status = RUNNING
+            job.started_at = time.time()
+            try:
+                self._run(job)
+            except JobCancelled as e:
+                self._finish(job, CANCELLED, str(e))
+            except BaseException as e:
+                # GeneratorExit 等也只结束当前任务，工作线程继续处理队列
+                self._finish(job, FAILED, f"{type(e).__name__}: {e}")
+            else:
+                self._finish(job, DONE)
+            finally:
+                # 兜底：任何情况下等待方都能拿到结束状态（已结束的任务不会被覆盖）
+                self._finish(job, FAILED, "worker stopped unexpectedly")
+
+    @staticmethod
+    def _stream(job: Job, prompt: str, on_chunk=None) -> Tuple[Optional[str], str]:
+        """
+        流式生成一个 prompt，每个片段之后检查取消；返回 (cache_key, response)。
+        取消或超出字数上限时关闭流，模型请求随之中止，未完成的结果不会写入缓存
+        """
+        if backup_model_for(job.model) is not None:
+            # 主模型首 token 太慢时同时请求备用模型，用先输出的结果
+            hedged = HedgedRequest(prompt, job.model, job.temperature, enable_cache=job.enable_cache)
+            stream = hedged.stream()
+        else:
+            hedged = None
+            stream = get_agent(job.model, job.temperature).stream_request(prompt, enable_cache=job.enable_cache)
+        chunks = []
+        try:
+            for chunk in stream:
+                if job.cancelled:
+                    raise JobCancelled("cancelled")
+                chunks.append(chunk)
+                if on_chunk is not None:
+                    on_chunk(chunk)
+        finally:
+            stream.close()
+        if hedged is not None:
+            return hedged.cache_key, "".join(chunks)
+        return get_agent(job.model, job.temperature)._request_cache_key(prompt), "".join(chunks)
+
+    def _run(self, job: Job):
+        if job.section_prompts:
+            def request_section(section_prompt):
+                # 取消后尚未开始的段直接放弃，进行中的段在下一个片段处中止
+                if job.cancelled:
+                    raise JobCancelled("cancelled")
+                return self._stream(job, section_prompt)
+
+            def on_section_done(i, response):
+                job.sections_done += 1
+
+            try:
+                job.sections = generate_sections(job.section_prompts, request_section,
+                                                 max_workers=job.max_workers, on_section_done=on_section_done)
+            except BaseException:
+                # 某一段失败时其他进行中的段也没有意义了
+                job.cancel_event.set()
+                raise
+            job.result = stitch_sections(job.sections)
+            return
+        job.cache_key, job.result = self._stream(job, job.prompt, on_chunk=job.append)
+
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """进程内共享的任务队列，第一次使用时才启动工作线程"""
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            _job_queue = JobQueue()
+        return _job_queue
@@ -3,33 +3,98 @@ from app import AppFramework
 from typing import List, Dict
 import os
 import time
-import gzip
-import pickle
+import urllib.error
 
 DEBUG = False
 
-from agent import agent
+from agent import agent, get_agent
+from cache_store import get_cache_store
+from generation import DEFAULT_MAX_WORKERS, dirty_sections, generate_variants, section_key, stitch_sections
+from jobs import QueueFullError, get_job_queue
+from tokens import count_tokens, plan_budget, trim_references
+from retrieval import DEFAULT_SECTION_TOKEN_BUDGET, DEFAULT_TOP_K, compress_references
+from service import SERVICE_URL, ServiceClient
+from session_store import SESSION_STORE, get_session_store
+from ingest import SUPPORTED_EXTENSIONS, ingest_file
+from prompt_builder import (DEFAULT_REQUIREMENTS, build_outline_text, build_section_prompts,
+                            generate_prompt, select_requirements)
 
 # 大模型接口调用函数
-def generate_result(prompt: str) -> str:
+def generate_variant_result(prompt: str, temperature: float):
     """
-    本地的大模型接口调用
+    指定温度的大模型接口调用，每个温度的结果单独缓存
     """
-    return agent.simple_request(prompt)
+    if SERVICE_URL:
+        job = ServiceClient(SERVICE_URL).generate(prompt, model=agent.model, temperature=temperature)
+        return job['cache_key'], job['text']
+    return get_agent(agent.model, temperature).simple_request(prompt)
 
-def generate_prompt(prompt: str, requirements: List[str]) -> str:
-    """生成prompt"""
-    return f"原始文本：\n{prompt}\n\n修改要求如下:\n" + "\n".join(requirements)
+def submit_generation(prompt: str, section_prompts: List[str] = None, max_workers: int = None,
+                      max_chars: int = None, enable_cache: bool = True) -> str:
+    """
+    提交后台生成任务并返回任务 id，脚本重跑和页面交互不会中断任务；enable_cache=False 时跳过响应缓存重新生成
+    """
+    if SERVICE_URL:
+        job = ServiceClient(SERVICE_URL).submit(prompt, model=agent.model, temperature=agent.temperature,
+                                                section_prompts=section_prompts, max_workers=max_workers,
+                                                max_chars=max_chars, enable_cache=enable_cache)
+        return job['id']
+    job = get_job_queue().submit(prompt, model=agent.model, temperature=agent.temperature,
+                                 section_prompts=section_prompts, max_workers=max_workers, max_chars=max_chars,
+                                 enable_cache=enable_cache)
+    return job.id
 
-# 默认要求
-DEFAULT_REQUIREMENTS = [
-    "请帮我适当缩短文本篇幅，保证可阅读性，并将术语更加易懂化或减少，保证大一新生也能读懂，但不改变原有的结构和严谨性，并且不使用任何比喻、类比的修辞手法，保证文本的严肃性。",
-    "我希望你能保留{主题}相关的内容，因为我这个内容用意是介绍{主题}。"
-]
+def generation_status(job_id: str):
+    """
+    查询后台任务的状态和已生成的文本，任务不存在（已清理或服务重启）时返回 None；
+    生成服务暂时无法连接时抛出 urllib.error.URLError
+    """
+    if SERVICE_URL:
+        try:
+            return ServiceClient(SERVICE_URL).status(job_id)
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                return None
+            raise
+    job = get_job_queue().get(job_id)
+    return job.snapshot() if job is not None else None
+
+def cancel_generation(job_id: str):
+    """
+    取消后台任务，未完成的结果不会写入缓存；生成服务无法连接时只记录错误
+    """
+    if SERVICE_URL:
+        try:
+            ServiceClient(SERVICE_URL).cancel(job_id)
+        except urllib.error.HTTPError as e:
+            if e.code != 404:
+                raise
+        except urllib.error.URLError as e:
+            print(f"Error cancelling generation job {job_id}: {e.reason}")
+        return
+    get_job_queue().cancel(job_id)
+
+# 生成模式
+GENERATION_MODES = ["整体生成", "分段并行生成"]
+# 多版本对比可选的温度
+VARIANT_TEMPERATURES = [0.0, 0.3, 0.5, 0.7, 1.0]
+# 后台生成任务的进度刷新间隔（秒）
+JOB_POLL_INTERVAL = 1
+# 第二步每页显示的大纲要点数
+REFERENCE_PAGE_SIZE = 10
+# 历史记录每页可选的条数
+HISTORY_PAGE_SIZES = [5, 10, 20, 50]
+# 设置 HUST_GEN_PAPER_SPECULATIVE=1 时默认开启预生成：第二步生成提示词后立即在后台生成文章
+SPECULATIVE = os.getenv("HUST_GEN_PAPER_SPECULATIVE", "0") == "1"
+# 预生成的输出字符上限，超出后放弃，限制提示词被修改时浪费的 token
+SPECULATIVE_MAX_CHARS = int(os.getenv("HUST_GEN_PAPER_SPECULATIVE_MAX_CHARS", 20000))
+# 恢复草稿版本时需要清除状态的输入框
+RESTORED_WIDGET_PREFIXES = ("hust_gen_paper_theme_input", "hust_gen_paper_outlines_input",
+                            "hust_gen_paper_generated_text_display", "hust_gen_paper_final_text_display",
+                            "hust_gen_paper_reference_", "hust_req_check_", "hust_gen_paper_req_")
 
 class PaperGeneratorPage:
     def __init__(self):
-        self.cache_dir = os.path.join(os.path.dirname(__file__), 'llm_cache')
         self.init_session_state()
         self.load_from_local_cache()
 
@@ -51,19 +116,28 @@ class PaperGeneratorPage:
             print("hust_gen_paper_cache:", cached_data)
         
         if cached_data and isinstance(cached_data, dict):
-            st.session_state.hust_gen_paper_theme = cached_data.get('theme', "")
-            st.session_state.hust_gen_paper_outlines = cached_data.get('outlines', [])
-            st.session_state.hust_gen_paper_references = cached_data.get('references', [])
-            st.session_state.hust_gen_paper_requirements = cached_data.get('requirements', DEFAULT_REQUIREMENTS.copy())
-            st.session_state.hust_gen_paper_outlines_text = cached_data.get('outlines_text', "")
-            st.session_state.hust_req_selected = cached_data.get('req_selected', [True] * len(st.session_state.hust_gen_paper_requirements))  # 新增：加载选择状态
-            st.session_state.hust_gen_paper_generated_text = cached_data.get('generated_text', "")
-            st.session_state.hust_gen_paper_final_text = cached_data.get('final_text', "")
+            self.apply_session_data(cached_data)
+            # 刷新页面后重新关联仍在运行的后台任务
+            st.session_state.hust_gen_paper_job_id = cached_data.get('job_id')
+            st.session_state.hust_gen_paper_section_plan = cached_data.get('section_plan')
+            st.session_state.hust_gen_paper_speculative = cached_data.get('speculative')
             # 标记已加载
             st.session_state._cache_loaded = True
         elif DEBUG:
             print("未找到有效的缓存数据")
         
+    def apply_session_data(self, cached_data: Dict):
+        """把缓存或草稿快照中的数据写回会话状态"""
+        st.session_state.hust_gen_paper_theme = cached_data.get('theme', "")
+        st.session_state.hust_gen_paper_outlines = cached_data.get('outlines', [])
+        st.session_state.hust_gen_paper_references = cached_data.get('references', [])
+        st.session_state.hust_gen_paper_requirements = cached_data.get('requirements', DEFAULT_REQUIREMENTS.copy())
+        st.session_state.hust_gen_paper_outlines_text = cached_data.get('outlines_text', "")
+        st.session_state.hust_req_selected = cached_data.get('req_selected', [True] * len(st.session_state.hust_gen_paper_requirements))  # 新增：加载选择状态
+        st.session_state.hust_gen_paper_generated_text = cached_data.get('generated_text', "")
+        st.session_state.hust_gen_paper_final_text = cached_data.get('final_text', "")
+        st.session_state.hust_gen_paper_section_cache = cached_data.get('section_cache', {})
+
     def init_session_state(self):
         """初始化会话状态"""
         if 'hust_gen_paper_step' not in st.session_state:
@@ -84,6 +158,38 @@ class PaperGeneratorPage:
             st.session_state.hust_gen_paper_final_text = ""
         if 'hust_req_selected' not in st.session_state:
             st.session_state.hust_req_selected = [True] * len(DEFAULT_REQUIREMENTS)
+        if 'hust_gen_paper_section_prompts' not in st.session_state:
+            st.session_state.hust_gen_paper_section_prompts = []
+        # 分段的输入键（与 section_prompts 一一对应）、当前文章各段的结果（键 -> 文本）、运行中的分段任务
+        if 'hust_gen_paper_section_keys' not in st.session_state:
+            st.session_state.hust_gen_paper_section_keys = []
+        if 'hust_gen_paper_section_cache' not in st.session_state:
+            st.session_state.hust_gen_paper_section_cache = {}
+        if 'hust_gen_paper_section_plan' not in st.session_state:
+            st.session_state.hust_gen_paper_section_plan = None
+        if 'hust_gen_paper_mode' not in st.session_state:
+            st.session_state.hust_gen_paper_mode = GENERATION_MODES[0]
+        if 'hust_gen_paper_max_workers' not in st.session_state:
+            st.session_state.hust_gen_paper_max_workers = DEFAULT_MAX_WORKERS
+        if 'hust_gen_paper_auto_trim' not in st.session_state:
+            st.session_state.hust_gen_paper_auto_trim = True
+        if 'hust_gen_paper_retrieval' not in st.session_state:
+            st.session_state.hust_gen_paper_retrieval = False
+        if 'hust_gen_paper_retrieval_top_k' not in st.session_state:
+            st.session_state.hust_gen_paper_retrieval_top_k = DEFAULT_TOP_K
+        if 'hust_gen_paper_retrieval_budget' not in st.session_state:
+            st.session_state.hust_gen_paper_retrieval_budget = DEFAULT_SECTION_TOKEN_BUDGET
+        if 'hust_gen_paper_variants' not in st.session_state:
+            st.session_state.hust_gen_paper_variants = None
+        if 'hust_gen_paper_job_id' not in st.session_state:
+            st.session_state.hust_gen_paper_job_id = None
+        if 'hust_gen_paper_job_message' not in st.session_state:
+            st.session_state.hust_gen_paper_job_message = None
+        # 预生成任务：{'job_id', 'prompt', 'model', 'temperature'}，没有时为 None
+        if 'hust_gen_paper_speculative' not in st.session_state:
+            st.session_state.hust_gen_paper_speculative = None
+        if 'hust_gen_paper_speculative_enabled' not in st.session_state:
+            st.session_state.hust_gen_paper_speculative_enabled = SPECULATIVE
     
     # 业务逻辑函数
     def update_theme(self, new_theme):
@@ -99,10 +205,68 @@ class PaperGeneratorPage:
     def update_prompt(self, new_prompt):
         """更新提示词"""
         st.session_state.hust_gen_paper_generated_text = new_prompt
+        # 提示词改了，预生成的结果不再可用
+        speculative = st.session_state.hust_gen_paper_speculative
+        if speculative and speculative['prompt'] != new_prompt:
+            self.cancel_speculation()
         AppFramework.save_to_local_cache(self.get_session_data())
 
+    def start_speculation(self, prompt: str):
+        """第二步生成提示词后立即在后台生成文章，用户在第三步不修改提示词时直接复用"""
+        speculative = st.session_state.hust_gen_paper_speculative
+        if speculative and speculative['prompt'] == prompt and speculative['model'] == agent.model \
+                and speculative['temperature'] == agent.temperature:
+            return
+        self.cancel_speculation()
+        if not st.session_state.hust_gen_paper_speculative_enabled or st.session_state.hust_gen_paper_job_id \
+                or st.session_state.hust_gen_paper_mode != GENERATION_MODES[0]:
+            return
+        try:
+            job_id = submit_generation(prompt, max_chars=SPECULATIVE_MAX_CHARS)
+        except (QueueFullError, urllib.error.URLError) as e:
+            # 预生成只是优化，提交失败时等用户点击后再正常生成
+            print(f"Speculative generation skipped: {e}")
+            return
+        st.session_state.hust_gen_paper_speculative = {'job_id': job_id, 'prompt': prompt, 'model': agent.model,
+                                                       'temperature': agent.temperature}
+
+    def cancel_speculation(self):
+        """取消预生成任务"""
+        speculative = st.session_state.hust_gen_paper_speculative
+        if speculative:
+            cancel_generation(speculative['job_id'])
+            st.session_state.hust_gen_paper_speculative = None
+
+    def take_speculation(self, prompt: str):
+        """提示词和模型都没变且预生成任务仍然有效时返回它的任务 id，否则取消预生成并返回 None"""
+        speculative = st.session_state.hust_gen_paper_speculative
+        if not speculative:
+            return None
+        try:
+            job = generation_status(speculative['job_id'])
+        except urllib.error.URLError:
+            job = None
+        if speculative['prompt'] == prompt and speculative['model'] == agent.model \
+                and speculative['temperature'] == agent.temperature \
+                and job is not None and job['status'] in ("queued", "running", "done"):
+            if job['status'] == "done":
+                st.session_state.hust_gen_paper_speculative = None
+                return speculative['job_id']
+            # 用户确认使用后不再受预生成的字数上限限制；生成服务上的任务无法解除上限，取消后重新提交
+            local_job = None if SERVICE_URL else get_job_queue().get(speculative['job_id'])
+            # 解除上限前任务可能刚好超出上限而停止，这时重新提交
+            if local_job is not None and local_job.lift_cap():
+                st.session_state.hust_gen_paper_speculative = None
+                return speculative['job_id']
+        self.cancel_speculation()
+        return None
+
     def reset_to_defaults(self):
         """重置为默认设置"""
+        if st.session_state.hust_gen_paper_job_id:
+            cancel_generation(st.session_state.hust_gen_paper_job_id)
+            st.session_state.hust_gen_paper_job_id = None
+        self.cancel_speculation()
         st.session_state.hust_gen_paper_theme = ""
         st.session_state.hust_gen_paper_outlines = []
         st.session_state.hust_gen_paper_references = []
@@ -110,6 +274,11 @@ class PaperGeneratorPage:
         st.session_state.hust_gen_paper_outlines_text = ""
         st.session_state.hust_gen_paper_generated_text = ""
         st.session_state.hust_gen_paper_final_text = ""
+        st.session_state.hust_gen_paper_section_prompts = []
+        st.session_state.hust_gen_paper_section_keys = []
+        st.session_state.hust_gen_paper_section_cache = {}
+        st.session_state.hust_gen_paper_section_plan = None
+        st.session_state.hust_gen_paper_variants = None
         st.session_state.hust_gen_paper_step = 1
         st.session_state.hust_req_selected = [True] * len(DEFAULT_REQUIREMENTS)
         AppFramework.save_to_local_cache(self.get_session_data())
@@ -167,51 +336,157 @@ class PaperGeneratorPage:
             AppFramework.save_to_local_cache(self.get_session_data())
             st.rerun()
         
-        for i, outline in enumerate(st.session_state.hust_gen_paper_outlines):
-            st.subheader(f"大纲要点 {i+1}")
-            st.write(outline)
-            
-            while len(st.session_state.hust_gen_paper_references) <= i:
-                st.session_state.hust_gen_paper_references.append("")
-            
-            reference = st.text_area(
-                f"参考文本 {i+1}", 
-                value=st.session_state.hust_gen_paper_references[i],
-                key=f"hust_gen_paper_reference_{i}",
-                height=150,
-                placeholder=f"请输入关于'{outline}'的参考文本",
-                on_change=lambda i=i: (
-                    st.session_state.hust_gen_paper_references.__setitem__(
-                        i, st.session_state[f"hust_gen_paper_reference_{i}"]
-                    ),
-                    AppFramework.save_to_local_cache(self.get_session_data())
-                )
-            )
+        outlines = st.session_state.hust_gen_paper_outlines
+        references = st.session_state.hust_gen_paper_references
+        if len(references) < len(outlines):
+            references.extend([""] * (len(outlines) - len(references)))
+        self.render_reference_upload()
+        
+        # 大纲要点较多时分页显示，每个要点的编辑框是独立刷新的局部片段
+        pages = max(1, (len(outlines) + REFERENCE_PAGE_SIZE - 1) // REFERENCE_PAGE_SIZE)
+        page = st.number_input(f"页码（共 {pages} 页，{len(outlines)} 个大纲要点）", min_value=1, max_value=pages,
+                               value=1, key="hust_gen_paper_reference_page") if pages > 1 else 1
+        start = (page - 1) * REFERENCE_PAGE_SIZE
+        for i in range(start, min(start + REFERENCE_PAGE_SIZE, len(outlines))):
+            self.render_reference_editor(i, outlines[i])
         
         if st.button("生成文章", key="hust_gen_paper_generate"):
-            prompt = f"{st.session_state.hust_gen_paper_theme}\n"
-            for outline, reference in zip(st.session_state.hust_gen_paper_outlines, st.session_state.hust_gen_paper_references):
-                prompt += f"{outline}\n"
-                if reference:
-                    prompt += f"  {reference}\n"
+            references = self.get_prompt_references()
+            prompt = build_outline_text(st.session_state.hust_gen_paper_theme,
+                                        st.session_state.hust_gen_paper_outlines,
+                                        references)
             
-            selected_requirements = []
-            order = 1
-            for i, (req, is_selected) in enumerate(zip(st.session_state.hust_gen_paper_requirements, 
-                                                     st.session_state.hust_req_selected), 1):
-                if is_selected:
-                    processed_req = req.replace("{主题}", st.session_state.hust_gen_paper_theme)
-                    selected_requirements.append(f"{order}. {processed_req}")
-                    order += 1
+            selected_requirements = select_requirements(st.session_state.hust_gen_paper_requirements,
+                                                        st.session_state.hust_req_selected,
+                                                        st.session_state.hust_gen_paper_theme)
+            
+            if st.session_state.hust_gen_paper_auto_trim:
+                # 发送前预估 token，超出模型上下文时先裁剪最长的参考文本
+                budget = plan_budget(agent.model, generate_prompt(prompt, selected_requirements))
+                overflow = budget['prompt_tokens'] + min(budget['max_output'], budget['predicted_output']) \
+                    - budget['context_window']
+                if overflow > 0:
+                    references = trim_references(references, overflow, agent.model)
+                    prompt = build_outline_text(st.session_state.hust_gen_paper_theme,
+                                                st.session_state.hust_gen_paper_outlines,
+                                                references)
+                    st.toast(f"参考文本超出模型上下文，已自动裁剪约 {overflow} tokens")
             
             with st.spinner("正在生成提示词，请稍候..."):
                 generated_text = generate_prompt(prompt, selected_requirements)
+                # 分段模式下每个大纲要点单独生成
+                st.session_state.hust_gen_paper_section_prompts = build_section_prompts(
+                    st.session_state.hust_gen_paper_theme,
+                    st.session_state.hust_gen_paper_outlines,
+                    references,
+                    selected_requirements
+                )
+                st.session_state.hust_gen_paper_section_keys = [
+                    section_key(st.session_state.hust_gen_paper_theme, outline, reference, selected_requirements,
+                                agent.model, agent.temperature)
+                    for outline, reference in zip(st.session_state.hust_gen_paper_outlines, references)
+                ]
             
             st.session_state.hust_gen_paper_generated_text = generated_text
+            self.start_speculation(generated_text)
             st.session_state.hust_gen_paper_step = 3
             AppFramework.save_to_local_cache(self.get_session_data())
             st.rerun()
 
+    def render_reference_upload(self):
+        """从 PDF / DOCX / TXT 文件导入参考文本，追加到选中的大纲要点"""
+        outlines = st.session_state.hust_gen_paper_outlines
+        if not outlines:
+            return
+        with st.expander("从文件导入参考文本"):
+            files = st.file_uploader("上传文件", type=list(SUPPORTED_EXTENSIONS), accept_multiple_files=True,
+                                     key="hust_gen_paper_reference_files")
+            target = st.selectbox("追加到大纲要点", range(len(outlines)),
+                                  format_func=lambda i: f"{i+1}. {outlines[i]}", key="hust_gen_paper_reference_target")
+            if files and st.button("导入", key="hust_gen_paper_ingest"):
+                imported = []
+                for file in files:
+                    status = st.empty()
+                    status.caption(f"正在解析 {file.name}...")
+                    try:
+                        # 逐页显示解析进度
+                        result = ingest_file(file.name, file.getvalue(), on_page=lambda page, text, name=file.name:
+                                             status.caption(f"{name}：已解析 {page} 页"))
+                    except ImportError as e:
+                        st.error(f"解析 {file.name} 需要安装额外的依赖：{e.name}")
+                        continue
+                    except Exception as e:
+                        st.error(f"解析 {file.name} 失败：{e}")
+                        continue
+                    status.caption(f"{file.name}：{result['pages']} 页，{len(result['chunks'])} 个片段"
+                                   + ("（来自缓存）" if result['cached'] else ""))
+                    imported.append("\n\n".join(result['chunks']))
+                if imported:
+                    reference = st.session_state.hust_gen_paper_references[target]
+                    st.session_state.hust_gen_paper_references[target] = "\n\n".join(
+                        ([reference] if reference.strip() else []) + imported)
+                    # 清除编辑框自身的状态，使其显示导入后的内容
+                    st.session_state.pop(f"hust_gen_paper_reference_{target}", None)
+                    AppFramework.save_to_local_cache(self.get_session_data())
+                    st.toast(f"已导入 {len(imported)} 个文件到大纲要点 {target+1}")
+
+    @st.fragment
+    def render_reference_editor(self, i: int, outline: str):
+        """单个大纲要点的参考文本编辑框，修改时只重新运行这一段"""
+        st.subheader(f"大纲要点 {i+1}")
+        st.write(outline)
+        
+        reference = st.text_area(
+            f"参考文本 {i+1}", 
+            value=st.session_state.hust_gen_paper_references[i],
+            key=f"hust_gen_paper_reference_{i}",
+            height=150,
+            placeholder=f"请输入关于'{outline}'的参考文本",
+            on_change=self.update_reference,
+            args=(i,)
+        )
+        section_tokens = count_tokens(outline + "\n" + reference, agent.model)
+        st.caption(f"约 {section_tokens} tokens")
+        # 局部刷新不会运行到页面末尾，在这里写入本地缓存（只有这一段的参考文本有变化）
+        AppFramework.flush_local_cache()
+
+    def update_reference(self, i: int):
+        """更新参考文本"""
+        st.session_state.hust_gen_paper_references[i] = st.session_state[f"hust_gen_paper_reference_{i}"]
+        AppFramework.save_to_local_cache(self.get_session_data())
+
+    def get_prompt_references(self) -> List[str]:
+        """放进提示词的参考文本，开启检索压缩时只保留与大纲要点最相关的片段"""
+        references = st.session_state.hust_gen_paper_references
+        if not st.session_state.hust_gen_paper_retrieval:
+            return references
+        embeddings = agent.embeddings
+        if embeddings is None:
+            st.warning("当前模型不支持嵌入，已跳过参考文本检索压缩")
+            return references
+        with st.spinner("正在检索压缩参考文本，请稍候..."):
+            return compress_references(st.session_state.hust_gen_paper_outlines, references, embeddings,
+                                       top_k=st.session_state.hust_gen_paper_retrieval_top_k,
+                                       token_budget=st.session_state.hust_gen_paper_retrieval_budget)
+
+    def render_token_budget(self, prompt: str):
+        """显示提示词的 token 预算，预测输出是否会被截断"""
+        sections = [f"{outline}\n{reference}" for outline, reference in
+                    zip(st.session_state.hust_gen_paper_outlines, st.session_state.hust_gen_paper_references)]
+        budget = plan_budget(agent.model, prompt, sections)
+        message = (f"提示词约 {budget['prompt_tokens']} tokens，预计输出约 {budget['predicted_output']} tokens"
+                   f"（模型 {agent.model}：上下文 {budget['context_window']}，最大输出 {budget['max_output']}）")
+        if not budget['prompt_fits']:
+            st.error(message + "，提示词超出模型上下文，请开启自动裁剪或缩短参考文本")
+        elif not budget['output_fits']:
+            st.warning(message + "，输出可能被截断，建议使用分段并行生成")
+        else:
+            st.caption(message)
+        with st.expander("各部分 token 数"):
+            for i, (outline, tokens) in enumerate(zip(st.session_state.hust_gen_paper_outlines,
+                                                      budget['section_tokens'])):
+                st.write(f"{i+1}. {outline}：{tokens} tokens")
+
     def render_step3(self):
         """第三步：显示提示词并生成文章"""
         st.header("3. 提示词生成")
@@ -236,20 +511,202 @@ class PaperGeneratorPage:
             label_visibility="collapsed",
             on_change=lambda: self.update_prompt(st.session_state.hust_gen_paper_generated_text_display)
         )
+        self.render_token_budget(st.session_state.hust_gen_paper_generated_text_display)
         
-        if st.button("生成最终文章", key="hust_gen_paper_generate_final"):
-            with st.spinner("正在生成文章，请稍候..."):
-                cache_key, final_text = generate_result(st.session_state.hust_gen_paper_generated_text_display)
-                # 记录一下对应的prompt为.pkl.gz
-                with gzip.open(os.path.join(self.cache_dir, cache_key + '.pkl.gz.prompt'), 'wb') as f:
-                    pickle.dump(st.session_state.hust_gen_paper_generated_text, f)
+        section_mode = (st.session_state.hust_gen_paper_mode == "分段并行生成"
+                        and st.session_state.hust_gen_paper_section_prompts)
+        dirty = []
+        if section_mode:
+            st.info(f"分段并行生成：将按 {len(st.session_state.hust_gen_paper_section_prompts)} 个大纲要点分别生成，上方提示词的修改不会生效。")
+            dirty = dirty_sections(st.session_state.hust_gen_paper_section_keys,
+                                   st.session_state.hust_gen_paper_section_cache)
+            reused = len(st.session_state.hust_gen_paper_section_keys) - len(dirty)
+            if reused:
+                st.caption(f"{reused} 个部分的输入没有变化，将直接复用上次的结果，只重新生成 {len(dirty)} 个部分")
+        
+        speculative = st.session_state.hust_gen_paper_speculative
+        if speculative and not section_mode:
+            try:
+                job = generation_status(speculative['job_id'])
+            except urllib.error.URLError:
+                job = None
+            if job is not None and job['status'] in ("queued", "running", "done"):
+                st.caption(f"已在后台预生成 {job['chars']} 字，提示词不修改时点击“生成最终文章”直接复用")
+        
+        running = bool(st.session_state.hust_gen_paper_job_id)
+        col1, col2 = st.columns(2)
+        with col1:
+            generate = st.button("生成最终文章", key="hust_gen_paper_generate_final", disabled=running,
+                                 help="已有生成任务在运行" if running else None)
+        with col2:
+            regenerate_all = section_mode and len(dirty) < len(st.session_state.hust_gen_paper_section_keys) and \
+                st.button("全部重新生成", key="hust_gen_paper_regenerate_all", disabled=running)
+        if generate or regenerate_all:
+            if regenerate_all:
+                dirty = list(range(len(st.session_state.hust_gen_paper_section_prompts)))
+            try:
+                if section_mode:
+                    self.start_section_generation(dirty, force=bool(regenerate_all))
+                else:
+                    prompt = st.session_state.hust_gen_paper_generated_text_display
+                    st.session_state.hust_gen_paper_section_plan = None
+                    st.session_state.hust_gen_paper_job_id = self.take_speculation(prompt) or submit_generation(prompt)
+            except (QueueFullError, urllib.error.URLError) as e:
+                st.error(f"生成任务提交失败：{e}")
+            else:
+                st.session_state.hust_gen_paper_job_message = None
+                AppFramework.save_to_local_cache(self.get_session_data())
+                st.rerun()
+        
+        self.render_variants()
+        self.render_history('prompt')
+
+    def get_requirement_sets(self) -> Dict[str, List[str]]:
+        """多版本对比可选的要求组合"""
+        theme = st.session_state.hust_gen_paper_theme
+        requirements = st.session_state.hust_gen_paper_requirements
+        requirement_sets = {
+            "当前选择的要求": select_requirements(requirements, st.session_state.hust_req_selected, theme),
+            "全部要求": select_requirements(requirements, [True] * len(requirements), theme),
+            "不使用要求": [],
+        }
+        for i in range(len(requirements)):
+            selected = [j == i for j in range(len(requirements))]
+            requirement_sets[f"仅要求 {i+1}"] = select_requirements(requirements, selected, theme)
+        return requirement_sets
+
+    def render_variants(self):
+        """多版本对比：一次批量生成多个要求组合和温度的版本"""
+        with st.expander("多版本对比", expanded=st.session_state.hust_gen_paper_variants is not None):
+            requirement_sets = self.get_requirement_sets()
+            set_names = st.multiselect("要求组合", list(requirement_sets.keys()),
+                                       default=["当前选择的要求"], key="hust_gen_paper_variant_sets")
+            temperatures = st.multiselect("温度", VARIANT_TEMPERATURES, default=[0.0, 0.7],
+                                          key="hust_gen_paper_variant_temperatures")
+            
+            if st.button("批量生成", key="hust_gen_paper_generate_variants"):
+                outline_text = build_outline_text(st.session_state.hust_gen_paper_theme,
+                                                  st.session_state.hust_gen_paper_outlines,
+                                                  self.get_prompt_references())
+                variants = [
+                    {'label': f"{name} / 温度 {temperature}",
+                     'prompt': generate_prompt(outline_text, requirement_sets[name]),
+                     'temperature': temperature}
+                    for name in set_names for temperature in temperatures
+                ]
+                with st.spinner(f"正在批量生成 {len(variants)} 个版本，请稍候..."):
+                    st.session_state.hust_gen_paper_variants = generate_variants(
+                        variants, generate_variant_result,
+                        max_workers=st.session_state.hust_gen_paper_max_workers
+                    )
             
-            st.session_state.hust_gen_paper_final_text = final_text
+            batch = st.session_state.hust_gen_paper_variants
+            if not batch:
+                return
+            results = batch['results']
+            st.write(f"共 {len(results)} 个版本，总耗时 {batch['elapsed']:.1f} 秒，"
+                     f"吞吐量 {batch['requests_per_sec']:.2f} 个/秒，{batch['chars_per_sec']:.0f} 字/秒")
+            # 每行最多并排显示3个版本
+            for row_start in range(0, len(results), 3):
+                columns = st.columns(3)
+                for column, (i, result) in zip(columns, enumerate(results[row_start:row_start + 3], row_start)):
+                    with column:
+                        st.markdown(f"**{result['label']}**（{result['elapsed']:.1f} 秒）")
+                        st.text_area(result['label'], value=result['response'], height=300,
+                                     key=f"hust_gen_paper_variant_{i}", label_visibility="collapsed")
+                        if st.button("采用此版本", key=f"hust_gen_paper_use_variant_{i}"):
+                            st.session_state.hust_gen_paper_final_text = result['response']
+                            st.session_state.hust_gen_paper_step = 4
+                            AppFramework.save_to_local_cache(self.get_session_data())
+                            st.rerun()
+
+    def start_section_generation(self, dirty: List[int], force: bool = False):
+        """只为输入有变化的段提交后台任务；所有段都可复用时直接拼接出文章。force 时跳过响应缓存重新生成"""
+        keys = st.session_state.hust_gen_paper_section_keys
+        if not dirty:
+            st.session_state.hust_gen_paper_final_text = stitch_sections(
+                [st.session_state.hust_gen_paper_section_cache[key] for key in keys])
             st.session_state.hust_gen_paper_step = 4
-            AppFramework.save_to_local_cache(self.get_session_data())
-            st.rerun()
+            return
+        prompts = [st.session_state.hust_gen_paper_section_prompts[i] for i in dirty]
+        st.session_state.hust_gen_paper_job_id = submit_generation(
+            "", section_prompts=prompts, max_workers=st.session_state.hust_gen_paper_max_workers,
+            enable_cache=not force)
+        # 记录提交时的段顺序，任务期间修改参考文本也不会拼错位置
+        st.session_state.hust_gen_paper_section_plan = {'keys': list(keys), 'dirty': [keys[i] for i in dirty]}
+
+    def splice_sections(self, section_texts: List[str]) -> str:
+        """把重新生成的段写回分段缓存，按提交时的大纲顺序拼接成文章"""
+        plan = st.session_state.hust_gen_paper_section_plan
+        cache = st.session_state.hust_gen_paper_section_cache
+        cache.update(zip(plan['dirty'], section_texts))
+        # 只保留当前文章用到的段
+        st.session_state.hust_gen_paper_section_cache = {key: cache[key] for key in plan['keys'] if key in cache}
+        return stitch_sections([cache.get(key, "") for key in plan['keys']])
+
+    @st.fragment(run_every=JOB_POLL_INTERVAL)
+    def render_generation_job(self):
+        """后台生成任务的进度面板，定时局部刷新，任务结束后写入最终文章并整页刷新"""
+        job_id = st.session_state.hust_gen_paper_job_id
+        if not job_id:
+            return
+        try:
+            job = generation_status(job_id)
+        except urllib.error.URLError as e:
+            # 生成服务暂时无法连接，下次刷新时重试
+            st.warning(f"暂时无法连接生成服务：{e.reason}")
+            return
+        if job is None:
+            self.finish_generation_job("warning", "生成任务已失效，请重新生成")
+            return
+        if job['status'] == "done":
+            if st.session_state.hust_gen_paper_section_plan and job.get('section_texts'):
+                st.session_state.hust_gen_paper_final_text = self.splice_sections(job['section_texts'])
+            else:
+                # 整体生成的文章没有分段，之后不能按段复用
+                st.session_state.hust_gen_paper_final_text = job['text']
+                st.session_state.hust_gen_paper_section_cache = {}
+            st.session_state.hust_gen_paper_step = 4
+            self.finish_generation_job("success", "文章生成完成")
+            return
+        if job['status'] in ("failed", "cancelled"):
+            level = "error" if job['status'] == "failed" else "warning"
+            self.finish_generation_job(level, f"生成任务{'失败' if level == 'error' else '已取消'}：{job.get('error') or ''}")
+            return
         
-        self.render_history('prompt')
+        with st.container(border=True):
+            col1, col2 = st.columns([4, 1])
+            with col1:
+                if job['status'] == "queued":
+                    st.write("⏳ 生成任务排队中...")
+                elif job['sections']:
+                    st.progress(job['sections_done'] / job['sections'],
+                                text=f"正在分段生成：已完成 {job['sections_done']}/{job['sections']} 个部分")
+                else:
+                    st.write(f"✍️ 正在生成文章：已生成 {job['chars']} 字")
+            with col2:
+                if st.button("取消生成", key="hust_gen_paper_cancel_job"):
+                    cancel_generation(job_id)
+                    self.finish_generation_job("warning", "生成任务已取消")
+                    return
+            if job['text']:
+                with st.expander("查看已生成的内容", expanded=st.session_state.hust_gen_paper_step == 3):
+                    st.text(job['text'])
+
+    def finish_generation_job(self, level: str, message: str):
+        """结束对后台任务的跟踪，保存结果并整页刷新"""
+        st.session_state.hust_gen_paper_job_id = None
+        st.session_state.hust_gen_paper_section_plan = None
+        st.session_state.hust_gen_paper_job_message = (level, message)
+        AppFramework.save_to_local_cache(self.get_session_data())
+        st.rerun()
+
+    def render_job_message(self):
+        """显示上一个后台任务的结束信息"""
+        if st.session_state.hust_gen_paper_job_message:
+            level, message = st.session_state.hust_gen_paper_job_message
+            getattr(st, level)(message)
+            st.session_state.hust_gen_paper_job_message = None
 
     def render_step4(self):
         """第四步：显示最终生成的文章"""
@@ -288,45 +745,125 @@ class PaperGeneratorPage:
         st.divider()
         st.subheader("历史记录")
         
-        cache_files = AppFramework.load_history(self.cache_dir)
-        back_str = '.pkl.gz'
-        if history_type == 'prompt':
-            back_str += '.prompt'
-        cache_files = [cache_file for cache_file in cache_files if cache_file.endswith(back_str)]
-        if cache_files:
-            show_all = st.checkbox("显示所有历史记录", key="show_all_history")
-            display_files = cache_files if show_all else cache_files[:5]
-            
-            st.write(f"显示 {'所有' if show_all else '最近'} 生成的文章:")
-            for i, cache_file in enumerate(display_files):
-                cache_key = cache_file.replace(back_str, '')
-                try:
-                    filepath = os.path.join(self.cache_dir, cache_file)
-                    with gzip.open(filepath, 'rb') as f:
-                        cached_data = pickle.load(f)
+        # 每条缓存记录同时保存了prompt和response
+        field = 'prompt' if history_type == 'prompt' else 'response'
+        col1, col2 = st.columns([3, 1])
+        with col1:
+            query = st.text_input("搜索历史记录", key="hust_gen_paper_history_query",
+                                  placeholder="输入主题或正文中的关键词")
+        with col2:
+            page_size = st.selectbox("每页条数", HISTORY_PAGE_SIZES, key="hust_gen_paper_history_page_size")
+        total = AppFramework.count_history(query=query, field=field)
+        if not total:
+            st.write("没有找到匹配的历史记录" if query else "暂无历史记录")
+            return
+        
+        pages = (total + page_size - 1) // page_size
+        page = st.number_input(f"页码（共 {pages} 页，{total} 条）", min_value=1, max_value=pages, value=1,
+                               key="hust_gen_paper_history_page") if pages > 1 else 1
+        entries = AppFramework.load_history(query=query, field=field, limit=page_size, offset=(page - 1) * page_size)
+        for i, entry in enumerate(entries, (page - 1) * page_size + 1):
+            cache_key = entry['key']
+            title = entry['theme'] or cache_key[:20]
+            with st.expander(f"历史记录 {i} - {title} - {time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['created_at']))}"):
+                if entry.get('model'):
+                    st.write(f"模型: {entry['model']}")
+                # 列表只显示预先计算的预览，完整内容在点击后才从缓存读取
+                if field == 'prompt':
+                    st.caption(f"提示词：{entry['prompt_preview']}")
+                    st.caption(f"对应文章：{entry['preview']}")
+                else:
+                    st.caption(entry['preview'])
+                    if entry.get('prompt_preview'):
+                        st.caption(f"提示词：{entry['prompt_preview']}")
+                
+                if st.session_state.get('hust_gen_paper_history_open') == cache_key:
+                    record = get_cache_store().get(cache_key)
+                    if record is not None:
+                        st.text_area(f"完整内容 {i}", value=record[field] or "", height=300,
+                                     key=f"history_full_{cache_key}", label_visibility="collapsed")
+                elif st.button(f"查看全文 {i}", key=f"history_open_{cache_key}"):
+                    st.session_state.hust_gen_paper_history_open = cache_key
+                    st.rerun()
+                
+                if st.button(f"恢复此版本 {i}", key=f"restore_{cache_key}"):
+                    record = get_cache_store().get(cache_key)
+                    if record is not None:
+                        # 清除编辑框自身的状态，使其显示恢复后的内容
+                        if history_type == 'prompt':
+                            st.session_state.pop("hust_gen_paper_generated_text_display", None)
+                            self.update_prompt(record['prompt'])
+                        else:
+                            st.session_state.pop("hust_gen_paper_final_text_display", None)
+                            st.session_state.hust_gen_paper_final_text = record['response']
+                            AppFramework.save_to_local_cache(self.get_session_data())
+                        st.rerun()
                     
-                    with st.expander(f"历史记录 {i+1} - {cache_key[:20]}..."):
-                        st.write(f"生成时间: {time.ctime(os.path.getmtime(filepath))}")
-                        st.text_area(
-                            f"内容预览 {i+1}",
-                            value=cached_data[:500] + ("..." if len(cached_data) > 500 else ""),
-                            height=150,
-                            key=f"history_preview_{i}",
-                            label_visibility="collapsed"
-                        )
-                        
-                        if st.button(f"恢复此版本 {i+1}", key=f"restore_{i}"):
-                            st.session_state.hust_gen_paper_final_text = cached_data
-                            st.rerun()
-                            
-                        if st.button(f"删除此记录 {i+1}", key=f"delete_{i}"):
-                            os.remove(filepath)
+                if st.button(f"删除此记录 {i}", key=f"delete_{cache_key}"):
+                    get_cache_store().delete(cache_key)
+                    st.rerun()
+
+    def render_draft_versions(self):
+        """服务端草稿的历史版本，可以回滚到任意快照"""
+        session_id = AppFramework.get_session_id(create=False)
+        if not session_id:
+            return
+        with st.sidebar.expander("草稿版本"):
+            snapshots = get_session_store().list_snapshots(session_id)
+            if not snapshots:
+                st.write("暂无保存的版本")
+            for snapshot in snapshots:
+                col1, col2 = st.columns([3, 1])
+                with col1:
+                    created = time.strftime('%m-%d %H:%M:%S', time.localtime(snapshot['created_at']))
+                    st.write(f"v{snapshot['version']} {created}")
+                    st.caption(f"{snapshot['theme'] or '无主题'}，{snapshot['references']} 段参考文本，"
+                               f"文章 {snapshot['final_chars']} 字")
+                with col2:
+                    if st.button("恢复", key=f"hust_gen_paper_restore_{snapshot['version']}"):
+                        data = get_session_store().load_snapshot(session_id, snapshot['version'])
+                        if data is not None:
+                            self.apply_session_data(data)
+                            # 清除输入框自身的状态，使其显示恢复后的内容
+                            for key in list(st.session_state.keys()):
+                                if key.startswith(RESTORED_WIDGET_PREFIXES):
+                                    del st.session_state[key]
+                            AppFramework.save_to_local_cache(self.get_session_data())
                             st.rerun()
-                except Exception as e:
-                    if st.session_state.get('DEBUG', False):
-                        st.error(f"读取缓存文件 {cache_file} 失败: {str(e)}")
-        else:
-            st.write("暂无历史记录")
+
+    def render_generation_settings(self):
+        """渲染生成模式设置侧边栏"""
+        st.sidebar.header("生成模式")
+        st.sidebar.radio(
+            "生成模式",
+            GENERATION_MODES,
+            key="hust_gen_paper_mode",
+            label_visibility="collapsed",
+            help="分段并行生成：每个大纲要点单独请求大模型，并发执行后按大纲顺序拼接"
+        )
+        if st.session_state.hust_gen_paper_mode == "分段并行生成":
+            st.sidebar.slider("最大并发数", min_value=1, max_value=16, key="hust_gen_paper_max_workers")
+        st.sidebar.checkbox(
+            "自动裁剪超长参考文本",
+            key="hust_gen_paper_auto_trim",
+            help="发送前预估 token 数，提示词加预计输出超出模型上下文时，优先裁剪最长的参考文本"
+        )
+        st.sidebar.checkbox(
+            "参考文本检索压缩",
+            key="hust_gen_paper_retrieval",
+            help="参考文本过长时，按大纲要点检索最相关的片段放进提示词"
+        )
+        if st.session_state.hust_gen_paper_retrieval:
+            st.sidebar.slider("每个要点保留片段数", min_value=1, max_value=20,
+                              key="hust_gen_paper_retrieval_top_k")
+            st.sidebar.number_input("每个要点 token 预算", min_value=100, max_value=8000, step=100,
+                                    key="hust_gen_paper_retrieval_budget")
+        st.sidebar.checkbox(
+            "预生成文章",
+            key="hust_gen_paper_speculative_enabled",
+            help=f"整体生成模式下，生成提示词后立即在后台生成文章；提示词未修改时点击“生成最终文章”直接复用，"
+                 f"修改提示词会取消预生成，预生成最多输出 {SPECULATIVE_MAX_CHARS} 字"
+        )
 
     def render_requirements_management(self):
         """渲染要求管理侧边栏"""
@@ -390,12 +927,23 @@ class PaperGeneratorPage:
             'outlines_text': st.session_state.hust_gen_paper_outlines_text,
             'req_selected': st.session_state.hust_req_selected,
             'generated_text': st.session_state.hust_gen_paper_generated_text,
-            'final_text': st.session_state.hust_gen_paper_final_text
+            'final_text': st.session_state.hust_gen_paper_final_text,
+            'job_id': st.session_state.hust_gen_paper_job_id,
+            'section_cache': st.session_state.hust_gen_paper_section_cache,
+            'section_plan': st.session_state.hust_gen_paper_section_plan,
+            'speculative': st.session_state.hust_gen_paper_speculative
         }
 
     def render(self):
         """渲染整个页面"""
+        self.render_generation_settings()
         self.render_requirements_management()
+        if SESSION_STORE:
+            self.render_draft_versions()
+        # 任务在后台运行，切换步骤、编辑参考文本时进度面板始终可见
+        self.render_job_message()
+        if st.session_state.hust_gen_paper_job_id:
+            self.render_generation_job()
         
         if st.session_state.hust_gen_paper_step == 1:
             self.render_step1()
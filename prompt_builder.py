@@ -0,0 +1,75 @@
+"""
+Usage: Build generation prompts from theme, outlines, references and requirements
+Export: DEFAULT_REQUIREMENTS, generate_prompt, build_outline_text, select_requirements, build_section_prompts,
+        extract_theme, split_requirements
+Note: no streamlit dependency, shared by the web page and headless tools
+"""
+
+from typing import List, Tuple
+
+# 默认要求
+DEFAULT_REQUIREMENTS = [
+    "请帮我适当缩短文本篇幅，保证可阅读性，并将术语更加易懂化或减少，保证大一新生也能读懂，但不改变原有的结构和严谨性，并且不使用任何比喻、类比的修辞手法，保证文本的严肃性。",
+    "我希望你能保留{主题}相关的内容，因为我这个内容用意是介绍{主题}。"
+]
+
+
+# 提示词中原始文本和修改要求的分隔
+REQUIREMENTS_HEADER = "\n\n修改要求如下:\n"
+
+
+def generate_prompt(prompt: str, requirements: List[str]) -> str:
+    """生成prompt"""
+    return f"原始文本：\n{prompt}{REQUIREMENTS_HEADER}" + "\n".join(requirements)
+
+
+def split_requirements(prompt: str) -> Tuple[str, str]:
+    """把 generate_prompt 生成的提示词拆成 (原始文本部分, 修改要求部分)，没有修改要求时后者为空"""
+    body, header, requirements = prompt.rpartition(REQUIREMENTS_HEADER)
+    if not header:
+        return prompt, ""
+    return body, requirements
+
+
+def build_outline_text(theme: str, outlines: List[str], references: List[str]) -> str:
+    """把主题、大纲要点和对应的参考文本拼成原始文本"""
+    prompt = f"{theme}\n"
+    for outline, reference in zip(outlines, references):
+        prompt += f"{outline}\n"
+        if reference:
+            prompt += f"  {reference}\n"
+    return prompt
+
+
+def select_requirements(requirements: List[str], selected: List[bool], theme: str) -> List[str]:
+    """取出已启用的要求，替换{主题}占位符并重新编号"""
+    selected_requirements = []
+    order = 1
+    for req, is_selected in zip(requirements, selected):
+        if is_selected:
+            processed_req = req.replace("{主题}", theme)
+            selected_requirements.append(f"{order}. {processed_req}")
+            order += 1
+    return selected_requirements
+
+
+def build_section_prompts(theme: str, outlines: List[str], references: List[str],
+                          requirements: List[str]) -> List[str]:
+    """分段生成：每个大纲要点单独一个prompt，共用同一组要求"""
+    prompts = []
+    total = len(outlines)
+    for i, outline in enumerate(outlines):
+        reference = references[i] if i < len(references) else ""
+        section_text = build_outline_text(theme, [outline], [reference])
+        section_requirements = requirements + [
+            f"这是文章第 {i+1}/{total} 部分，只需要输出这一部分的内容，不要重复其他部分，也不要添加全文的开头和结尾。"
+        ]
+        prompts.append(generate_prompt(section_text, section_requirements))
+    return prompts
+
+
+def extract_theme(prompt: str) -> str:
+    """从 generate_prompt 生成的提示词中取出主题（原始文本的第一行）"""
+    if not prompt or not prompt.startswith("原始文本：\n"):
+        return ""
+    return prompt[len("原始文本：\n"):].split("\n", 1)[0].strip()
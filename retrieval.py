@@ -0,0 +1,119 @@
+"""
+Usage: Retrieval-based compression of long reference texts per outline point
+Export: chunk_text, estimate_tokens, compress_reference, compress_references
+Methods:
+    - chunk_text: Split a reference into sentence-aligned chunks
+    - compress_reference: Keep only the top-k chunks most similar to the outline line, within a token budget
+"""
+
+import math
+import re
+from typing import List
+
+# 每个大纲要点默认保留的片段数和 token 预算
+DEFAULT_TOP_K = 4
+DEFAULT_SECTION_TOKEN_BUDGET = 800
+CHUNK_SIZE = 300
+CHUNK_OVERLAP = 50
+
+_sentence_end = re.compile(r'(?<=[。！？；!?;])|\n+')
+_cjk = re.compile(r'[一-鿿　-〿＀-￯]')
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估计 token 数：中文按每字 1 个，其余按每 4 个字符 1 个"""
+    cjk = len(_cjk.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def chunk_text(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[str]:
+    """按句子切分后合并成不超过 chunk_size 个字符的片段，相邻片段保留 overlap 个字符的重叠"""
+    # 保留句子之间的空格，英文句子拼接后不会粘在一起
+    sentences = [s for s in _sentence_end.split(text) if s and s.strip()]
+    chunks = []
+    current = ""
+    for sentence in sentences:
+        # 超长句子直接按长度硬切
+        while len(sentence) > chunk_size:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(sentence[:chunk_size])
+            sentence = sentence[chunk_size - overlap:]
+        if current and len(current) + len(sentence) > chunk_size:
+            chunks.append(current)
+            current = current[-overlap:] if overlap else ""
+        current += sentence
+    if current:
+        chunks.append(current)
+    return [chunk.strip() for chunk in chunks if chunk.strip()]
+
+
+def _cosine(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+def _select_chunks(chunks: List[str], query_vector: List[float], chunk_vectors: List[List[float]], top_k: int,
+                   token_budget: int) -> str:
+    ranked = sorted(range(len(chunks)), key=lambda i: _cosine(query_vector, chunk_vectors[i]), reverse=True)
+
+    kept = []
+    used = 0
+    for i in ranked:
+        if len(kept) >= top_k:
+            break
+        tokens = estimate_tokens(chunks[i])
+        if used + tokens > token_budget and kept:
+            continue
+        kept.append(i)
+        used += tokens
+    # 保留原文顺序，避免打乱上下文
+    return "\n".join(chunks[i] for i in sorted(kept))
+
+
+def _chunks_to_compress(reference: str, token_budget: int) -> List[str]:
+    """需要压缩时返回切分后的片段，否则返回空列表"""
+    if not reference or estimate_tokens(reference) <= token_budget:
+        return []
+    # 不重叠切分：保留的相邻片段拼接时重叠部分不会在提示词中出现两次
+    chunks = chunk_text(reference, overlap=0)
+    return chunks if len(chunks) > 1 else []
+
+
+def compress_reference(outline: str, reference: str, embeddings, top_k: int = DEFAULT_TOP_K,
+                       token_budget: int = DEFAULT_SECTION_TOKEN_BUDGET) -> str:
+    """
+    Usage: Rank reference chunks against the outline line and keep the best ones within the token budget
+    :param outline: str, outline line used as the retrieval query
+    :param reference: str, full reference text of the outline point
+    :param embeddings: LangChain embeddings, must provide embed_query and embed_documents
+    :param top_k: int, maximum number of chunks to keep
+    :param token_budget: int, maximum estimated tokens of the kept chunks
+    :return: str, kept chunks joined in their original order
+    """
+    chunks = _chunks_to_compress(reference, token_budget)
+    if not chunks:
+        return reference
+    return _select_chunks(chunks, embeddings.embed_query(outline), embeddings.embed_documents(chunks),
+                          top_k, token_budget)
+
+
+def compress_references(outlines: List[str], references: List[str], embeddings, top_k: int = DEFAULT_TOP_K,
+                        token_budget: int = DEFAULT_SECTION_TOKEN_BUDGET) -> List[str]:
+    """对每个大纲要点的参考文本分别压缩，所有参考文本的片段合并成一次 embed_documents 调用"""
+    compressed = [references[i] if i < len(references) else "" for i in range(len(outlines))]
+    pending = {i: chunks for i, chunks in
+               ((i, _chunks_to_compress(reference, token_budget)) for i, reference in enumerate(compressed))
+               if chunks}
+    if not pending:
+        return compressed
+    vectors = embeddings.embed_documents([chunk for chunks in pending.values() for chunk in chunks])
+    offset = 0
+    for i, chunks in pending.items():
+        chunk_vectors = vectors[offset:offset + len(chunks)]
+        offset += len(chunks)
+        compressed[i] = _select_chunks(chunks, embeddings.embed_query(outlines[i]), chunk_vectors,
+                                       top_k, token_budget)
+    return compressed
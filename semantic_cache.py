@@ -0,0 +1,260 @@
+"""
+Usage: Opt-in semantic near-duplicate cache over prompt embeddings
+Export: SEMANTIC_CACHE, SEMANTIC_MAX_TOKENS, SemanticCache, get_semantic_cache, semantic_cache_stats
+Methods:
+    - lookup: Find the most similar cached prompt above the similarity threshold
+    - add: Index a prompt and the cache key of its response
+    - stats: Lookup / hit counters and embedding time, i.e. how many model calls were saved
+Files (append-only, shared by all processes, under a file lock):
+    <index>.f32   L2-normalized float32 rows, a lookup is a single matrix-vector product
+    <index>.keys  one JSON line [cache key, scope] per row
+    <index>.json  vector dimension and compaction generation
+Note: texts longer than SEMANTIC_MAX_TOKENS are neither looked up nor indexed, because the embedding model
+      truncates them and prompts that differ only after the cut would look identical
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from embedding_store import file_lock
+from retrieval import estimate_tokens
+
+file_dir = os.path.dirname(os.path.abspath(__file__))
+
+# 设置 HUST_GEN_PAPER_SEMANTIC_CACHE=1 开启语义缓存
+SEMANTIC_CACHE = os.getenv("HUST_GEN_PAPER_SEMANTIC_CACHE", "0") == "1"
+# 余弦相似度阈值，越接近 1 越严格
+SIMILARITY_THRESHOLD = float(os.getenv("HUST_GEN_PAPER_SEMANTIC_THRESHOLD", 0.97))
+# 嵌入模型的输入窗口（token），更长的文本会被截断，不参与语义缓存
+SEMANTIC_MAX_TOKENS = int(os.getenv("HUST_GEN_PAPER_SEMANTIC_MAX_TOKENS", 512))
+# 索引条目上限，只在最近的条目中查找；文件行数超过两倍上限时压缩
+MAX_ENTRIES = 20000
+DEFAULT_INDEX_PATH = os.path.join(file_dir, 'semantic_cache')
+
+
+class SemanticCache:
+    """按 scope（模型、温度、系统提示词、修改要求）隔离的近似 prompt 索引"""
+
+    def __init__(self, embeddings, threshold: float = SIMILARITY_THRESHOLD,
+                 index_path: Optional[str] = DEFAULT_INDEX_PATH, max_entries: int = MAX_ENTRIES,
+                 max_tokens: int = SEMANTIC_MAX_TOKENS):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.index_path = index_path
+        self.max_entries = max_entries
+        self.max_tokens = max_tokens
+        self._lock = threading.Lock()
+        self._reset()
+        self._counters = {'lookups': 0, 'hits': 0, 'misses': 0, 'skipped': 0, 'embed_seconds': 0.0,
+                          'best_similarity': 0.0}
+        if self.index_path:
+            with self._lock, file_lock(self.index_path + '.lock'):
+                self._migrate()
+                self._refresh()
+
+    def _reset(self):
+        self._buffer = None  # 容量按倍数增长的 (capacity, dim) float32 矩阵，前 _count 行有效
+        self._count = 0
+        self._keys: List[str] = []
+        self._scopes: List[str] = []
+        self._keys_offset = 0
+        self._dim: Optional[int] = None
+        self._generation = 0
+        self._meta_mtime = None
+
+    def _append_rows(self, vectors: np.ndarray, keys: List[str], scopes: List[str]):
+        """追加到内存矩阵，容量不足时翻倍，避免每次 vstack 复制整个矩阵"""
+        if self._buffer is None:
+            self._buffer = np.empty((max(64, len(vectors)), vectors.shape[1]), dtype=np.float32)
+        needed = self._count + len(vectors)
+        if needed > len(self._buffer):
+            grown = np.empty((max(needed, 2 * len(self._buffer)), self._buffer.shape[1]), dtype=np.float32)
+            grown[:self._count] = self._buffer[:self._count]
+            self._buffer = grown
+        self._buffer[self._count:needed] = vectors
+        self._count = needed
+        self._keys.extend(keys)
+        self._scopes.extend(scopes)
+
+    def _migrate(self):
+        """把旧版的 .npy + .json 整体索引转换成追加格式"""
+        old_vectors, old_meta = self.index_path + '.npy', self.index_path + '.json'
+        if not os.path.exists(old_vectors) or os.path.exists(self.index_path + '.f32'):
+            return
+        try:
+            vectors = np.load(old_vectors).astype(np.float32)
+            with open(old_meta, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if len(meta['keys']) == len(vectors) and len(vectors):
+                self._write_files(vectors, meta['keys'], meta['scopes'], generation=1)
+        except Exception as e:
+            print(f"Error migrating semantic cache: {e}, starting with an empty index")
+        os.remove(old_vectors)
+        # 没有转换成功时旧的 .json 和新格式的元数据同名，一并删除
+        if not os.path.exists(self.index_path + '.f32') and os.path.exists(old_meta):
+            os.remove(old_meta)
+
+    def _write_files(self, vectors: np.ndarray, keys: List[str], scopes: List[str], generation: int):
+        """整体重写索引文件（迁移和压缩时使用），调用方持有文件锁"""
+        tmp_suffix = f".{os.getpid()}.tmp"
+        with open(self.index_path + '.f32' + tmp_suffix, 'wb') as f:
+            f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        with open(self.index_path + '.keys' + tmp_suffix, 'w', encoding='utf-8') as f:
+            f.writelines(json.dumps([key, scope], ensure_ascii=False) + "\n" for key, scope in zip(keys, scopes))
+        with open(self.index_path + '.json' + tmp_suffix, 'w', encoding='utf-8') as f:
+            json.dump({'dim': int(vectors.shape[1]), 'generation': generation}, f)
+        os.replace(self.index_path + '.f32' + tmp_suffix, self.index_path + '.f32')
+        os.replace(self.index_path + '.keys' + tmp_suffix, self.index_path + '.keys')
+        os.replace(self.index_path + '.json' + tmp_suffix, self.index_path + '.json')
+
+    def _refresh(self):
+        """读取其他进程追加的行；索引被压缩过时整体重新加载。调用方持有 self._lock 和文件锁"""
+        meta_path = self.index_path + '.json'
+        if not os.path.exists(meta_path):
+            return
+        mtime = os.stat(meta_path).st_mtime_ns
+        if mtime != self._meta_mtime:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta['generation'] != self._generation or meta['dim'] != self._dim:
+                self._reset()
+                self._dim, self._generation = meta['dim'], meta['generation']
+            self._meta_mtime = mtime
+        vectors_path, keys_path = self.index_path + '.f32', self.index_path + '.keys'
+        if not os.path.exists(vectors_path) or not os.path.exists(keys_path):
+            return
+        rows = os.path.getsize(vectors_path) // (4 * self._dim) - self._count
+        if rows <= 0:
+            return
+        with open(keys_path, 'rb') as f:
+            f.seek(self._keys_offset)
+            data = f.read()
+        # 只取完整的行，写了一半的行等下次再读
+        lines = data[:data.rfind(b"\n") + 1].splitlines(keepends=True)[:rows]
+        if not lines:
+            return
+        vectors = np.fromfile(vectors_path, dtype=np.float32, count=len(lines) * self._dim,
+                              offset=self._count * 4 * self._dim).reshape(len(lines), self._dim)
+        entries = [json.loads(line) for line in lines]
+        self._append_rows(vectors, [entry[0] for entry in entries], [entry[1] for entry in entries])
+        self._keys_offset += sum(len(line) for line in lines)
+
+    def _persist(self, vector: np.ndarray, cache_key: str, scope: str):
+        """在文件锁内追加一行，调用方持有 self._lock"""
+        with file_lock(self.index_path + '.lock'):
+            self._refresh()
+            if self._dim is None or self._dim != vector.shape[0]:
+                # 第一条记录或换了嵌入模型：重新开始
+                generation = self._generation + 1
+                self._reset()
+                self._write_files(vector[np.newaxis, :], [cache_key], [scope], generation=generation)
+                self._refresh()
+                return
+            vectors_path, keys_path = self.index_path + '.f32', self.index_path + '.keys'
+            # 截掉上次中断时写了一半的行，保证向量行号和键行号一致
+            os.truncate(vectors_path, self._count * 4 * self._dim)
+            os.truncate(keys_path, self._keys_offset)
+            line = (json.dumps([cache_key, scope], ensure_ascii=False) + "\n").encode('utf-8')
+            with open(vectors_path, 'ab') as f:
+                f.write(vector.astype(np.float32).tobytes())
+            with open(keys_path, 'ab') as f:
+                f.write(line)
+            self._append_rows(vector[np.newaxis, :], [cache_key], [scope])
+            self._keys_offset += len(line)
+            if self._count > 2 * self.max_entries:
+                # 只保留最近 max_entries 条，其他进程通过 generation 发现后重新加载
+                start = self._count - self.max_entries
+                vectors, keys, scopes = self._buffer[start:self._count].copy(), self._keys[start:], self._scopes[start:]
+                generation = self._generation + 1
+                self._write_files(vectors, keys, scopes, generation=generation)
+                self._reset()
+                self._refresh()
+
+    def _embed(self, text: str) -> np.ndarray:
+        start = time.perf_counter()
+        vector = np.asarray(self.embeddings.embed_query(text), dtype=np.float32)
+        with self._lock:
+            self._counters['embed_seconds'] += time.perf_counter() - start
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _fits(self, prompt: str) -> bool:
+        if estimate_tokens(prompt) <= self.max_tokens:
+            return True
+        with self._lock:
+            self._counters['skipped'] += 1
+        return False
+
+    def lookup(self, prompt: str, scope: str) -> Optional[Tuple[str, float]]:
+        """返回 (缓存键, 相似度)，没有足够相似的条目或文本超出嵌入窗口时返回 None"""
+        if not self._fits(prompt):
+            return None
+        vector = self._embed(prompt)
+        with self._lock:
+            if self.index_path:
+                with file_lock(self.index_path + '.lock'):
+                    self._refresh()
+            self._counters['lookups'] += 1
+            if not self._count or self._buffer.shape[1] != vector.shape[0]:
+                self._counters['misses'] += 1
+                return None
+            start = max(0, self._count - self.max_entries)
+            similarities = self._buffer[start:self._count] @ vector
+            # 其他模型、温度或修改要求的结果不能复用
+            mask = np.fromiter((s == scope for s in self._scopes[start:self._count]), dtype=bool,
+                               count=self._count - start)
+            similarities = np.where(mask, similarities, -1.0)
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+            self._counters['best_similarity'] = similarity
+            if similarity < self.threshold:
+                self._counters['misses'] += 1
+                return None
+            self._counters['hits'] += 1
+            return self._keys[start + best], similarity
+
+    def add(self, prompt: str, cache_key: str, scope: str):
+        if not self._fits(prompt):
+            return
+        vector = self._embed(prompt)
+        with self._lock:
+            if self.index_path:
+                self._persist(vector, cache_key, scope)
+                return
+            if self._buffer is not None and self._buffer.shape[1] != vector.shape[0]:
+                self._reset()
+            self._append_rows(vector[np.newaxis, :], [cache_key], [scope])
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._counters)
+            stats['entries'] = min(self._count, self.max_entries)
+        # 每次语义命中都省掉了一次大模型调用
+        stats['saved_calls'] = stats['hits']
+        stats['hit_ratio'] = stats['hits'] / stats['lookups'] if stats['lookups'] else 0.0
+        return stats
+
+
+_semantic_caches = {}
+_semantic_caches_lock = threading.Lock()
+
+
+def get_semantic_cache(embeddings, name: str = "default") -> SemanticCache:
+    """按嵌入模型名获取进程内共享的语义缓存，不同嵌入模型的向量不能混用"""
+    with _semantic_caches_lock:
+        if name not in _semantic_caches:
+            index_path = DEFAULT_INDEX_PATH if name == "default" else f"{DEFAULT_INDEX_PATH}_{name}"
+            _semantic_caches[name] = SemanticCache(embeddings, index_path=index_path)
+        return _semantic_caches[name]
+
+
+def semantic_cache_stats() -> Dict:
+    """所有语义缓存的统计汇总"""
+    with _semantic_caches_lock:
+        caches = dict(_semantic_caches)
+    return {name: cache.stats() for name, cache in caches.items()}
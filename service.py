@@ -0,0 +1,214 @@
+"""
+Usage: Local HTTP generation service wrapping LLMAgent with a job queue and worker pool
+Run: python service.py [--host 127.0.0.1] [--port 8765] [--workers 4] [--queue-size 64]
+Endpoints:
+    POST   /jobs              {"prompt": ..., "model": ..., "temperature": ..., "section_prompts": [...],
+                               "max_workers": ..., "max_chars": ..., "enable_cache": ...} -> 202 job
+    GET    /jobs/<id>         job status and the text generated so far
+    GET    /jobs/<id>/stream  server-sent events: one "chunk" event per new text, then a "done" event
+    GET    /jobs/<id>/result  final text (409 while the job is still running)
+    DELETE /jobs/<id>         cancel the job
+    GET    /health            queue depth
+Export: ServiceClient, SERVICE_URL
+The Streamlit page uses the service instead of calling the model directly when HUST_GEN_PAPER_SERVICE_URL is set.
+"""
+
+import json
+import os
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator, List, Optional
+
+# 设置后网页通过该地址的生成服务请求大模型，例如 http://127.0.0.1:8765
+SERVICE_URL = os.getenv("HUST_GEN_PAPER_SERVICE_URL", "")
+# 流式接口轮询任务进度的间隔（秒）
+STREAM_POLL_INTERVAL = 0.1
+
+
+class GenerationRequestHandler(BaseHTTPRequestHandler):
+    job_queue = None
+
+    def _send_json(self, status: int, data):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _route(self):
+        parts = [part for part in self.path.split('?')[0].split('/') if part]
+        job = None
+        if len(parts) >= 2 and parts[0] == "jobs":
+            job = self.job_queue.get(parts[1])
+        return parts, job
+
+    def do_POST(self):
+        from jobs import QueueFullError
+
+        parts, _ = self._route()
+        if parts != ["jobs"]:
+            return self._send_json(404, {'error': 'not found'})
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            return self._send_json(400, {'error': 'invalid JSON body'})
+        if not payload.get('prompt') and not payload.get('section_prompts'):
+            return self._send_json(400, {'error': "'prompt' or 'section_prompts' is required"})
+        kwargs = {key: payload[key] for key in ('model', 'temperature', 'section_prompts', 'max_chars', 'max_workers',
+                                                'enable_cache')
+                  if payload.get(key) is not None}
+        # enable_cache=false 跳过响应缓存重新生成，max_chars 是预生成的字数上限，类型不对时不能静默忽略
+        if not isinstance(kwargs.get('enable_cache', True), bool):
+            return self._send_json(400, {'error': "'enable_cache' must be a boolean"})
+        if 'max_chars' in kwargs and (type(kwargs['max_chars']) is not int or kwargs['max_chars'] <= 0):
+            return self._send_json(400, {'error': "'max_chars' must be a positive integer"})
+        try:
+            job = self.job_queue.submit(payload.get('prompt', ""), **kwargs)
+        except QueueFullError as e:
+            return self._send_json(503, {'error': str(e)})
+        self._send_json(202, job.snapshot(include_text=False))
+
+    def do_GET(self):
+        parts, job = self._route()
+        if parts == ["health"]:
+            return self._send_json(200, {'status': 'ok', 'pending': self.job_queue.pending()})
+        if job is None:
+            return self._send_json(404, {'error': 'job not found'})
+        if len(parts) == 2:
+            return self._send_json(200, job.snapshot())
+        if parts[2] == "result":
+            if not job.finished:
+                return self._send_json(409, job.snapshot(include_text=False))
+            return self._send_json(200, job.snapshot())
+        if parts[2] == "stream":
+            return self._stream(job)
+        self._send_json(404, {'error': 'not found'})
+
+    def do_DELETE(self):
+        parts, job = self._route()
+        if job is None or len(parts) != 2:
+            return self._send_json(404, {'error': 'job not found'})
+        self.job_queue.cancel(job.id)
+        self._send_json(200, job.snapshot(include_text=False))
+
+    def _stream(self, job):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        sent = 0
+        try:
+            while True:
+                finished = job.finished
+                text = job.text()
+                if len(text) > sent:
+                    self._send_event("chunk", {'text': text[sent:]})
+                    sent = len(text)
+                if finished:
+                    self._send_event("done", job.snapshot(include_text=False))
+                    return
+                job.done_event.wait(STREAM_POLL_INTERVAL)
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端断开不取消任务，结果仍会写入缓存
+            return
+
+    def _send_event(self, event: str, data):
+        self.wfile.write(f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode('utf-8'))
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ServiceClient:
+    """生成服务的 HTTP 客户端，只依赖标准库"""
+
+    def __init__(self, base_url: str = SERVICE_URL, timeout: float = 30):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+    def _request(self, method: str, path: str, payload=None, timeout: Optional[float] = None):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8') if payload is not None else None
+        request = urllib.request.Request(self.base_url + path, data=data, method=method,
+                                         headers={"Content-Type": "application/json"})
+        return urllib.request.urlopen(request, timeout=timeout or self.timeout)
+
+    def submit(self, prompt: str, model: Optional[str] = None, temperature: Optional[float] = None,
+               section_prompts: Optional[List[str]] = None, max_workers: Optional[int] = None,
+               max_chars: Optional[int] = None, enable_cache: bool = True) -> dict:
+        payload = {'prompt': prompt, 'model': model, 'temperature': temperature, 'section_prompts': section_prompts,
+                   'max_workers': max_workers, 'max_chars': max_chars, 'enable_cache': enable_cache}
+        with self._request("POST", "/jobs", payload) as response:
+            return json.loads(response.read())
+
+    def status(self, job_id: str) -> dict:
+        with self._request("GET", f"/jobs/{job_id}") as response:
+            return json.loads(response.read())
+
+    def cancel(self, job_id: str) -> dict:
+        with self._request("DELETE", f"/jobs/{job_id}") as response:
+            return json.loads(response.read())
+
+    def stream(self, job_id: str) -> Iterator[str]:
+        """逐段返回任务生成的文本，任务失败时抛出 RuntimeError"""
+        with self._request("GET", f"/jobs/{job_id}/stream", timeout=3600) as response:
+            event = None
+            for raw_line in response:
+                line = raw_line.decode('utf-8').rstrip('\n')
+                if line.startswith("event: "):
+                    event = line[len("event: "):]
+                elif line.startswith("data: "):
+                    data = json.loads(line[len("data: "):])
+                    if event == "chunk":
+                        yield data['text']
+                    elif event == "done":
+                        if data['status'] != "done":
+                            raise RuntimeError(f"generation {data['status']}: {data.get('error')}")
+                        return
+
+    def generate(self, prompt: str, model: Optional[str] = None, temperature: Optional[float] = None,
+                 section_prompts: Optional[List[str]] = None, max_workers: Optional[int] = None,
+                 max_chars: Optional[int] = None, enable_cache: bool = True, poll_interval: float = 1.0) -> dict:
+        """提交任务并等待完成，返回任务的最终状态"""
+        job = self.submit(prompt, model=model, temperature=temperature, section_prompts=section_prompts,
+                          max_workers=max_workers, max_chars=max_chars, enable_cache=enable_cache)
+        while True:
+            job = self.status(job['id'])
+            if job['status'] == "done":
+                return job
+            if job['status'] in ("failed", "cancelled"):
+                raise RuntimeError(f"generation {job['status']}: {job.get('error')}")
+            time.sleep(poll_interval)
+
+
+def main():
+    import argparse
+    from jobs import JobQueue
+
+    parser = argparse.ArgumentParser(description="Local HTTP generation service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=None, help="concurrent generation jobs")
+    parser.add_argument("--queue-size", type=int, default=None, help="maximum number of waiting jobs")
+    args = parser.parse_args()
+
+    kwargs = {}
+    if args.workers is not None:
+        kwargs['workers'] = args.workers
+    if args.queue_size is not None:
+        kwargs['max_queue'] = args.queue_size
+    GenerationRequestHandler.job_queue = JobQueue(**kwargs)
+    server = ThreadingHTTPServer((args.host, args.port), GenerationRequestHandler)
+    print(f"generation service listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
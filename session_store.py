@@ -0,0 +1,208 @@
+"""
+Usage: Server-side store for page drafts, keyed by a session id kept in the page URL (?sid=...)
+Export: SessionStore, SESSION_STORE, get_session_store, new_session_id
+Methods:
+    - load: Latest draft of a session, read synchronously on the first script run
+    - save: Save a draft; adds a snapshot when the content changed and the last snapshot is old enough
+    - list_snapshots / load_snapshot: Draft versions for rollback
+    - purge: Delete sessions that have not been updated for a while
+Note: drafts are zlib-compressed JSON in SQLite, so their size is not limited by the browser storage quota
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from typing import Dict, List, Optional
+
+file_dir = os.path.dirname(os.path.abspath(__file__))
+
+# 设置 HUST_GEN_PAPER_SESSION_STORE=1 时草稿保存在服务端，不再依赖浏览器 localStorage
+SESSION_STORE = os.getenv("HUST_GEN_PAPER_SESSION_STORE", "0") == "1"
+DEFAULT_DB_PATH = os.path.join(file_dir, 'session_store.db')
+# 两个快照之间的最小间隔（秒），间隔内的修改只更新当前草稿
+SNAPSHOT_INTERVAL = 60
+# 每个会话保留的快照数
+MAX_SNAPSHOTS = 50
+# 超过该时间（秒）未更新的会话会被清理
+SESSION_RETENTION = 30 * 24 * 3600
+
+
+def new_session_id() -> str:
+    return uuid.uuid4().hex
+
+
+class SessionStore:
+    """基于 SQLite 的草稿存储，sessions 表保存最新草稿，snapshots 表保存历史版本"""
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH):
+        self.db_path = db_path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._init_schema()
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite3 连接不能跨线程使用，每个线程各自持有一个连接
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._connect()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                data BLOB NOT NULL,
+                version INTEGER NOT NULL,
+                updated_at REAL NOT NULL,
+                snapshot_at REAL NOT NULL
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS snapshots (
+                session_id TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                data BLOB NOT NULL,
+                created_at REAL NOT NULL,
+                theme TEXT,
+                reference_count INTEGER,
+                final_chars INTEGER,
+                PRIMARY KEY (session_id, version)
+            )
+        """)
+        # 兼容没有摘要列的旧库，旧快照在列出时补写
+        columns = [row['name'] for row in conn.execute("PRAGMA table_info(snapshots)")]
+        for column, definition in (('theme', "TEXT"), ('reference_count', "INTEGER"), ('final_chars', "INTEGER")):
+            if column not in columns:
+                conn.execute(f"ALTER TABLE snapshots ADD COLUMN {column} {definition}")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_updated ON sessions(updated_at)")
+
+    @staticmethod
+    def _encode(data: Dict) -> bytes:
+        return zlib.compress(json.dumps(data, ensure_ascii=False).encode('utf-8'))
+
+    @staticmethod
+    def _decode(blob: bytes) -> Dict:
+        return json.loads(zlib.decompress(blob).decode('utf-8'))
+
+    @staticmethod
+    def _summary(data: Dict):
+        """快照列表显示的摘要：(主题, 参考文本数, 文章字数)"""
+        return data.get('theme', ""), len(data.get('references', [])), len(data.get('final_text', ""))
+
+    def load(self, session_id: str) -> Optional[Dict]:
+        row = self._connect().execute("SELECT data FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        if row is None:
+            return None
+        try:
+            return self._decode(row['data'])
+        except (ValueError, zlib.error) as e:
+            print(f"Error loading session {session_id}: {e}")
+            return None
+
+    def save(self, session_id: str, data: Dict) -> int:
+        """保存草稿并返回当前版本号"""
+        blob = self._encode(data)
+        summary = self._summary(data)
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT data, version, snapshot_at FROM sessions WHERE session_id = ?",
+                               (session_id,)).fetchone()
+            if row is not None and row['data'] == blob:
+                conn.execute("COMMIT")
+                return row['version']
+            if row is None or now - row['snapshot_at'] >= SNAPSHOT_INTERVAL:
+                # 新版本：写入快照并只保留最近 MAX_SNAPSHOTS 个
+                version = (row['version'] + 1) if row is not None else 1
+                snapshot_at = now
+                conn.execute("INSERT OR REPLACE INTO snapshots (session_id, version, data, created_at, theme, "
+                             "reference_count, final_chars) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             (session_id, version, blob, now) + summary)
+                conn.execute("DELETE FROM snapshots WHERE session_id = ? AND version <= ?",
+                             (session_id, version - MAX_SNAPSHOTS))
+            else:
+                # 间隔内的修改合并到当前版本的快照
+                version = row['version']
+                snapshot_at = row['snapshot_at']
+                conn.execute("UPDATE snapshots SET data = ?, created_at = ?, theme = ?, reference_count = ?, "
+                             "final_chars = ? WHERE session_id = ? AND version = ?",
+                             (blob, now) + summary + (session_id, version))
+            conn.execute("""
+                INSERT INTO sessions (session_id, data, version, updated_at, snapshot_at) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(session_id) DO UPDATE SET
+                    data = excluded.data, version = excluded.version,
+                    updated_at = excluded.updated_at, snapshot_at = excluded.snapshot_at
+            """, (session_id, blob, version, now, snapshot_at))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return version
+
+    def list_snapshots(self, session_id: str) -> List[Dict]:
+        """按版本号倒序列出快照，只读取保存时记录的主题和字数，不解压完整内容"""
+        conn = self._connect()
+        rows = conn.execute(
+            "SELECT version, created_at, theme, reference_count, final_chars FROM snapshots "
+            "WHERE session_id = ? ORDER BY version DESC", (session_id,)).fetchall()
+        snapshots = []
+        for row in rows:
+            theme, references, final_chars = row['theme'], row['reference_count'], row['final_chars']
+            if references is None:
+                # 旧库的快照没有摘要列，解压一次并补写
+                blob = conn.execute("SELECT data FROM snapshots WHERE session_id = ? AND version = ?",
+                                    (session_id, row['version'])).fetchone()['data']
+                try:
+                    theme, references, final_chars = self._summary(self._decode(blob))
+                except (ValueError, zlib.error):
+                    continue
+                conn.execute("UPDATE snapshots SET theme = ?, reference_count = ?, final_chars = ? "
+                             "WHERE session_id = ? AND version = ?",
+                             (theme, references, final_chars, session_id, row['version']))
+            snapshots.append({
+                'version': row['version'],
+                'created_at': row['created_at'],
+                'theme': theme,
+                'references': references,
+                'final_chars': final_chars,
+            })
+        return snapshots
+
+    def load_snapshot(self, session_id: str, version: int) -> Optional[Dict]:
+        row = self._connect().execute("SELECT data FROM snapshots WHERE session_id = ? AND version = ?",
+                                      (session_id, version)).fetchone()
+        return self._decode(row['data']) if row is not None else None
+
+    def purge(self, older_than: float = SESSION_RETENTION) -> int:
+        cutoff = time.time() - older_than
+        conn = self._connect()
+        with conn:
+            expired = [row['session_id'] for row in
+                       conn.execute("SELECT session_id FROM sessions WHERE updated_at < ?", (cutoff,))]
+            conn.executemany("DELETE FROM snapshots WHERE session_id = ?", [(sid,) for sid in expired])
+            conn.executemany("DELETE FROM sessions WHERE session_id = ?", [(sid,) for sid in expired])
+        return len(expired)
+
+
+_session_store = None
+_session_store_lock = threading.Lock()
+
+
+def get_session_store() -> SessionStore:
+    """进程内共享的草稿存储，第一次使用时清理过期会话"""
+    global _session_store
+    with _session_store_lock:
+        if _session_store is None:
+            _session_store = SessionStore()
+            _session_store.purge()
+        return _session_store
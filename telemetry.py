@@ -0,0 +1,252 @@
+"""
+Usage: Per-request LLM telemetry stored in a local SQLite table
+Export: CallTimer, start_call, summary, recent_calls, latency_percentile, set_telemetry_db
+Methods:
+    - start_call: Start timing one LLM call, returns a CallTimer
+    - CallTimer.finish: Record latency, time to first token, tokens, cache tier and error of the call
+    - summary: Aggregate latency percentiles, tokens/sec and cache hit ratio per model
+    - latency_percentile: Latency / first-token percentile of one model's successful uncached calls
+    - set_telemetry_db: Write records to another database (benchmarks use a temporary one)
+Note: records are written by a background thread, the request path only enqueues them
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+file_dir = os.path.dirname(os.path.abspath(__file__))
+
+# 设置 HUST_GEN_PAPER_TELEMETRY=0 关闭记录
+TELEMETRY = os.getenv("HUST_GEN_PAPER_TELEMETRY", "1") == "1"
+DEFAULT_DB_PATH = os.path.join(file_dir, 'telemetry.db')
+# 表中最多保留的记录数，超出后删除最早的记录
+MAX_ROWS = 100000
+ROTATE_EVERY = 500
+
+
+class CallTimer:
+    """记录一次大模型调用的各阶段耗时"""
+
+    def __init__(self, model: str, temperature: float, mode: str):
+        self.model = model
+        self.temperature = temperature
+        self.mode = mode
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.queue_wait = 0.0
+        self.first_token = None
+        self._finished = False
+
+    def add_wait(self, seconds: float):
+        """排队时间：等待限流令牌或等待相同请求完成"""
+        self.queue_wait += seconds
+
+    def mark_first_token(self):
+        if self.first_token is None:
+            self.first_token = time.perf_counter() - self._start
+
+    def finish(self, prompt: str = "", response: str = "", cache_tier: str = "miss",
+               error: Optional[BaseException] = None):
+        if self._finished:
+            return
+        self._finished = True
+        total = time.perf_counter() - self._start
+        _writer.submit({
+            'started_at': self.started_at,
+            'model': self.model,
+            'temperature': self.temperature,
+            'mode': self.mode,
+            'cache_tier': cache_tier,
+            'queue_wait': self.queue_wait,
+            'ttft': self.first_token if self.first_token is not None else total,
+            'latency': total,
+            'prompt': prompt or "",
+            'response': response if isinstance(response, str) else "",
+            'error': f"{type(error).__name__}: {error}" if error is not None else None,
+        })
+
+
+class TelemetryWriter:
+    """后台线程批量写入 SQLite，token 统计也在后台完成"""
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH):
+        self.db_path = db_path
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._inserted = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_calls (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                started_at REAL NOT NULL,
+                model TEXT,
+                temperature REAL,
+                mode TEXT,
+                cache_tier TEXT,
+                queue_wait REAL,
+                ttft REAL,
+                latency REAL,
+                input_tokens INTEGER,
+                output_tokens INTEGER,
+                tokens_per_sec REAL,
+                error TEXT
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_calls_started ON llm_calls(started_at)")
+        return conn
+
+    def submit(self, record: Dict):
+        if not TELEMETRY:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="llm-telemetry", daemon=True)
+                self._thread.start()
+        self._queue.put(record)
+
+    def _run(self):
+        conn = self._connect()
+        while True:
+            records = [self._queue.get()]
+            # 一次取走队列中已有的记录，合并成一个事务写入
+            while not self._queue.empty() and len(records) < 200:
+                records.append(self._queue.get_nowait())
+            try:
+                self._write(conn, records)
+            except Exception as e:
+                print(f"Error writing telemetry: {e}")
+
+    def _write(self, conn: sqlite3.Connection, records: List[Dict]):
+        from tokens import count_tokens
+        rows = []
+        for record in records:
+            input_tokens = count_tokens(record['prompt'], record['model'])
+            output_tokens = count_tokens(record['response'], record['model'])
+            generation_time = record['latency'] - record['queue_wait']
+            tokens_per_sec = output_tokens / generation_time \
+                if record['cache_tier'] == 'miss' and generation_time > 0 else None
+            rows.append((record['started_at'], record['model'], record['temperature'], record['mode'],
+                         record['cache_tier'], record['queue_wait'], record['ttft'], record['latency'],
+                         input_tokens, output_tokens, tokens_per_sec, record['error']))
+        with conn:
+            conn.executemany("""
+                INSERT INTO llm_calls (started_at, model, temperature, mode, cache_tier, queue_wait, ttft,
+                                       latency, input_tokens, output_tokens, tokens_per_sec, error)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+        self._inserted += len(rows)
+        if self._inserted >= ROTATE_EVERY:
+            self._inserted = 0
+            with conn:
+                conn.execute("DELETE FROM llm_calls WHERE id <= (SELECT MAX(id) FROM llm_calls) - ?", (MAX_ROWS,))
+
+
+_writer = TelemetryWriter()
+
+
+def set_telemetry_db(db_path: str):
+    """之后的调用记录写入 db_path（用于基准测试，避免污染 telemetry.db）"""
+    global _writer
+    _writer = TelemetryWriter(db_path)
+
+
+def start_call(model: str, temperature: float, mode: str = "invoke") -> CallTimer:
+    return CallTimer(model, temperature, mode)
+
+
+def _percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p * (len(values) - 1))))]
+
+
+def recent_calls(since: float = 0, limit: Optional[int] = None) -> List[Dict]:
+    if not os.path.exists(_writer.db_path):
+        return []
+    conn = _writer._connect()
+    try:
+        rows = conn.execute("SELECT * FROM llm_calls WHERE started_at >= ? ORDER BY started_at DESC LIMIT ?",
+                            (since, limit if limit is not None else -1)).fetchall()
+        return [dict(row) for row in rows]
+    finally:
+        conn.close()
+
+
+def latency_percentile(model: str, p: float, field: str = 'ttft', mode: Optional[str] = None, since: float = 0,
+                       min_samples: int = 20, limit: int = 1000) -> Optional[float]:
+    """某个模型最近 limit 次未命中缓存且成功的调用的延迟分位数，样本不足 min_samples 时返回 None"""
+    if field not in ('ttft', 'latency'):
+        raise ValueError(f"unknown latency field: {field}")
+    if not os.path.exists(_writer.db_path):
+        return None
+    conn = _writer._connect()
+    try:
+        rows = conn.execute(f"""
+            SELECT {field} FROM llm_calls
+            WHERE model = ? AND started_at >= ? AND cache_tier = 'miss' AND error IS NULL AND (? IS NULL OR mode = ?)
+            ORDER BY started_at DESC LIMIT ?
+        """, (model, since, mode, mode, limit)).fetchall()
+    finally:
+        conn.close()
+    if len(rows) < min_samples:
+        return None
+    return _percentile([row[0] for row in rows], p)
+
+
+def _sql_percentile(conn: sqlite3.Connection, field: str, model: str, since: float, count: int, p: float) -> float:
+    """在 SQLite 中排序取分位数，只读出一个值"""
+    if not count:
+        return 0.0
+    row = conn.execute(f"""
+        SELECT {field} FROM llm_calls
+        WHERE model IS ? AND started_at >= ? AND cache_tier = 'miss' AND error IS NULL
+        ORDER BY {field} LIMIT 1 OFFSET ?
+    """, (model, since, min(count - 1, int(round(p * (count - 1)))))).fetchone()
+    return row[0] if row is not None and row[0] is not None else 0.0
+
+
+def summary(since: float = 0) -> Dict:
+    """按模型汇总调用次数、缓存命中率、延迟分位数、首 token 时间和输出速度，聚合都在 SQL 中完成"""
+    if not os.path.exists(_writer.db_path):
+        return {}
+    conn = _writer._connect()
+    try:
+        rows = conn.execute("""
+            SELECT model,
+                   COUNT(*) AS calls,
+                   SUM(error IS NOT NULL) AS errors,
+                   SUM(cache_tier != 'miss') AS hits,
+                   SUM(cache_tier = 'miss' AND error IS NULL) AS misses,
+                   AVG(CASE WHEN cache_tier = 'miss' AND error IS NULL AND tokens_per_sec > 0
+                            THEN tokens_per_sec END) AS tokens_per_sec,
+                   COALESCE(SUM(input_tokens), 0) AS input_tokens,
+                   COALESCE(SUM(output_tokens), 0) AS output_tokens
+            FROM llm_calls WHERE started_at >= ? GROUP BY model
+        """, (since,)).fetchall()
+        result = {}
+        for row in rows:
+            model, misses = row['model'], row['misses']
+            result[model] = {
+                'calls': row['calls'],
+                'errors': row['errors'],
+                'hit_ratio': row['hits'] / row['calls'],
+                'latency_p50': _sql_percentile(conn, 'latency', model, since, misses, 0.5),
+                'latency_p95': _sql_percentile(conn, 'latency', model, since, misses, 0.95),
+                'ttft_p50': _sql_percentile(conn, 'ttft', model, since, misses, 0.5),
+                'queue_wait_p95': _sql_percentile(conn, 'queue_wait', model, since, misses, 0.95),
+                'tokens_per_sec': row['tokens_per_sec'] or 0.0,
+                'input_tokens': row['input_tokens'],
+                'output_tokens': row['output_tokens'],
+            }
+        return result
+    finally:
+        conn.close()
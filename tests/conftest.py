@@ -0,0 +1,88 @@
+"""
+Usage: Shared fixtures for the test suite: an isolated response cache and a fake streaming LLM
+Run: python -m pytest -q tests
+"""
+
+import os
+import sys
+import threading
+import time
+from typing import Any, List, Optional
+
+os.environ.setdefault("HUST_GEN_PAPER_TELEMETRY", "0")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import GenerationChunk
+from pydantic import Field
+
+from cache_store import SQLiteCacheStore, TieredCache, set_cache_store
+from throttle import TokenBucket, provider_of, set_limiter
+
+
+class FakeLLM(LLM):
+    """
+    回显用户消息的假模型：gate 置位前阻塞在第一个片段之前，之后每隔 token_delay 秒输出一个字符。
+    calls 记录请求次数，finished / aborted 记录流是读完还是被中途关闭
+    """
+    gate: Optional[Any] = None
+    latency: float = 0.0
+    token_delay: float = 0.0
+    repeat: int = 1
+    calls: List[str] = Field(default_factory=list)
+    finished: List[str] = Field(default_factory=list)
+    aborted: List[str] = Field(default_factory=list)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    def _text(self, prompt: str) -> str:
+        return prompt.rsplit("Human: ", 1)[-1] * self.repeat
+
+    def _call(self, prompt, stop=None, run_manager=None, **kwargs):
+        return "".join(chunk.text for chunk in self._stream(prompt))
+
+    def _stream(self, prompt, stop=None, run_manager=None, **kwargs):
+        self.calls.append(prompt)
+        if self.gate is not None:
+            self.gate.wait(5)
+        time.sleep(self.latency)
+        try:
+            for ch in self._text(prompt):
+                time.sleep(self.token_delay)
+                yield GenerationChunk(text=ch)
+        except GeneratorExit:
+            self.aborted.append(prompt)
+            raise
+        self.finished.append(prompt)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    """每个测试使用独立的响应缓存，不读写项目目录下的 llm_cache.db"""
+    store = TieredCache(SQLiteCacheStore(str(tmp_path / "cache.db")), background=False)
+    set_cache_store(store)
+    return store
+
+
+@pytest.fixture
+def make_agent(cache):
+    """创建使用 FakeLLM 的 LLMAgent，不限流"""
+    import agent as agent_module
+
+    def make(model="fake", **llm_kwargs):
+        llm_agent = agent_module.LLMAgent(model=model, init=False, semantic_cache=False)
+        llm_agent.llm = FakeLLM(**llm_kwargs)
+        set_limiter(provider_of(model), TokenBucket(1e9, 1e9))
+        return llm_agent
+
+    return make
+
+
+@pytest.fixture
+def fake_agent(make_agent):
+    """第一个片段由 gate 控制的 agent，返回 (agent, llm)"""
+    llm_agent = make_agent(gate=threading.Event())
+    return llm_agent, llm_agent.llm
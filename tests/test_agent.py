@@ -0,0 +1,46 @@
+"""
+Usage: Tests for LLMAgent streaming: chunks arrive incrementally and only complete responses are cached
+Run: python -m pytest -q tests
+"""
+
+
+def test_stream_yields_chunks_and_caches_the_full_response(make_agent, cache):
+    llm_agent = make_agent()
+
+    chunks = list(llm_agent.stream_request("hello"))
+
+    assert chunks == list("hello")
+    assert cache.get(llm_agent._request_cache_key("hello"))['response'] == "hello"
+    # 第二次直接从缓存一次性返回，不再请求模型
+    assert list(llm_agent.stream_request("hello")) == ["hello"]
+    assert len(llm_agent.llm.calls) == 1
+
+
+def test_closed_stream_is_not_cached_and_aborts_the_model(make_agent, cache):
+    llm_agent = make_agent(repeat=100)
+    stream = llm_agent.stream_request("hello")
+    assert next(stream) == "h"
+
+    stream.close()
+
+    assert cache.get(llm_agent._request_cache_key("hello")) is None
+    assert llm_agent.llm.aborted and not llm_agent.llm.finished
+
+
+def test_stream_without_cache_regenerates(make_agent, cache):
+    llm_agent = make_agent()
+    list(llm_agent.stream_request("hello"))
+
+    assert "".join(llm_agent.stream_request("hello", enable_cache=False)) == "hello"
+    assert len(llm_agent.llm.calls) == 2
+
+
+def test_simple_request_matches_stream(make_agent, cache):
+    llm_agent = make_agent()
+
+    cache_key, response = llm_agent.simple_request("hello")
+
+    assert response == "hello"
+    assert cache_key == llm_agent._request_cache_key("hello")
+    assert "".join(llm_agent.stream_request("hello")) == "hello"
+    assert len(llm_agent.llm.calls) == 1
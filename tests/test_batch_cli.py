@@ -0,0 +1,40 @@
+"""
+Usage: Tests for the batch CLI: invalid models fail only their own job, output names never collide
+Run: python -m pytest -q tests
+"""
+
+import json
+import sys
+
+import batch_cli
+
+
+def run_batch(tmp_path, monkeypatch, jobs):
+    job_file = tmp_path / "jobs.jsonl"
+    job_file.write_text("\n".join(json.dumps(job) for job in jobs), encoding='utf-8')
+    output_dir = tmp_path / "out"
+    monkeypatch.setattr(sys, "argv", ["batch_cli.py", str(job_file), "--output-dir", str(output_dir),
+                                      "--model", "gpt-4o"])
+    batch_cli.main()
+    return output_dir
+
+
+def test_invalid_model_fails_only_its_job(tmp_path, monkeypatch, make_agent, capsys):
+    llm_agent = make_agent("gpt-4o")
+    monkeypatch.setattr(batch_cli, "get_agent", lambda model, temperature: llm_agent)
+
+    output_dir = run_batch(tmp_path, monkeypatch, [
+        {"id": "bad", "theme": "t", "outlines": ["1"], "model": "no-such-model"},
+        {"id": "good", "theme": "t", "outlines": ["1"]},
+    ])
+
+    summary = json.loads(capsys.readouterr().out.strip().splitlines()[-1])
+    assert summary['failed'] == ["bad"]
+    assert summary['finished'] == 1
+    assert batch_cli.load_checkpoint(str(output_dir)) == {"good"}
+
+
+def test_result_names_do_not_collide():
+    names = {batch_cli.result_name(job_id) for job_id in ["a/b", "a_b", "a b", "a:b"]}
+    assert len(names) == 4
+    assert batch_cli.result_name("report-01.v2") == "report-01.v2"
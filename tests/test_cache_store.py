@@ -0,0 +1,92 @@
+"""
+Usage: Tests for the LLM response cache: TTL, byte-budget eviction, memory-tier access times, pickle migration
+Run: python -m pytest -q tests
+"""
+
+import time
+
+from cache_store import PickleCacheStore, SQLiteCacheStore, TieredCache, migrate_pickle_cache
+
+
+def make_tiered(tmp_path, **kwargs):
+    return TieredCache(SQLiteCacheStore(str(tmp_path / "cache.db")), background=False, **kwargs)
+
+
+def test_memory_hits_keep_records_from_disk_eviction(tmp_path):
+    cache = make_tiered(tmp_path, ttl=0)
+    cache.put("hot", "x" * 1000)
+    time.sleep(0.01)
+    cache.put("cold", "y" * 1000)
+    time.sleep(0.01)
+    # 只在内存层命中，磁盘上 hot 的 accessed_at 仍然最早
+    assert cache.lookup("hot")[1] == 'memory'
+
+    cache.evict(max_bytes=cache.store.total_bytes() - 1)
+
+    assert cache.store.get("hot") is not None
+    assert cache.store.get("cold") is None
+
+
+def test_ttl_expires_in_both_tiers(tmp_path):
+    cache = make_tiered(tmp_path)
+    cache.put("short", "response", ttl=0.05)
+    cache.put("forever", "response", ttl=0)
+    assert cache.lookup("short")[1] == 'memory'
+
+    time.sleep(0.1)
+
+    assert cache.lookup("short") == (None, 'miss')
+    assert cache.store.get("short") is None
+    assert cache.lookup("forever")[0]['response'] == "response"
+    assert cache.purge_expired() == 1
+    assert cache.count() == 1
+
+
+def test_disk_record_promoted_to_memory_keeps_its_expiry(tmp_path):
+    store = SQLiteCacheStore(str(tmp_path / "cache.db"))
+    store.put("key", "response", ttl=0.05)
+    cache = TieredCache(store, background=False)
+    assert cache.lookup("key")[1] == 'disk'
+
+    time.sleep(0.1)
+
+    assert cache.lookup("key") == (None, 'miss')
+
+
+def test_evict_removes_least_recently_used_down_to_the_budget(tmp_path):
+    store = SQLiteCacheStore(str(tmp_path / "cache.db"))
+    for i in range(10):
+        store.put(f"key{i}", "x" * 1000)
+        time.sleep(0.002)
+    store.get("key0")
+    budget = store.total_bytes() // 2
+
+    evicted = store.evict(budget)
+
+    assert evicted > 0
+    assert store.total_bytes() <= budget * 0.9
+    assert store.get("key0") is not None
+    assert store.get("key1") is None
+    assert store.get("key9") is not None
+    assert store.evict(budget) == 0
+
+
+def test_migrate_pickle_cache(tmp_path):
+    source = PickleCacheStore(str(tmp_path / "llm_cache"))
+    source.put("a", "response a", prompt="prompt a")
+    source.put("b", {"answer": "response b"})
+    target = SQLiteCacheStore(str(tmp_path / "cache.db"))
+
+    assert migrate_pickle_cache(source.cache_dir, target) == 2
+
+    record = target.get("a")
+    assert record['response'] == "response a"
+    assert record['prompt'] == "prompt a"
+    assert record['created_at'] == source.get("a")['created_at']
+    assert target.get("b")['response'] == {"answer": "response b"}
+    # 已经导入的记录默认跳过
+    source.put("a", "changed")
+    assert migrate_pickle_cache(source.cache_dir, target) == 0
+    assert migrate_pickle_cache(source.cache_dir, target, overwrite=True) == 2
+    assert target.get("a")['response'] == "changed"
+    assert migrate_pickle_cache(str(tmp_path / "missing"), target) == 0
@@ -0,0 +1,51 @@
+"""
+Usage: Tests for hedged requests: the losing request is aborted, not read to the end
+Run: python -m pytest -q tests
+"""
+
+import threading
+import time
+
+import pytest
+
+import hedging
+
+
+def hedge_threads():
+    return [thread for thread in threading.enumerate() if thread.name.startswith("hedge-")]
+
+
+@pytest.fixture
+def agents(make_agent, monkeypatch):
+    """慢模型首 token 要等 0.3 秒、之后每 0.05 秒一个字符；快模型立即输出"""
+    pool = {
+        'slow': make_agent("slow", latency=0.3, token_delay=0.05, repeat=20),
+        'fast': make_agent("fast"),
+    }
+    monkeypatch.setattr(hedging, "get_agent", lambda model, temperature: pool[model])
+    return pool
+
+
+def test_backup_wins_and_slow_primary_is_aborted(agents):
+    request = hedging.HedgedRequest("abc", "slow", backup_model="fast", threshold=0.05)
+
+    cache_key, response = request.result()
+
+    assert response == "abc"
+    assert request.hedged and request.winner == "fast"
+    # 落败的主模型在输出第一个片段后就被中止，而不是读完剩余的 3 秒输出
+    start = time.monotonic()
+    while hedge_threads() and time.monotonic() - start < 2:
+        time.sleep(0.01)
+    assert not hedge_threads()
+    assert time.monotonic() - start < 1
+    assert agents['slow'].llm.aborted
+    assert not agents['slow'].llm.finished
+
+
+def test_fast_primary_does_not_hedge(agents):
+    request = hedging.HedgedRequest("abc", "fast", backup_model="slow", threshold=1)
+
+    assert request.result()[1] == "abc"
+    assert not request.hedged and request.winner == "fast"
+    assert not agents['slow'].llm.calls
@@ -0,0 +1,87 @@
+"""
+Usage: Tests for the searchable history index: CJK bigram terms, search, pagination and budget accounting
+Run: python -m pytest -q tests
+"""
+
+import time
+
+import pytest
+
+from cache_store import PickleCacheStore, SQLiteCacheStore
+from history_index import index_terms, make_preview, query_terms
+
+
+def test_cjk_text_is_indexed_as_unigrams_and_bigrams():
+    assert index_terms("大模型 API") == {"大", "模", "型", "大模", "模型", "api"}
+    assert query_terms("模型") == {"模型"}
+    assert query_terms("型") == {"型"}
+    assert query_terms("大模型 Cache") == {"大模", "模型", "cache"}
+
+
+def test_preview_is_single_line_and_bounded():
+    assert make_preview("第一行\n第二行", limit=5) == "第一行 第..."
+    assert make_preview(None) == ""
+
+
+@pytest.fixture(params=["sqlite", "pickle"])
+def store(request, tmp_path):
+    if request.param == "sqlite":
+        return SQLiteCacheStore(str(tmp_path / "cache.db"))
+    return PickleCacheStore(str(tmp_path / "llm_cache"))
+
+
+def fill(store):
+    store.put("k1", "介绍深度学习的基本原理", prompt="原始文本：\n深度学习\n1. 原理")
+    time.sleep(0.01)
+    store.put("k2", "关于强化学习的综述", prompt=None)
+    time.sleep(0.01)
+    store.put("k3", "深度强化学习与 Transformer", prompt="原始文本：\n强化学习\n1. 方法")
+
+
+def keys(entries):
+    return [entry['key'] for entry in entries]
+
+
+def test_search_matches_every_cjk_term(store):
+    fill(store)
+
+    assert keys(store.list_history("深度学习")) == ["k1"]
+    assert keys(store.list_history("强化学习")) == ["k3", "k2"]
+    assert keys(store.list_history("深度 transformer")) == ["k3"]
+    assert store.count_history("学习") == 3
+    assert store.count_history("机器学习") == 0
+
+
+def test_history_is_paginated_newest_first(store):
+    fill(store)
+
+    assert keys(store.list_history(limit=2)) == ["k3", "k2"]
+    assert keys(store.list_history(limit=2, offset=2)) == ["k1"]
+    assert keys(store.list_history(field='prompt')) == ["k3", "k1"]
+
+
+def test_sqlite_history_entries_carry_previews(tmp_path):
+    store = SQLiteCacheStore(str(tmp_path / "cache.db"))
+    fill(store)
+    store.reindex()
+
+    entry = store.list_history("深度学习")[0]
+    assert entry['theme'] == "深度学习"
+    assert entry['preview'] == "介绍深度学习的基本原理"
+
+
+def test_sqlite_index_is_built_off_the_write_path_and_counted_in_size(tmp_path):
+    store = SQLiteCacheStore(str(tmp_path / "cache.db"))
+    store.put("k1", "深度学习" * 100)
+    conn = store._connect()
+    assert conn.execute("SELECT COUNT(*) FROM llm_cache_terms").fetchone()[0] == 0
+    size_before = store.total_bytes()
+
+    assert store.reindex() == 1
+
+    assert conn.execute("SELECT COUNT(*) FROM llm_cache_terms").fetchone()[0] > 0
+    assert store.total_bytes() > size_before
+    # 重新写入后旧的检索词失效，按新内容重建
+    store.put("k1", "强化学习")
+    assert keys(store.list_history("强化")) == ["k1"]
+    assert store.list_history("深度") == []
@@ -0,0 +1,103 @@
+"""
+Usage: Tests for the generation job queue: character cap, cancellation latency and section jobs
+Run: python -m pytest -q tests
+"""
+
+import time
+
+import pytest
+
+import jobs
+
+
+@pytest.fixture
+def job_queue(make_agent, monkeypatch):
+    """不对冲、所有模型都用同一个慢速假模型的任务队列；逐字符输出 "abc" * 70，读完约 2 秒"""
+    llm_agent = make_agent(token_delay=0.01, repeat=70)
+    monkeypatch.setattr(jobs, "get_agent", lambda model, temperature: llm_agent)
+    monkeypatch.setattr(jobs, "backup_model_for", lambda model: None)
+    return jobs.JobQueue(workers=2), llm_agent.llm
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not met in time"
+        time.sleep(0.005)
+
+
+def test_capped_job_stops_before_the_model_finishes(job_queue):
+    queue, llm = job_queue
+    start = time.monotonic()
+    job = queue.submit("abc", model="fake", max_chars=20)
+
+    assert queue.wait(job.id, timeout=5).status == jobs.CANCELLED
+    assert time.monotonic() - start < 0.5
+    assert job.capped
+    # 模型请求被中止，而不是读完剩余输出
+    wait_for(lambda: llm.aborted)
+    assert not llm.finished
+
+
+def test_lift_cap_before_the_cap_lets_the_job_finish(job_queue):
+    queue, llm = job_queue
+    job = queue.submit("abc", model="fake", max_chars=100)
+    wait_for(lambda: job.chunks)
+
+    assert job.lift_cap()
+    assert queue.wait(job.id, timeout=5).status == jobs.DONE
+    assert job.result == "abc" * 70
+
+
+def test_lift_cap_after_the_cap_asks_for_a_new_job(job_queue):
+    queue, llm = job_queue
+    job = queue.submit("abc", model="fake", max_chars=5)
+    queue.wait(job.id, timeout=5)
+
+    assert not job.lift_cap()
+
+
+def test_cancel_stops_a_running_job_promptly(job_queue):
+    queue, llm = job_queue
+    job = queue.submit("abc", model="fake")
+    wait_for(lambda: job.chunks)
+
+    start = time.monotonic()
+    assert queue.cancel(job.id)
+    assert queue.wait(job.id, timeout=5).status == jobs.CANCELLED
+    assert time.monotonic() - start < 0.2
+    wait_for(lambda: llm.aborted)
+    assert not llm.finished
+    # 工作线程没有被占住
+    second = queue.submit("d", model="fake")
+    assert queue.wait(second.id, timeout=5).status == jobs.DONE
+
+
+def test_cancel_aborts_sections_in_flight(job_queue):
+    queue, llm = job_queue
+    job = queue.submit("", model="fake", section_prompts=["a", "b", "c", "d"], max_workers=2)
+    wait_for(lambda: len(llm.calls) == 2)
+
+    start = time.monotonic()
+    assert queue.cancel(job.id)
+    assert queue.wait(job.id, timeout=5).status == jobs.CANCELLED
+    assert time.monotonic() - start < 0.2
+    # 进行中的两段都被中止，排队的两段没有开始
+    wait_for(lambda: len(llm.aborted) == 2)
+    time.sleep(0.05)
+    assert len(llm.calls) == 2
+    assert not llm.finished
+
+
+def test_section_job_stitches_sections_in_order(make_agent, monkeypatch):
+    llm_agent = make_agent()
+    monkeypatch.setattr(jobs, "get_agent", lambda model, temperature: llm_agent)
+    monkeypatch.setattr(jobs, "backup_model_for", lambda model: None)
+    queue = jobs.JobQueue(workers=1)
+
+    job = queue.submit("", model="fake", section_prompts=["one", "two", "three"], max_workers=3)
+
+    assert queue.wait(job.id, timeout=5).status == jobs.DONE
+    assert job.sections == ["one", "two", "three"]
+    assert job.result == "one\n\ntwo\n\nthree"
+    assert job.sections_done == 3
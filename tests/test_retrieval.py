@@ -0,0 +1,89 @@
+"""
+Usage: Tests for reference chunking and retrieval-based compression
+Run: python -m pytest -q tests
+"""
+
+from retrieval import chunk_text, compress_references, estimate_tokens
+
+TOPICS = ["苹果", "香蕉", "樱桃"]
+
+
+class KeywordEmbeddings:
+    """按关键词出现次数构造向量的假嵌入模型，记录调用次数"""
+
+    def __init__(self):
+        self.document_calls = 0
+
+    @staticmethod
+    def _vector(text):
+        return [text.count(topic) for topic in TOPICS] + [0.01]
+
+    def embed_query(self, text):
+        return self._vector(text)
+
+    def embed_documents(self, texts):
+        self.document_calls += 1
+        return [self._vector(text) for text in texts]
+
+
+def paragraph(topic, sentences=30):
+    """每句 10 个字符，默认 30 句刚好是一个 CHUNK_SIZE 的片段"""
+    return "".join(f"{topic}事实{i:02d}很重要。" for i in range(sentences))
+
+
+def test_chunk_text_is_sentence_aligned_and_bounded():
+    text = paragraph("苹果", 40)
+    chunks = chunk_text(text, chunk_size=100, overlap=0)
+
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 100 for chunk in chunks)
+    assert all(chunk.endswith("。") for chunk in chunks)
+    # 不重叠时片段拼起来就是原文
+    assert "".join(chunks) == text
+
+
+def test_chunk_text_overlap_repeats_the_tail():
+    chunks = chunk_text(paragraph("苹果", 40), chunk_size=100, overlap=20)
+
+    assert len(chunks) > 1
+    for previous, current in zip(chunks, chunks[1:]):
+        assert current.startswith(previous[-20:])
+
+
+def test_chunk_text_hard_splits_long_sentences():
+    chunks = chunk_text("长" * 250, chunk_size=100, overlap=0)
+
+    assert [len(chunk) for chunk in chunks] == [100, 100, 50]
+
+
+def test_compress_references_keeps_relevant_chunks_in_order():
+    embeddings = KeywordEmbeddings()
+    reference = paragraph("香蕉") + paragraph("苹果") + paragraph("樱桃")
+
+    compressed = compress_references(["樱桃和苹果", "苹果和香蕉"], [reference, reference], embeddings,
+                                     top_k=2, token_budget=600)
+
+    # 保留的片段按原文顺序拼接，不会重复出现
+    assert compressed == [paragraph("苹果") + "\n" + paragraph("樱桃"),
+                          paragraph("香蕉") + "\n" + paragraph("苹果")]
+    # 所有参考文本的片段合并成一次嵌入调用
+    assert embeddings.document_calls == 1
+
+
+def test_compress_references_respects_the_token_budget():
+    reference = paragraph("香蕉") + paragraph("苹果") + paragraph("樱桃")
+
+    compressed = compress_references(["樱桃和苹果"], [reference], KeywordEmbeddings(), top_k=2, token_budget=300)
+
+    assert compressed == [paragraph("苹果")] or compressed == [paragraph("樱桃")]
+    assert estimate_tokens(compressed[0]) <= 300
+
+
+def test_short_references_are_not_compressed():
+    embeddings = KeywordEmbeddings()
+    assert compress_references(["苹果"], ["很短的参考文本。"], embeddings) == ["很短的参考文本。"]
+    assert embeddings.document_calls == 0
+
+
+def test_compress_references_pads_missing_references():
+    assert compress_references(["a", "b"], ["x"], KeywordEmbeddings()) == ["x", ""]
@@ -0,0 +1,97 @@
+"""
+Usage: Tests for the HTTP generation service: status, cancel and option forwarding through ServiceClient
+Run: python -m pytest -q tests
+"""
+
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import jobs
+from service import GenerationRequestHandler, ServiceClient
+
+
+@pytest.fixture
+def service(make_agent, monkeypatch):
+    """在随机端口上启动生成服务，所有任务都用逐字符输出 "abc" * 70 的假模型"""
+    llm_agent = make_agent(repeat=70)
+    monkeypatch.setattr(jobs, "get_agent", lambda model, temperature: llm_agent)
+    monkeypatch.setattr(jobs, "backup_model_for", lambda model: None)
+    monkeypatch.setattr(GenerationRequestHandler, "job_queue", jobs.JobQueue(workers=2))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), GenerationRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield ServiceClient(f"http://127.0.0.1:{server.server_address[1]}"), llm_agent.llm
+    server.shutdown()
+    server.server_close()
+
+
+def test_status_reports_progress_and_result(service):
+    client, llm = service
+    job = client.submit("abc", model="fake")
+    assert job['status'] in ("queued", "running")
+
+    while job['status'] in ("queued", "running"):
+        time.sleep(0.05)
+        job = client.status(job['id'])
+
+    assert job['status'] == "done"
+    assert job['text'] == "abc" * 70
+    assert job['cache_key']
+
+
+def test_cancel_over_http_stops_the_job(service):
+    client, llm = service
+    llm.token_delay = 0.02
+    job = client.submit("abc", model="fake")
+    while not client.status(job['id'])['chars']:
+        time.sleep(0.01)
+
+    client.cancel(job['id'])
+    start = time.monotonic()
+    while client.status(job['id'])['status'] != "cancelled":
+        assert time.monotonic() - start < 0.5
+        time.sleep(0.01)
+    assert not llm.finished
+
+
+def test_generate_forwards_enable_cache(service):
+    client, llm = service
+    first = client.generate("abc", model="fake", poll_interval=0.05)
+    cached = client.generate("abc", model="fake", poll_interval=0.05)
+    assert len(llm.calls) == 1
+    assert cached['text'] == first['text']
+
+    # “全部重新生成”：跳过缓存，模型被再次调用
+    regenerated = client.generate("abc", model="fake", enable_cache=False, poll_interval=0.05)
+    assert regenerated['enable_cache'] is False
+    assert len(llm.calls) == 2
+
+
+def test_generate_forwards_max_chars(service):
+    client, llm = service
+    llm.token_delay = 0.02
+    with pytest.raises(RuntimeError, match="cancelled"):
+        client.generate("abc", model="fake", max_chars=10, poll_interval=0.05)
+    assert not llm.finished
+
+
+def test_invalid_options_are_rejected(service):
+    client, llm = service
+    for payload in ({'prompt': "abc", 'enable_cache': "no"}, {'prompt': "abc", 'max_chars': "10"}, {}):
+        request = urllib.request.Request(client.base_url + "/jobs", data=json.dumps(payload).encode('utf-8'),
+                                         method="POST", headers={"Content-Type": "application/json"})
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(request, timeout=5)
+        assert error.value.code == 400
+
+
+def test_unknown_job_is_404(service):
+    client, llm = service
+    with pytest.raises(urllib.error.HTTPError) as error:
+        client.status("missing")
+    assert error.value.code == 404
@@ -0,0 +1,72 @@
+"""
+Usage: Tests for the server-side session store: snapshot interval, retention and purge
+Run: python -m pytest -q tests
+"""
+
+import pytest
+
+import session_store
+from session_store import SessionStore
+
+
+def draft(theme, references=1, final_text=""):
+    return {'theme': theme, 'references': ["参考"] * references, 'final_text': final_text}
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SessionStore(str(tmp_path / "session_store.db"))
+
+
+def test_saves_within_the_interval_update_the_current_snapshot(store):
+    assert store.save("sid", draft("第一版")) == 1
+    assert store.save("sid", draft("第二版", references=3, final_text="正文")) == 1
+
+    assert store.load("sid") == draft("第二版", references=3, final_text="正文")
+    snapshots = store.list_snapshots("sid")
+    assert [(s['version'], s['theme'], s['references'], s['final_chars']) for s in snapshots] == \
+        [(1, "第二版", 3, 2)]
+    assert store.load_snapshot("sid", 1) == draft("第二版", references=3, final_text="正文")
+
+
+def test_unchanged_draft_does_not_add_a_version(store, monkeypatch):
+    monkeypatch.setattr(session_store, "SNAPSHOT_INTERVAL", 0)
+    store.save("sid", draft("主题"))
+
+    assert store.save("sid", draft("主题")) == 1
+    assert len(store.list_snapshots("sid")) == 1
+
+
+def test_snapshots_after_the_interval_are_kept_up_to_the_limit(store, monkeypatch):
+    monkeypatch.setattr(session_store, "SNAPSHOT_INTERVAL", 0)
+    monkeypatch.setattr(session_store, "MAX_SNAPSHOTS", 3)
+    for i in range(5):
+        store.save("sid", draft(f"第{i}版"))
+    store.save("other", draft("其他会话"))
+
+    assert [s['version'] for s in store.list_snapshots("sid")] == [5, 4, 3]
+    assert store.load_snapshot("sid", 1) is None
+    assert store.load_snapshot("sid", 3) == draft("第2版")
+    assert [s['version'] for s in store.list_snapshots("other")] == [1]
+
+
+def test_legacy_snapshots_get_their_summary_backfilled(store):
+    store.save("sid", draft("旧版", references=2, final_text="abc"))
+    conn = store._connect()
+    conn.execute("UPDATE snapshots SET theme = NULL, reference_count = NULL, final_chars = NULL")
+
+    assert store.list_snapshots("sid")[0]['theme'] == "旧版"
+    row = conn.execute("SELECT theme, reference_count, final_chars FROM snapshots").fetchone()
+    assert tuple(row) == ("旧版", 2, 3)
+
+
+def test_purge_removes_stale_sessions_and_their_snapshots(store):
+    store.save("stale", draft("旧会话"))
+    store._connect().execute("UPDATE sessions SET updated_at = updated_at - 1000 WHERE session_id = 'stale'")
+    store.save("fresh", draft("新会话"))
+
+    assert store.purge(older_than=500) == 1
+
+    assert store.load("stale") is None
+    assert store.list_snapshots("stale") == []
+    assert store.load("fresh") == draft("新会话")
@@ -0,0 +1,77 @@
+"""
+Usage: Regression tests for request coalescing when the leading request is cancelled
+Run: python -m pytest -q tests
+"""
+
+import threading
+import time
+
+import pytest
+
+from throttle import LeaderCancelled, SingleFlight
+
+
+def test_single_flight_cancelled_leader_lets_follower_retry():
+    flight = SingleFlight()
+    future, leader = flight.begin("k")
+    assert leader
+    flight.finish("k", exception=GeneratorExit())
+    with pytest.raises(LeaderCancelled):
+        future.result()
+    assert flight.do("k", lambda: "ok") == "ok"
+
+
+def test_closed_stream_does_not_leak_generator_exit_to_followers(fake_agent):
+    llm_agent, chain = fake_agent
+    stream = llm_agent.stream_request("abc")
+    # 启动生成器，使它成为 in-flight 的执行方
+    reader = threading.Thread(target=lambda: next(stream))
+    reader.start()
+    while not chain.calls:
+        time.sleep(0.01)
+
+    results = {}
+
+    def follower():
+        try:
+            results['response'] = llm_agent.simple_request("abc")[1]
+        except BaseException as e:
+            results['error'] = e
+
+    thread = threading.Thread(target=follower)
+    thread.start()
+    time.sleep(0.1)
+    chain.gate.set()
+    reader.join(5)
+    stream.close()
+    thread.join(5)
+
+    assert not thread.is_alive()
+    assert 'error' not in results
+    assert results['response'] == "abc"
+
+
+def test_job_survives_cancelled_stream_for_same_prompt(fake_agent, monkeypatch):
+    import jobs
+
+    llm_agent, chain = fake_agent
+    monkeypatch.setattr(jobs, "get_agent", lambda model, temperature: llm_agent)
+    monkeypatch.setattr(jobs, "backup_model_for", lambda model: None)
+    queue = jobs.JobQueue(workers=1)
+
+    stream = llm_agent.stream_request("abc")
+    reader = threading.Thread(target=lambda: next(stream))
+    reader.start()
+    while not chain.calls:
+        time.sleep(0.01)
+    job = queue.submit("abc", model="fake")
+    time.sleep(0.1)
+    chain.gate.set()
+    reader.join(5)
+    stream.close()
+
+    assert queue.wait(job.id, timeout=5).status == jobs.DONE
+    assert job.result == "abc"
+    # 工作线程仍然可用
+    second = queue.submit("def", model="fake")
+    assert queue.wait(second.id, timeout=5).status == jobs.DONE
@@ -0,0 +1,69 @@
+"""
+Usage: Tests for the token budget planner and reference trimming
+Run: python -m pytest -q tests
+"""
+
+from retrieval import estimate_tokens
+from tokens import MAX_TOKENS, MIN_REFERENCE_TOKENS, count_tokens, plan_budget, trim_references
+
+# Ollama 模型使用估算分词，结果不依赖是否安装 tiktoken
+MODEL = "llama2:7b"
+
+
+def test_plan_budget_counts_prompt_and_sections():
+    sections = ["要点一" * 10, "要点二" * 20]
+
+    plan = plan_budget(MODEL, "提示词" * 100, sections)
+
+    assert plan['prompt_tokens'] == estimate_tokens("提示词" * 100)
+    assert plan['section_tokens'] == [30, 60]
+    assert plan['predicted_output'] == 90
+    assert plan['context_window'] == 4096
+    assert plan['input_budget'] == 4096 - 90
+    assert plan['prompt_fits'] and plan['output_fits']
+
+
+def test_plan_budget_flags_prompts_that_do_not_fit():
+    plan = plan_budget(MODEL, "字" * 3000)
+
+    # 没有分段时按整个提示词预测输出，输入和输出共用上下文窗口
+    assert plan['predicted_output'] == 3000
+    assert plan['input_budget'] == 4096 - 3000
+    assert not plan['prompt_fits']
+
+
+def test_plan_budget_uses_the_output_cap_of_api_models():
+    plan = plan_budget("gemini-2.5-flash", "字" * 10000)
+
+    assert plan['max_output'] == MAX_TOKENS
+    assert not plan['output_fits']
+    assert plan['input_budget'] == plan['context_window'] - MAX_TOKENS
+    assert plan['prompt_fits']
+
+
+def test_trim_references_shrinks_the_longest_first():
+    references = ["短" * 50, "中" * 300, "长" * 1000]
+
+    trimmed = trim_references(references, 800, MODEL)
+
+    assert trimmed[0] == references[0]
+    removed = sum(count_tokens(a, MODEL) for a in references) - \
+        sum(count_tokens(t.rstrip("……"), MODEL) for t in trimmed)
+    assert removed >= 800
+    assert trimmed[2].endswith("……") and trimmed[2].startswith("长")
+    # 截断水位统一：被裁剪的参考文本保留的长度相同
+    assert len(trimmed[1].rstrip("……")) == len(trimmed[2].rstrip("……"))
+
+
+def test_trim_references_keeps_a_minimum_per_reference():
+    trimmed = trim_references(["甲" * 500, "乙" * 500], 10000, MODEL)
+
+    assert [count_tokens(t.rstrip("……"), MODEL) for t in trimmed] == [MIN_REFERENCE_TOKENS] * 2
+
+
+def test_trim_references_without_overflow_is_a_copy():
+    references = ["一", "二"]
+    trimmed = trim_references(references, 0, MODEL)
+
+    assert trimmed == references and trimmed is not references
+    assert trim_references([], 10, MODEL) == []
@@ -0,0 +1,182 @@
+"""
+Usage: Request coalescing, per-provider rate limiting and retry with jittered backoff
+Export: SingleFlight, LeaderCancelled, TokenBucket, provider_of, get_limiter, set_limiter, call_with_retry, is_retryable
+Methods:
+    - SingleFlight.do: Run a function once per key, concurrent callers share the same in-flight result;
+      when the leader is cancelled (GeneratorExit, KeyboardInterrupt) waiting callers get LeaderCancelled and retry
+    - TokenBucket.acquire: Block until a request token is available
+    - call_with_retry: Retry 429 / 5xx / connection errors with exponential backoff and full jitter
+"""
+
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, Tuple
+
+# 每个服务商的限流配置：(每秒请求数, 突发容量)
+PROVIDER_LIMITS = {
+    "openai": (float(os.getenv("HUST_GEN_PAPER_OPENAI_RPS", 3)), 6),
+    "gemini": (float(os.getenv("HUST_GEN_PAPER_GEMINI_RPS", 1)), 2),
+    "ollama": (float(os.getenv("HUST_GEN_PAPER_OLLAMA_RPS", 2)), 2),
+}
+# 重试配置
+MAX_RETRIES = 4
+BASE_DELAY = 1.0
+MAX_DELAY = 30.0
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class LeaderCancelled(Exception):
+    """执行中的请求被取消（流被关闭、线程退出），等待它的调用方应当自己重新发起请求"""
+
+
+class SingleFlight:
+    """同一个键同时只有一个请求在执行，其余调用方等待同一个结果"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._futures: Dict[str, Future] = {}
+
+    def begin(self, key: str) -> Tuple[Future, bool]:
+        """返回 (future, 是否由当前调用方负责执行)"""
+        with self._lock:
+            future = self._futures.get(key)
+            if future is not None:
+                return future, False
+            future = Future()
+            self._futures[key] = future
+            return future, True
+
+    def finish(self, key: str, result=None, exception: BaseException = None):
+        with self._lock:
+            future = self._futures.pop(key, None)
+        if future is None:
+            return
+        if exception is not None and not isinstance(exception, Exception):
+            # GeneratorExit 等只属于执行方自己，不能抛给等待的调用方
+            exception = LeaderCancelled(f"in-flight request {key} was cancelled")
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+
+    def do(self, key: str, fn: Callable):
+        while True:
+            future, leader = self.begin(key)
+            if leader:
+                break
+            try:
+                return future.result()
+            except LeaderCancelled:
+                # 执行方被取消，由当前调用方重新执行
+                continue
+        try:
+            result = fn()
+        except BaseException as e:
+            self.finish(key, exception=e)
+            raise
+        self.finish(key, result=result)
+        return result
+
+    def in_flight(self, key: str) -> bool:
+        with self._lock:
+            return key in self._futures
+
+
+class TokenBucket:
+    """令牌桶限流，rate 为每秒补充的令牌数，capacity 为允许的突发请求数"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def provider_of(model: str) -> str:
+    """根据模型名判断服务商，和 create_chat_model 的分支保持一致"""
+    if 'llama2' in model or 'qwq' in model:
+        return "ollama"
+    if 'gemini' in model:
+        return "gemini"
+    return "openai"
+
+
+_limiters: Dict[str, TokenBucket] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(provider: str) -> TokenBucket:
+    with _limiters_lock:
+        if provider not in _limiters:
+            rate, capacity = PROVIDER_LIMITS.get(provider, PROVIDER_LIMITS["openai"])
+            _limiters[provider] = TokenBucket(rate, capacity)
+        return _limiters[provider]
+
+
+def set_limiter(provider: str, limiter: TokenBucket):
+    """替换某个服务商的限流器"""
+    with _limiters_lock:
+        _limiters[provider] = limiter
+
+
+def _status_code(error: BaseException):
+    status = getattr(error, 'status_code', None) or getattr(error, 'code', None)
+    response = getattr(error, 'response', None)
+    if status is None and response is not None:
+        status = getattr(response, 'status_code', None)
+    return status if isinstance(status, int) else None
+
+
+def is_retryable(error: BaseException) -> bool:
+    """429、5xx、超时和连接错误可以重试，其余错误直接抛出"""
+    status = _status_code(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    name = type(error).__name__
+    return any(word in name for word in ("RateLimit", "Timeout", "Connection", "ServiceUnavailable",
+                                         "InternalServerError", "ResourceExhausted"))
+
+
+def call_with_retry(fn: Callable, limiter: TokenBucket = None, max_retries: int = MAX_RETRIES,
+                    base_delay: float = BASE_DELAY, max_delay: float = MAX_DELAY, on_wait: Callable = None):
+    """
+    Usage: Call fn under the rate limiter, retrying retryable errors with exponential backoff and full jitter
+    :param fn: callable without arguments
+    :param limiter: TokenBucket, acquired before every attempt
+    :param on_wait: callable(seconds), receives the time spent waiting for tokens and backoff
+    :return: result of fn
+    """
+    attempt = 0
+    while True:
+        if limiter is not None:
+            start = time.perf_counter()
+            limiter.acquire()
+            if on_wait is not None:
+                on_wait(time.perf_counter() - start)
+        try:
+            return fn()
+        except Exception as e:
+            if attempt >= max_retries or not is_retryable(e):
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+            print(f"LLM request failed ({type(e).__name__}: {e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+            if on_wait is not None:
+                on_wait(delay)
+            attempt += 1
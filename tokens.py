@@ -0,0 +1,139 @@
+"""
+Usage: Token accounting and prompt budget planning before dispatch
+Export: MAX_TOKENS, get_tokenizer, count_tokens, get_model_limits, plan_budget, trim_references
+Methods:
+    - count_tokens: Count tokens with a cached tokenizer per model (tiktoken when available, estimate otherwise)
+    - plan_budget: Per-section token counts and whether prompt and predicted output fit the model limits
+    - trim_references: Shrink the longest references until the prompt fits the budget
+"""
+
+from functools import lru_cache
+from typing import Callable, Dict, List
+
+from retrieval import estimate_tokens
+
+# OpenAI 兼容模型的最大输出 token 数（agent 创建客户端时使用）
+MAX_TOKENS = 8192
+# 各模型的上下文窗口（token），未列出的模型按 DEFAULT_CONTEXT_WINDOW 处理
+CONTEXT_WINDOWS = {
+    "gpt-4o": 128000,
+    "gpt-4-1106-preview": 128000,
+    "deepseek-chat": 64000,
+    "gpt-4o-all": 128000,
+    "gpt-4.1": 1047576,
+    "claude-3-7-sonnet-20250219": 200000,
+    "claude-3-sonnet-20240229": 200000,
+    "claude-3-7-sonnet-latest": 200000,
+    "claude-3-5-sonnet-20241022": 200000,
+    "claude-3-5-sonnet-20240620": 200000,
+    "gemini-2.0-pro": 2097152,
+    "gemini-2.0-flash": 1048576,
+    "gemini-2.5-pro": 1048576,
+    "gemini-2.5-flash": 1048576,
+    "llama2:7b": 4096,
+    "llama2:70b": 4096,
+    "llama2:13b": 4096,
+    "llama2-chinese:13b": 4096,
+    "qwq:latest-fixed": 32768,
+    "baidu": 8000,
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+# 改写任务的输出长度大致与原始文本相当
+OUTPUT_RATIO = 1.0
+# 裁剪时每段参考文本至少保留的 token 数
+MIN_REFERENCE_TOKENS = 100
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer(model: str) -> Callable[[str], int]:
+    """每个模型只创建一次分词器，返回计数函数"""
+    if 'gpt' in model or 'deepseek' in model or 'claude' in model:
+        try:
+            import tiktoken
+            # 非 OpenAI 模型没有公开的 tiktoken 编码，用 cl100k_base 近似
+            encoding_name = "o200k_base" if model.startswith(("gpt-4o", "gpt-4.1")) else "cl100k_base"
+            encoding = tiktoken.get_encoding(encoding_name)
+            return lambda text: len(encoding.encode(text, disallowed_special=()))
+        except ImportError:
+            pass
+    return estimate_tokens
+
+
+def count_tokens(text: str, model: str) -> int:
+    return get_tokenizer(model)(text) if text else 0
+
+
+def get_model_limits(model: str) -> Dict:
+    """返回 (上下文窗口, 最大输出) token 数"""
+    context_window = CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW)
+    if 'gpt' in model or 'deepseek' in model or 'claude' in model or 'gemini' in model:
+        max_output = MAX_TOKENS
+    else:
+        # Ollama 模型的输出只受上下文窗口限制
+        max_output = context_window
+    return {'context_window': context_window, 'max_output': max_output}
+
+
+def plan_budget(model: str, prompt: str, sections: List[str] = None) -> Dict:
+    """
+    Usage: Plan the token budget of a prompt before sending it
+    :param model: str, actual model name from model_options
+    :param prompt: str, the full prompt that will be sent
+    :param sections: list of str, per-section texts (outline line + reference) to count separately
+    :return: dict with prompt_tokens, section_tokens, predicted_output, limits and fit flags
+    """
+    limits = get_model_limits(model)
+    section_tokens = [count_tokens(section, model) for section in (sections or [])]
+    prompt_tokens = count_tokens(prompt, model)
+    predicted_output = int((sum(section_tokens) if sections else prompt_tokens) * OUTPUT_RATIO)
+    input_budget = limits['context_window'] - min(limits['max_output'], predicted_output)
+    return {
+        'prompt_tokens': prompt_tokens,
+        'section_tokens': section_tokens,
+        'predicted_output': predicted_output,
+        'context_window': limits['context_window'],
+        'max_output': limits['max_output'],
+        'input_budget': input_budget,
+        'prompt_fits': prompt_tokens <= input_budget,
+        'output_fits': predicted_output <= limits['max_output'],
+    }
+
+
+def _truncate(text: str, max_tokens: int, model: str) -> str:
+    """二分查找不超过 max_tokens 的最长前缀"""
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if count_tokens(text[:mid], model) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low]
+
+
+def trim_references(references: List[str], overflow: int, model: str) -> List[str]:
+    """
+    Usage: Shrink the longest references first until overflow tokens have been removed
+    :param references: list of str, reference texts per outline point
+    :param overflow: int, number of tokens that must be removed
+    :param model: str, model whose tokenizer is used
+    :return: list of str, trimmed references (same length and order)
+    """
+    if overflow <= 0:
+        return list(references)
+    counts = [count_tokens(reference, model) for reference in references]
+    if not counts:
+        return []
+    # 找到统一的截断水位：所有超过水位的参考文本都削到水位，削掉的总量刚好覆盖 overflow
+    low, high = MIN_REFERENCE_TOKENS, max(counts)
+    while low < high:
+        level = (low + high + 1) // 2
+        if sum(max(0, count - level) for count in counts) >= overflow:
+            low = level
+        else:
+            high = level - 1
+    targets = [min(count, low) for count in counts]
+    return [reference if target >= count else _truncate(reference, target, model) + "……"
+            for reference, count, target in zip(references, counts, targets)]